@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Long-lived dashboard aggregates, updated as events are logged
+"""
+
+import os
+import json
+import itertools
+import threading
+from collections import deque
+from logs import log
+
+RECENT_LIMIT = 50  # Rows kept per table on the dashboard
+
+# Shared by all instances, so a version is never reused, even across reset()
+_versions = itertools.count(1)
+
+class DashboardAggregates:
+    """Counters behind /dashboard, maintained incrementally.
+
+    Every logged event calls add(); geolocation arrives later through
+    apply_geo(). The state is saved with the event-store watermark it
+    covers, so after a restart only events past that watermark are read.
+    """
+
+    def __init__(self, recent_limit=RECENT_LIMIT):
+        self.lock = threading.Lock()
+        self.recent_limit = recent_limit
+        self.reset()
+
+    def reset(self):
+        self.totals = {'click': 0, 'open': 0}
+        self.unique = {'click': set(), 'open': set()}
+        self.hourly = {'click': {}, 'open': {}}
+        self.countries = {}
+        self.isps = {}
+        self.recent = {'click': deque(maxlen=self.recent_limit), 'open': deque(maxlen=self.recent_limit)}
+        self.pending = {}  # event_id -> event still waiting for geolocation
+        self.watermark = None
+        self.versions = {'click': next(_versions), 'open': next(_versions)}  # Bumped on every change
+
+    def add(self, event, pending_geo=False):
+        """Count a new click/open; pending_geo defers country/ISP until apply_geo()"""
+        event_type = event.get('event_type')
+        if event_type not in self.totals:
+            return
+        with self.lock:
+            self.totals[event_type] += 1
+            self.unique[event_type].add(event.get('tracking_id'))
+            timestamp = event.get('timestamp', '')
+            hour = timestamp[11:13] if len(timestamp) > 13 else '00'
+            hourly = self.hourly[event_type]
+            hourly[hour] = hourly.get(hour, 0) + 1
+            self.recent[event_type].append(event)
+            self.versions[event_type] = next(_versions)
+            if pending_geo and 'country' not in event and event.get('event_id'):
+                self.pending[event['event_id']] = event
+            else:
+                self._count_geo(event)
+
+    def apply_geo(self, event_id, geo):
+        """Fold in geolocation for an event added with pending_geo"""
+        with self.lock:
+            event = self.pending.pop(event_id, None)
+            if event is None:
+                return
+            for field in ('country', 'city', 'isp'):
+                event[field] = geo.get(field)
+            self._count_geo(event)
+            self.versions[event['event_type']] = next(_versions)
+
+    def _count_geo(self, event):
+        country = event.get('country') or 'Unknown'
+        self.countries[country] = self.countries.get(country, 0) + 1
+        isp = (event.get('isp') or 'Unknown')[:30]
+        self.isps[isp] = self.isps.get(isp, 0) + 1
+
+    def chart_data(self):
+        """The chartData object rendered into the dashboard"""
+        with self.lock:
+            return {
+                "clicks": self.totals['click'],
+                "opens": self.totals['open'],
+                "countries": dict(self.countries),
+                "isps": dict(sorted(self.isps.items(), key=lambda x: x[1], reverse=True)[:10]),
+                "hourly_clicks": dict(self.hourly['click']),
+                "hourly_opens": dict(self.hourly['open'])
+            }
+
+    def version(self, event_type):
+        """Changes whenever anything shown for this event type (counts, rows, geolocation) does"""
+        return self.versions[event_type]
+
+    def unique_counts(self):
+        with self.lock:
+            return len(self.unique['click']), len(self.unique['open'])
+
+    def tracking_ids(self):
+        """Every tracking ID counted so far"""
+        with self.lock:
+            return self.unique['click'] | self.unique['open']
+
+    def latest(self, event_type, limit=RECENT_LIMIT):
+        """Newest events of a type, newest first"""
+        with self.lock:
+            return list(reversed(self.recent[event_type]))[:limit]
+
+    def catch_up(self, store, until=None):
+        """Apply everything the store holds past our watermark, or only as far as `until`.
+
+        `until` is a single store's (integer) watermark; saved counters
+        already past it are rebuilt from the start.
+        """
+        if self.watermark is not None and not store.has_watermark(self.watermark):
+            log.warning('AGG', 'Event store was truncated, rebuilding dashboard aggregates')
+            with self.lock:
+                self.reset()
+        elif until is not None and self.watermark is not None and self.watermark > until:
+            with self.lock:
+                self.reset()
+        count = 0
+        for event, watermark in store.tail(self.watermark):
+            if until is not None and watermark > until:
+                break
+            if event.get('event_type') == 'geo':
+                self.apply_geo(event.get('event_id'), event)
+            else:
+                self.add(event, pending_geo=True)
+                count += 1
+            self.watermark = watermark
+        # Nothing is enriching events left over from a previous run
+        with self.lock:
+            for event in self.pending.values():
+                self._count_geo(event)
+                self.versions[event['event_type']] = next(_versions)
+            self.pending.clear()
+        return count
+
+    def save(self, path, backend):
+        """Persist counters plus the watermark they cover"""
+        with self.lock:
+            state = {
+                'backend': backend,
+                'watermark': self.watermark,
+                'totals': self.totals,
+                'unique': {key: sorted(values) for key, values in self.unique.items()},
+                'hourly': self.hourly,
+                'countries': self.countries,
+                'isps': self.isps,
+                'recent': {key: list(values) for key, values in self.recent.items()},
+                'pending': list(self.pending.values())
+            }
+        try:
+            tmp_path = f"{path}.{os.getpid()}.tmp"  # Unique per process: several workers may save at once
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            log.error('AGG', 'Error saving dashboard state', path=path, error=e)
+
+    def load(self, path, backend):
+        """Restore saved counters; returns False if there was nothing usable"""
+        try:
+            if not os.path.exists(path):
+                return False
+            with open(path, 'r') as f:
+                state = json.load(f)
+            if state.get('backend') != backend:
+                return False
+            with self.lock:
+                self.reset()
+                self.watermark = state['watermark']
+                self.totals.update(state['totals'])
+                for key, values in state['unique'].items():
+                    self.unique[key] = set(values)
+                self.hourly.update(state['hourly'])
+                self.countries = state['countries']
+                self.isps = state['isps']
+                for key, values in state['recent'].items():
+                    self.recent[key].extend(values)
+                for event in state.get('pending', []):
+                    self.pending[event['event_id']] = event
+                self.versions = {'click': next(_versions), 'open': next(_versions)}
+            return True
+        except Exception as e:
+            log.error('AGG', 'Error loading dashboard state', path=path, error=e)
+            with self.lock:
+                self.reset()
+            return False
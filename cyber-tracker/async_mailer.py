@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Asyncio SMTP backend: many concurrent SMTP sessions driven from one event-loop thread
+
+The client is our own rather than aiosmtplib's: aiosmtplib doesn't pipeline
+MAIL/RCPT/DATA (RFC 2920), and the send path stays stdlib-only.
+"""
+
+import re
+import ssl
+import copy
+import base64
+import asyncio
+import smtplib
+import threading
+from mailer import (SMTP_POOL_SIZE, SMTP_TIMEOUT, SMTP_MAX_MESSAGES, SMTP_IDLE_CHECK, SMTP_RETRIES,
+                    SMTP_RETRY_BACKOFF, classify_error)
+
+LEADING_DOT = re.compile(rb'^\.', re.MULTILINE)
+
+# One event loop for every asyncio pool in the process, on its own daemon thread next to Flask's
+_loop = None
+_loop_lock = threading.Lock()
+
+def event_loop():
+    """The shared sending loop, started on first use"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="smtp-asyncio", daemon=True).start()
+        return _loop
+
+def message_bytes(msg):
+    """Wire form of a message the way smtplib.send_message sends it: CRLF lines, no Bcc, dots stuffed"""
+    if msg['Bcc'] is not None or msg['Resent-Bcc'] is not None:
+        msg = copy.copy(msg)
+        del msg['Bcc']
+        del msg['Resent-Bcc']
+    data = msg.as_bytes(policy=msg.policy.clone(linesep='\r\n'))
+    if not data.endswith(b'\r\n'):
+        data += b'\r\n'
+    return LEADING_DOT.sub(b'..', data)
+
+class AsyncSMTPConnection:
+    """One SMTP session over asyncio streams (EHLO, STARTTLS, AUTH PLAIN/LOGIN, MAIL/RCPT/DATA).
+
+    Failures raise the same smtplib exceptions smtplib.SMTP would, so
+    classify_error() treats both backends alike.
+    """
+
+    def __init__(self, host, port, timeout=SMTP_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+        self.features = {}
+        self.messages = 0
+        self.last_used = 0.0
+
+    async def _reply(self):
+        lines = []
+        while True:
+            line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+            if not line:
+                raise smtplib.SMTPServerDisconnected(f"Connection to {self.host} closed")
+            lines.append(line[4:].strip())
+            if line[3:4] != b'-':
+                try:
+                    code = int(line[:3])
+                except ValueError:
+                    raise smtplib.SMTPServerDisconnected(f"Bad SMTP reply from {self.host}: {line!r}")
+                return code, b'\n'.join(lines)
+
+    async def command(self, line):
+        self.writer.write(line.encode('ascii') + b'\r\n')
+        return await self._reply()
+
+    async def _ehlo(self):
+        code, message = await self.command('EHLO localhost')
+        if code != 250:
+            raise smtplib.SMTPHeloError(code, message)
+        self.features = {}
+        for line in message.decode('latin-1').split('\n')[1:]:
+            keyword, _, params = line.partition(' ')
+            self.features[keyword.lower()] = params
+
+    async def connect(self, ssl_context, user=None, password=None, starttls=True, use_ssl=False):
+        """ssl_context is a callable, so the context is only built when TLS is actually used"""
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=ssl_context() if use_ssl else None), self.timeout)
+        code, message = await self._reply()
+        if code != 220:
+            raise smtplib.SMTPConnectError(code, message)
+        await self._ehlo()
+        if starttls and not use_ssl:
+            if 'starttls' not in self.features:
+                raise smtplib.SMTPNotSupportedError(f"{self.host} does not offer STARTTLS")
+            code, message = await self.command('STARTTLS')
+            if code != 220:
+                raise smtplib.SMTPResponseException(code, message)
+            await asyncio.wait_for(self.writer.start_tls(ssl_context(), server_hostname=self.host), self.timeout)
+            await self._ehlo()
+        if user:
+            await self._login(user, password or '')
+
+    async def _login(self, user, password):
+        mechanisms = self.features.get('auth', '').upper().split()
+        if 'PLAIN' in mechanisms:
+            token = base64.b64encode(f"\0{user}\0{password}".encode()).decode('ascii')
+            code, message = await self.command(f'AUTH PLAIN {token}')
+        elif 'LOGIN' in mechanisms:
+            code, message = await self.command('AUTH LOGIN')
+            for value in (user, password):
+                if code != 334:
+                    break
+                code, message = await self.command(base64.b64encode(value.encode()).decode('ascii'))
+        else:
+            raise smtplib.SMTPNotSupportedError(f"{self.host} offers no supported AUTH mechanism")
+        if code not in (235, 503):  # 503: already authenticated
+            raise smtplib.SMTPAuthenticationError(code, message)
+
+    async def send(self, data, from_addr, to_addrs):
+        """Send pre-encoded message bytes; returns refused recipients like smtplib.sendmail.
+
+        If the server offers PIPELINING, MAIL, RCPT and DATA go out in one
+        write (RFC 2920), saving two round trips per message.
+        """
+        commands = [f'MAIL FROM:<{from_addr}>'] + [f'RCPT TO:<{address}>' for address in to_addrs] + ['DATA']
+        if 'pipelining' in self.features:
+            self.writer.write(''.join(command + '\r\n' for command in commands).encode('ascii'))
+            replies = [await self._reply() for _ in commands]
+        else:
+            replies = []
+            for command in commands:
+                replies.append(await self.command(command))
+                if replies[-1][0] != 250 and command.startswith('MAIL'):
+                    break
+        code, message = replies[0]
+        refused = {address: reply for address, reply in zip(to_addrs, replies[1:-1]) if reply[0] not in (250, 251)}
+        data_code, data_message = replies[-1] if len(replies) == len(commands) else (None, None)
+        if code != 250 or len(refused) == len(to_addrs) or data_code != 354:
+            if data_code == 354:
+                # Pipelined DATA was accepted after all; an empty message is the only way out
+                await self.command('.')
+            await self._reset()
+            if code != 250:
+                raise smtplib.SMTPSenderRefused(code, message, from_addr)
+            if len(refused) == len(to_addrs):
+                raise smtplib.SMTPRecipientsRefused(refused)
+            raise smtplib.SMTPDataError(data_code, data_message)
+        self.writer.write(data + b'.\r\n')
+        code, message = await self._reply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, message)
+        return refused
+
+    async def _reset(self):
+        try:
+            await self.command('RSET')
+        except Exception:
+            pass
+
+    async def noop(self):
+        return (await self.command('NOOP'))[0]
+
+    async def close(self):
+        if self.writer is None:
+            return
+        try:
+            await asyncio.wait_for(self.command('QUIT'), 5)
+        except Exception:
+            pass
+        self.writer.close()
+        try:
+            await asyncio.wait_for(self.writer.wait_closed(), 5)
+        except Exception:
+            pass
+
+class AsyncSMTPPool:
+    """Up to `size` concurrent SMTP sessions to one server/account, all on the shared loop thread.
+
+    Drop-in for SMTPConnectionPool: send(msg, from_addr, to_addrs) blocks
+    the calling thread until the message is accepted, so send_with_retry,
+    BulkSender and the send queue work unchanged. submit() instead returns
+    a future right away, which lets a single thread keep all `size`
+    sessions busy.
+    """
+
+    backend = 'asyncio'
+
+    def __init__(self, host, port=587, user=None, password=None, size=SMTP_POOL_SIZE, starttls=True,
+                 use_ssl=False, timeout=SMTP_TIMEOUT, max_messages=SMTP_MAX_MESSAGES):
+        self.host = host
+        self.port = int(port)
+        self.user = user
+        self.password = password
+        self.size = size
+        self.starttls = starttls
+        self.use_ssl = use_ssl or self.port == 465
+        self.timeout = timeout
+        self.max_messages = max_messages
+        self.loop = event_loop()
+        # Only touched from the loop thread
+        self.idle = []
+        self.slots = asyncio.Semaphore(size)
+        self.connections_opened = 0
+        self.messages_sent = 0
+        self.discarded = 0
+        self._ssl_context = None
+
+    def ssl_context(self):
+        if self._ssl_context is None:
+            self._ssl_context = ssl.create_default_context()
+        return self._ssl_context
+
+    async def _acquire(self):
+        await self.slots.acquire()
+        try:
+            while self.idle:
+                conn = self.idle.pop()
+                if self.loop.time() - conn.last_used < SMTP_IDLE_CHECK:
+                    return conn
+                try:
+                    if await conn.noop() == 250:
+                        return conn
+                except Exception:
+                    pass
+                await conn.close()
+            conn = AsyncSMTPConnection(self.host, self.port, self.timeout)
+            try:
+                await conn.connect(self.ssl_context, self.user, self.password, self.starttls, self.use_ssl)
+            except BaseException:
+                await conn.close()
+                raise
+            self.connections_opened += 1
+            return conn
+        except BaseException:
+            self.slots.release()
+            raise
+
+    async def _release(self, conn, healthy=True):
+        try:
+            if healthy and conn.messages < self.max_messages:
+                conn.last_used = self.loop.time()
+                self.idle.append(conn)
+            else:
+                if not healthy:
+                    self.discarded += 1
+                await conn.close()
+        finally:
+            self.slots.release()
+
+    async def send_async(self, data, from_addr, to_addrs):
+        """Send one message (bytes from message_bytes) on a pooled session, no retries; runs on the loop"""
+        conn = await self._acquire()
+        try:
+            refused = await conn.send(data, from_addr, to_addrs)
+        except Exception as e:
+            transient, _ = classify_error(e)
+            # Permanent rejections leave the session usable; anything transient gets a fresh session
+            await self._release(conn, healthy=not transient)
+            raise
+        conn.messages += 1
+        self.messages_sent += 1
+        await self._release(conn)
+        return refused
+
+    async def send_with_retry_async(self, data, from_addr, to_addr, retries=SMTP_RETRIES, backoff=SMTP_RETRY_BACKOFF):
+        """mailer.send_with_retry without blocking a thread between attempts"""
+        attempts = 0
+        while True:
+            attempts += 1
+            try:
+                await self.send_async(data, from_addr, [to_addr])
+                return {'status': 'sent', 'attempts': attempts}
+            except Exception as e:
+                transient, code = classify_error(e)
+                if not transient or attempts > retries:
+                    return {'status': 'failed', 'attempts': attempts, 'code': code, 'error': str(e)}
+                await asyncio.sleep(backoff * (2 ** (attempts - 1)))
+
+    # Messages are flattened by the calling thread, so the loop thread only does I/O
+
+    def send(self, msg, from_addr, to_addrs):
+        """Blocking send from any thread other than the loop's"""
+        data = message_bytes(msg)
+        return asyncio.run_coroutine_threadsafe(self.send_async(data, from_addr, to_addrs), self.loop).result()
+
+    def submit(self, msg, from_addr, to_addr, retries=SMTP_RETRIES, backoff=SMTP_RETRY_BACKOFF):
+        """Queue a send with retries; returns a concurrent.futures.Future of the status dict"""
+        data = message_bytes(msg)
+        return asyncio.run_coroutine_threadsafe(
+            self.send_with_retry_async(data, from_addr, to_addr, retries, backoff), self.loop)
+
+    async def _close_idle(self):
+        while self.idle:
+            await self.idle.pop().close()
+
+    def close(self):
+        if self.loop.is_running():
+            try:
+                asyncio.run_coroutine_threadsafe(self._close_idle(), self.loop).result(10)
+            except Exception:
+                pass
+
+    def stats(self):
+        return {
+            'host': self.host,
+            'port': self.port,
+            'backend': self.backend,
+            'size': self.size,
+            'idle': len(self.idle),
+            'connections_opened': self.connections_opened,
+            'connections_discarded': self.discarded,
+            'messages_sent': self.messages_sent
+        }
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: tracking ID -> recipient resolution
+
+Compares the old dashboard lookup, name_map.get(tid) or
+name_map.get(tid.split('_')[0]), with the PrefixIndex used by
+RecipientDirectory. Not a test; run it directly:
+
+    python3 bench_name_lookup.py [events] [recipients]
+"""
+
+import sys
+import time
+import random
+import tracemalloc
+from recipients import PrefixIndex
+
+def make_recipients(count, rng):
+    """Recipients with both ID styles the tracker produces"""
+    first_names = ['patrick', 'paddy', 'tim', 'john', 'jane', 'bob', 'alice', 'mary']
+    recipients = []
+    for i in range(count):
+        name = f"{rng.choice(first_names)} {rng.choice(['corr', 'smith', 'doe', 'wilson'])}"
+        if i % 2:
+            # generate_email_api style: first_last_HHMMSS, tracking ID adds a hex suffix
+            employee_id = f"{name.replace(' ', '_')}_{100000 + i}"
+        else:
+            # generate_links.py style: emp001, tracking ID emp001_<hex>
+            employee_id = f"emp{i:05d}"
+        tracking_id = f"{employee_id}_{rng.getrandbits(32):08x}"
+        recipients.append({'name': name.title(), 'employee_id': employee_id, 'tracking_id': tracking_id})
+    return recipients
+
+def make_events(recipients, count, rng):
+    """Click IDs, pixel IDs, re-issued links and IDs nobody knows about.
+
+    Returns (tracking IDs, expected names)."""
+    events = []
+    expected = []
+    for i in range(count):
+        recipient = rng.choice(recipients)
+        kind = i % 10
+        if kind < 5:
+            events.append(recipient['tracking_id'])
+        elif kind < 8:
+            events.append(recipient['employee_id'])
+        elif kind < 9:
+            # Link re-sent with a fresh suffix that isn't in the CSV
+            events.append(f"{recipient['employee_id']}_{rng.getrandbits(32):08x}")
+        else:
+            events.append(f"unknown_{i}")
+            expected.append(None)
+            continue
+        expected.append(recipient['name'])
+    return events, expected
+
+def old_lookup(recipients):
+    # The name map the dashboard used to build per request
+    name_map = {}
+    for recipient in recipients:
+        name_map[recipient['tracking_id']] = recipient['name']
+        name_map[recipient['tracking_id'].split('_')[0]] = recipient['name']
+        name_map[recipient['employee_id']] = recipient['name']
+    def resolve(tid):
+        return name_map.get(tid) or name_map.get(tid.split('_')[0])
+    return resolve
+
+def new_lookup(recipients):
+    index = PrefixIndex()
+    for recipient in recipients:
+        index.insert(recipient['employee_id'], recipient['name'])
+        index.insert(recipient['tracking_id'], recipient['name'])
+    return index.longest_match
+
+def run(label, resolve, events, expected):
+    start = time.perf_counter()
+    results = [resolve(tid) for tid in events]
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    for tid in events:
+        resolve(tid)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    correct = sum(1 for got, want in zip(results, expected) if got == want)
+    print(f"  {label:<14} {elapsed * 1000:8.1f} ms  {elapsed / len(events) * 1e9:7.0f} ns/event  "
+          f"peak alloc {peak / 1024:7.1f} KB  correct {correct}/{len(events)}")
+
+if __name__ == '__main__':
+    event_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    recipient_count = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    rng = random.Random(42)
+    recipients = make_recipients(recipient_count, rng)
+    events, expected = make_events(recipients, event_count, rng)
+
+    print(f"[BENCH] {event_count} events, {recipient_count} recipients")
+    run("split + dict", old_lookup(recipients), events, expected)
+    run("prefix index", new_lookup(recipients), events, expected)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Benchmark: serving the open-tracking pixel with send_file() vs the prebuilt response
+
+Both responders are mounted on a bare Flask app (no event logging, which
+costs the same either way) and measured two ways:
+
+  wsgi  the app called in-process, one request at a time: the responder's own cost
+  http  the app on a local threaded server in a child process, driven by
+        `concurrency` keep-alive client threads
+
+and reports requests/second with p50 / p99 latency. Not a test; run it directly:
+
+    python3 bench_pixel.py [requests] [--concurrency 8]
+"""
+
+import io
+import time
+import socket
+import argparse
+import threading
+import http.client
+import multiprocessing
+from flask import Flask, send_file
+from werkzeug.serving import make_server, WSGIRequestHandler
+from werkzeug.test import EnvironBuilder
+from pixel import PIXEL_GIF, pixel_response
+
+ROUTES = (('send_file', '/pixel-send-file'), ('prebuilt', '/pixel'))
+
+def make_app():
+    app = Flask(__name__)
+
+    @app.route('/pixel-send-file')
+    def pixel_send_file():
+        # tracker.py before the prebuilt response
+        return send_file(io.BytesIO(PIXEL_GIF), mimetype='image/gif', as_attachment=False)
+
+    @app.route('/pixel')
+    def pixel():
+        return pixel_response()
+
+    return app
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+def report(mode, label, latencies, elapsed):
+    latencies.sort()
+    print(f"  {mode:<4} {label:<10} {len(latencies) / elapsed:9.0f} req/s  "
+          f"p50 {percentile(latencies, 0.50) * 1e6:7.0f} us  p99 {percentile(latencies, 0.99) * 1e6:7.0f} us")
+
+def bench_wsgi(app, path, requests):
+    environ = EnvironBuilder(path=path, query_string='id=bench').get_environ()
+    body_ok = []
+
+    def start_response(status, headers):
+        body_ok.append(status.startswith('200'))
+
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(requests):
+        began = time.perf_counter()
+        body = b''.join(app(dict(environ), start_response))
+        latencies.append(time.perf_counter() - began)
+    elapsed = time.perf_counter() - start
+    assert all(body_ok) and body == PIXEL_GIF
+    return latencies, elapsed
+
+class QuietHandler(WSGIRequestHandler):
+    # HTTP/1.1 so the client threads can keep their connections open
+    protocol_version = "HTTP/1.1"
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+def serve(port, ready):
+    server = make_server('127.0.0.1', port, make_app(), threaded=True, request_handler=QuietHandler)
+    ready.set()
+    server.serve_forever()
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def bench_http(port, path, requests, concurrency):
+    latencies = []
+    lock = threading.Lock()
+    per_client = requests // concurrency
+
+    def client():
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        mine = []
+        for _ in range(per_client):
+            began = time.perf_counter()
+            conn.request('GET', f"{path}?id=bench")
+            response = conn.getresponse()
+            body = response.read()
+            mine.append(time.perf_counter() - began)
+            assert response.status == 200 and body == PIXEL_GIF
+        conn.close()
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, time.perf_counter() - start
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare send_file() with the prebuilt pixel response")
+    parser.add_argument('requests', nargs='?', type=int, default=20000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+
+    print(f"[BENCH] {args.requests} pixel requests per responder, http concurrency {args.concurrency}")
+    app = make_app()
+    for label, path in ROUTES:
+        bench_wsgi(app, path, 500)  # warm-up
+        report('wsgi', label, *bench_wsgi(app, path, args.requests))
+
+    port = free_port()
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(target=serve, args=(port, ready), daemon=True)
+    server.start()
+    ready.wait(10)
+    try:
+        for label, path in ROUTES:
+            bench_http(port, path, 200 * args.concurrency, args.concurrency)  # warm-up
+            report('http', label, *bench_http(port, path, args.requests, args.concurrency))
+    finally:
+        server.terminate()
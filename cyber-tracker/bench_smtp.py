@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Benchmark: bulk-send throughput of the smtplib and asyncio SMTP backends
+
+Sends the same message to `messages` recipients through each backend at
+concurrency 1, 8 and 64 against a local SMTP sink, and reports
+messages/second. The sink runs in a child process and waits `latency`
+seconds before accepting each message, to stand in for a remote server.
+Not a test; run it directly:
+
+    python3 bench_smtp.py [messages] [latency]
+    python3 bench_smtp.py 500 0.02 --host 127.0.0.1 --port 8025   # an external sink instead
+"""
+
+import time
+import socket
+import asyncio
+import argparse
+import multiprocessing
+from mailer import SMTP_BACKENDS, pool_class, build_message, BulkSender
+
+CONCURRENCY = (1, 8, 64)
+
+async def sink_session(reader, writer, latency):
+    writer.write(b'220 bench sink\r\n')
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        verb = line[:4].upper()
+        if verb in (b'EHLO', b'HELO'):
+            writer.write(b'250-bench sink\r\n250-PIPELINING\r\n250 8BITMIME\r\n')
+        elif verb == b'DATA':
+            writer.write(b'354 End data with <CR><LF>.<CR><LF>\r\n')
+            await writer.drain()
+            await reader.readuntil(b'\r\n.\r\n')
+            await asyncio.sleep(latency)
+            writer.write(b'250 OK queued\r\n')
+        elif verb == b'QUIT':
+            writer.write(b'221 Bye\r\n')
+            break
+        else:
+            writer.write(b'250 OK\r\n')
+        await writer.drain()
+    writer.close()
+
+def run_sink(port, latency, ready):
+    """Minimal SMTP server: accepts everything, no TLS or AUTH"""
+    async def main():
+        server = await asyncio.start_server(lambda r, w: sink_session(r, w, latency),
+                                            '127.0.0.1', port, backlog=512, limit=2 ** 20)
+        ready.set()
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(main())
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def run(backend, concurrency, host, port, recipients, msg):
+    pool = pool_class(backend)(host, port, size=concurrency, starttls=False)
+    sender = BulkSender(pool, msg['From'], lambda recipient: msg, retries=0)
+    start = time.perf_counter()
+    results = sender.send(recipients)
+    elapsed = time.perf_counter() - start
+    pool.close()
+    sent = sum(1 for result in results if result['status'] == 'sent')
+    print(f"  {backend:<8} concurrency {concurrency:>3}  {sent:>6}/{len(recipients)} sent  {elapsed:7.2f} s  "
+          f"{sent / elapsed:8.1f} msg/s  {pool.connections_opened:>3} connections")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare SMTP backend throughput against a local sink")
+    parser.add_argument('messages', nargs='?', type=int, default=500)
+    parser.add_argument('latency', nargs='?', type=float, default=0.01, help="Sink delay per message, seconds")
+    parser.add_argument('--host', help="Use a running SMTP sink instead of starting one")
+    parser.add_argument('--port', type=int, default=8025)
+    args = parser.parse_args()
+
+    sink = None
+    host, port = args.host, args.port
+    if not host:
+        host, port = '127.0.0.1', free_port()
+        ready = multiprocessing.Event()
+        sink = multiprocessing.Process(target=run_sink, args=(port, args.latency, ready), daemon=True)
+        sink.start()
+        ready.wait(10)
+
+    html = '<html><body><p>Benchmark message</p>' + 'x' * 4000 + '</body></html>'
+    msg = build_message('bench@example.com', 'rcpt@example.com', 'Benchmark', html, 'Bench')
+    recipients = [{'email': f'user{i}@example.com', 'tracking_id': f'emp{i:05d}_bench'} for i in range(args.messages)]
+
+    print(f"[BENCH] {args.messages} messages to {host}:{port}"
+          + (f", sink latency {args.latency * 1000:.0f} ms" if sink else ""))
+    for concurrency in CONCURRENCY:
+        for backend in SMTP_BACKENDS:
+            run(backend, concurrency, host, port, recipients, msg)
+    if sink:
+        sink.terminate()
@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+"""
+Load test: the tracker's HTTP endpoints against a synthetic campaign
+
+Runs tracker.py locally in a scratch directory with geolocation stubbed out,
+loads `events` synthetic clicks/opens, and measures requests/second,
+p50/p95/p99 latency and server RSS per endpoint:
+
+  /track, /pixel            the last --http events (a quarter of them clicks),
+                            replayed over HTTP by --concurrency keep-alive clients
+  /dashboard, /api/clicks,  --reads requests each, against the full store
+  /api/export/csv|pdf
+
+The rest of the events are written straight into the store before the
+server starts (as an existing campaign's history would be). Results go to a
+JSON baseline; --compare prints the change against an earlier one. Not a
+test; run it directly:
+
+    python3 bench_tracker.py                               # 10k events, dev server
+    python3 bench_tracker.py 1000000 --http 20000 --reads 5
+    python3 bench_tracker.py --gunicorn 4 --compare bench_baseline.json --output /tmp/after.json
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import socket
+import shutil
+import argparse
+import tempfile
+import threading
+import contextlib
+import http.client
+import subprocess
+import multiprocessing
+from datetime import datetime, timedelta
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+CAMPAIGN = "bench"
+STUB_GEO = {'country': 'Benchland', 'city': 'Bench City', 'isp': 'Bench ISP'}
+SEED_BATCH = 10000
+CLICK_SHARE = 0.25  # Of replayed/seeded events; the rest are opens
+WARMUP = 100  # Requests per route before measuring
+
+def stub_geolocation(ip_address):
+    return dict(STUB_GEO)
+
+def quiet():
+    """Tracker logging to /dev/null in the server processes (its cost is still paid)"""
+    sys.stdout = open(os.devnull, 'w')
+
+def make_campaign(recipients):
+    """campaigns/bench_with_links.csv with signed tokens; returns the tokens"""
+    import generate_links
+    os.makedirs('campaigns', exist_ok=True)
+    with open(os.path.join('campaigns', f"{CAMPAIGN}.csv"), 'w') as f:
+        f.write("employee_id,email,name,department\n")
+        for i in range(recipients):
+            f.write(f"emp{i:06d},user{i}@example.com,User {i},Dept {i % 20}\n")
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        output = generate_links.process_campaign(os.path.join('campaigns', f"{CAMPAIGN}.csv"))
+    os.remove(os.path.join('campaigns', f"{CAMPAIGN}.csv"))
+    with open(output) as f:
+        header = f.readline().rstrip('\n').split(',')
+        column = header.index('tracking_id')
+        return [line.rstrip('\n').split(',')[column] for line in f]
+
+def seed_events(count, tokens, done):
+    """Child process: write `count` historical events through the tracker's own store, then save its state"""
+    quiet()
+    import geo
+    geo.get_geolocation = stub_geolocation
+    import tracker
+    rng = random.Random(7)
+    start = datetime.utcnow() - timedelta(days=30)
+    written = 0
+    while written < count:
+        batch = []
+        for _ in range(min(SEED_BATCH, count - written)):
+            click = rng.random() < CLICK_SHARE
+            event = dict({
+                'event_type': 'click' if click else 'open',
+                'event_id': uuid.uuid4().hex,
+                'timestamp': (start + timedelta(seconds=rng.randrange(30 * 86400))).isoformat(),
+                'tracking_id': rng.choice(tokens),
+                'ip_address': f"203.0.{rng.randrange(256)}.{rng.randrange(256)}",
+                'user_agent': 'Mozilla/5.0 (bench)',
+                'campaign': CAMPAIGN
+            }, **STUB_GEO)
+            if click:
+                event.update(target_url='/failed-test', referrer='Direct')
+            batch.append(event)
+        tracker.event_store.write_batch(batch, [])
+        written += len(batch)
+    tracker.aggregates.catch_up(tracker.event_store)
+    tracker.aggregates_for(CAMPAIGN).catch_up(tracker.event_store.partition(CAMPAIGN))
+    # multiprocessing children skip atexit, so save the dashboard state the way a clean shutdown would
+    tracker.save_dashboard_state()
+    done.set()
+
+def serve_dev(port):
+    """Child process: the tracker on werkzeug's threaded server (what tracker.py runs)"""
+    quiet()
+    import geo
+    geo.get_geolocation = stub_geolocation
+    from werkzeug.serving import make_server, WSGIRequestHandler
+
+    class QuietHandler(WSGIRequestHandler):
+        protocol_version = "HTTP/1.1"  # Keep-alive, like the production server
+
+        def log_request(self, *args, **kwargs):
+            pass
+
+    import tracker
+    make_server('127.0.0.1', port, tracker.app, threaded=True, request_handler=QuietHandler).serve_forever()
+
+def serve_gunicorn(port, workers):
+    """Child process: the tracker under serve.py; workers fork from here, stub included"""
+    quiet()
+    import geo
+    geo.get_geolocation = stub_geolocation
+    import serve
+    serve.SERVER_PID_FILE = 'serve.pid'
+    sys.argv = [sys.argv[0]]  # gunicorn parses the command line too
+    serve.run(workers=workers, bind=f"127.0.0.1:{port}")
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def wait_for_port(port, timeout=300):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+def process_tree(pid):
+    pids = [pid]
+    for parent in pids:
+        try:
+            for task in os.listdir(f"/proc/{parent}/task"):
+                with open(f"/proc/{parent}/task/{task}/children") as f:
+                    pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+def rss_mb(pid):
+    """(current, peak) resident memory of a process and its children, MB; None without /proc"""
+    current = peak = 0
+    for member in process_tree(pid):
+        try:
+            with open(f"/proc/{member}/status") as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        current += int(line.split()[1])
+                    elif line.startswith('VmHWM:'):
+                        peak += int(line.split()[1])
+        except OSError:
+            continue
+    if not current:
+        return None, None
+    return round(current / 1024, 1), round(peak / 1024, 1)
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+def run_requests(port, paths, concurrency):
+    """Issue GETs for `paths` from `concurrency` keep-alive clients; returns (latencies by path, errors, seconds)"""
+    latencies = {}
+    errors = {}
+    lock = threading.Lock()
+    shares = [paths[i::concurrency] for i in range(concurrency)]
+
+    def client(share):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+        mine = {}
+        failed = {}
+        for path in share:
+            route = path.split('?')[0]
+            began = time.perf_counter()
+            try:
+                conn.request('GET', path)
+                response = conn.getresponse()
+                response.read()
+                ok = response.status < 400
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+                ok = False
+            mine.setdefault(route, []).append(time.perf_counter() - began)
+            if not ok:
+                failed[route] = failed.get(route, 0) + 1
+        conn.close()
+        with lock:
+            for route, values in mine.items():
+                latencies.setdefault(route, []).extend(values)
+            for route, value in failed.items():
+                errors[route] = errors.get(route, 0) + value
+
+    threads = [threading.Thread(target=client, args=(share,)) for share in shares if share]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, time.perf_counter() - started
+
+def summarize(latencies, errors, elapsed, rss):
+    values = sorted(latencies)
+    return {
+        'requests': len(values),
+        'errors': errors,
+        'rps': round(len(values) / elapsed, 1),
+        'p50_ms': round(percentile(values, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(values, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(values, 0.99) * 1000, 3),
+        'rss_mb': rss[0],
+        'peak_rss_mb': rss[1]
+    }
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\n[BENCH] Against {baseline_path} ({baseline['meta'].get('revision')}, "
+          f"{baseline['meta'].get('events')} events):")
+    for endpoint, now in results['endpoints'].items():
+        before = baseline.get('endpoints', {}).get(endpoint)
+        if not before:
+            print(f"  {endpoint:<22} (not in baseline)")
+            continue
+
+        def change(key):
+            return f"{(now[key] - before[key]) / before[key] * 100:+6.1f}%" if before.get(key) and now.get(key) is not None else "   n/a"
+        print(f"  {endpoint:<22} req/s {change('rps')}  p50 {change('p50_ms')}  p99 {change('p99_ms')}  "
+              f"rss {change('rss_mb')}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the tracker's endpoints on a synthetic campaign")
+    parser.add_argument('events', nargs='?', type=int, default=10000, help="Total clicks + opens in the store")
+    parser.add_argument('--http', type=int, default=10000, help="How many of them to replay over HTTP")
+    parser.add_argument('--recipients', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--reads', type=int, default=20, help="Requests per dashboard/API/export endpoint")
+    parser.add_argument('--gunicorn', type=int, metavar='WORKERS', help="Serve with serve.py instead of the dev server")
+    parser.add_argument('--output', default=os.path.join(REPO_DIR, 'bench_baseline.json'))
+    parser.add_argument('--compare', help="Earlier results to compare with")
+    parser.add_argument('--keep', action='store_true', help="Keep the scratch directory")
+    args = parser.parse_args()
+    replayed = min(args.http, args.events)
+    # Relative to where we were started, not the scratch directory
+    args.output = os.path.abspath(args.output)
+    args.compare = os.path.abspath(args.compare) if args.compare else None
+
+    workdir = tempfile.mkdtemp(prefix='tracker-bench-')
+    os.chdir(workdir)
+    server = None
+    try:
+        started = time.perf_counter()
+        tokens = make_campaign(args.recipients)
+        print(f"[BENCH] Scratch directory {workdir}, {len(tokens)} recipients")
+
+        if args.events > replayed:
+            done = multiprocessing.Event()
+            seeder = multiprocessing.Process(target=seed_events, args=(args.events - replayed, tokens, done))
+            seeder.start()
+            seeder.join()
+            if not done.is_set():
+                print("❌ Seeding the store failed")
+                sys.exit(1)
+            print(f"[BENCH] Seeded {args.events - replayed} events in {time.perf_counter() - started:.1f}s")
+
+        port = free_port()
+        if args.gunicorn:
+            server = multiprocessing.Process(target=serve_gunicorn, args=(port, args.gunicorn))
+        else:
+            server = multiprocessing.Process(target=serve_dev, args=(port,))
+        launched = time.perf_counter()
+        server.start()
+        if not wait_for_port(port):
+            print("❌ Tracker didn't start")
+            sys.exit(1)
+        startup = time.perf_counter() - launched
+        print(f"[BENCH] Tracker up in {startup:.2f}s ({'gunicorn x%d' % args.gunicorn if args.gunicorn else 'dev server'})")
+
+        results = {
+            'meta': {
+                'revision': git_revision(),
+                'date': datetime.utcnow().isoformat(timespec='seconds'),
+                'events': args.events,
+                'replayed': replayed,
+                'recipients': args.recipients,
+                'concurrency': args.concurrency,
+                'reads': args.reads,
+                'server': f"gunicorn x{args.gunicorn}" if args.gunicorn else "dev",
+                'cpus': os.cpu_count(),
+                'python': sys.version.split()[0],
+                'startup_s': round(startup, 3),
+                'idle_rss_mb': rss_mb(server.pid)[0]
+            },
+            'endpoints': {}
+        }
+
+        rng = random.Random(11)
+        clicks = int(replayed * CLICK_SHARE)
+        for route, count in (('/track', clicks), ('/pixel', replayed - clicks)):
+            paths = [f"{route}?id={rng.choice(tokens)}" for _ in range(count)]
+            if not paths:
+                continue
+            run_requests(port, paths[:WARMUP], args.concurrency)  # Warm-up: not measured, though its events are stored
+            latencies, errors, elapsed = run_requests(port, paths, args.concurrency)
+            results['endpoints'][route] = summarize(latencies[route], errors.get(route, 0), elapsed, rss_mb(server.pid))
+        time.sleep(2)  # Let the event writer and geo workers drain before the reads
+
+        reads = {
+            '/dashboard': '/dashboard',
+            '/dashboard?campaign': f'/dashboard?campaign={CAMPAIGN}',
+            '/api/clicks': '/api/clicks?limit=100',
+            '/api/export/csv': f'/api/export/csv?campaign={CAMPAIGN}',
+            '/api/export/pdf': f'/api/export/pdf?campaign={CAMPAIGN}'
+        }
+        for name, path in reads.items():
+            latencies, errors, elapsed = run_requests(port, [path] * args.reads, 1)
+            results['endpoints'][name] = summarize(latencies[path.split('?')[0]], sum(errors.values()), elapsed,
+                                                   rss_mb(server.pid))
+
+        print(f"\n[BENCH] {args.events} events ({replayed} over HTTP, concurrency {args.concurrency})")
+        for name, result in results['endpoints'].items():
+            print(f"  {name:<22} {result['requests']:>7} req  {result['rps']:9.1f} req/s  "
+                  f"p50 {result['p50_ms']:8.2f}  p95 {result['p95_ms']:8.2f}  p99 {result['p99_ms']:8.2f} ms  "
+                  f"rss {result['rss_mb']} MB" + (f"  {result['errors']} errors" if result['errors'] else ""))
+
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n📁 Results: {args.output}")
+        if args.compare:
+            compare(results, args.compare)
+    finally:
+        if server is not None and server.is_alive():
+            server.terminate()
+            server.join(30)
+        os.chdir(REPO_DIR)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Campaign registry: id, creation time, recipient list and email template
+"""
+
+import os
+import csv
+import json
+import fcntl
+import threading
+from datetime import datetime
+from logs import log
+
+REGISTRY_FILE = "campaigns.json"  # Kept next to the recipient CSVs
+DEFAULT_TEMPLATE = "microsoft365"
+ID_CHARS = set('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_-')
+RECIPIENT_FIELDS = ['employee_id', 'email', 'name', 'department', 'target_url', 'tracking_id']
+
+class CampaignRegistry:
+    """Campaign records stored in campaigns/campaigns.json.
+
+    A campaign's recipients are its CSV(s) in the campaigns directory, read
+    through the shared RecipientDirectory. CSVs dropped into the directory
+    by hand are registered the first time they are seen, dated by the
+    file's modification time. Several processes may share the directory:
+    campaigns.json is re-read whenever another one rewrites it, and
+    changes are made under an exclusive lock on campaigns.json.lock.
+    """
+
+    def __init__(self, campaigns_dir, recipient_directory):
+        self.campaigns_dir = campaigns_dir
+        self.path = os.path.join(campaigns_dir, REGISTRY_FILE)
+        self.recipient_directory = recipient_directory
+        self.lock = threading.Lock()
+        self.records = {}
+        self.signature = None
+        self._reload()
+        self.sync()
+
+    def _file_signature(self):
+        try:
+            info = os.stat(self.path)
+        except OSError:
+            return None
+        return info.st_ino, info.st_mtime_ns, info.st_size
+
+    def _reload(self):
+        """Re-read campaigns.json if it changed since we last read or wrote it"""
+        signature = self._file_signature()
+        if signature == self.signature:
+            return
+        try:
+            if signature is not None:
+                with open(self.path, 'r') as f:
+                    self.records = {record['id']: record for record in json.load(f) if self.valid_id(record.get('id'))}
+        except Exception as e:
+            log.error('CAMPAIGN', 'Error loading the registry', path=self.path, error=e)
+        self.signature = signature
+
+    def _file_lock(self):
+        """Exclusive lock shared with other processes using the same directory; close() releases it"""
+        os.makedirs(self.campaigns_dir, exist_ok=True)
+        handle = open(self.path + '.lock', 'a')
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        return handle
+
+    @staticmethod
+    def valid_id(campaign_id):
+        return bool(campaign_id) and set(campaign_id) <= ID_CHARS
+
+    def sync(self):
+        """Register campaign CSVs that aren't in the registry yet"""
+        with self.lock:
+            self._reload()
+            new_ids = [campaign_id for campaign_id in self.recipient_directory.campaigns()
+                       if campaign_id not in self.records and self.valid_id(campaign_id)]
+            if not new_ids:
+                return
+            with self._file_lock():
+                self._reload()
+                self._register(new_ids)
+
+    def _register(self, campaign_ids):
+        """Add records for hand-made CSVs (caller holds both locks)"""
+        added = False
+        for campaign_id in campaign_ids:
+            if campaign_id in self.records:
+                continue
+            csv_path = os.path.join(self.campaigns_dir, f"{campaign_id}.csv")
+            created = os.path.getmtime(csv_path) if os.path.exists(csv_path) else None
+            self.records[campaign_id] = {
+                'id': campaign_id,
+                'created': (datetime.utcfromtimestamp(created) if created else datetime.utcnow()).isoformat(),
+                'recipients': f"{campaign_id}.csv",
+                'template': DEFAULT_TEMPLATE
+            }
+            added = True
+        if added:
+            self._save()
+
+    def _save(self):
+        try:
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(sorted(self.records.values(), key=lambda record: record['id']), f, indent=2)
+            os.replace(tmp_path, self.path)
+            self.signature = self._file_signature()
+        except Exception as e:
+            log.error('CAMPAIGN', 'Error saving the registry', path=self.path, error=e)
+
+    def get(self, campaign_id):
+        self.sync()
+        return self.records.get(campaign_id)
+
+    def exists(self, campaign_id):
+        return self.get(campaign_id) is not None
+
+    def ids(self):
+        self.sync()
+        return sorted(self.records)
+
+    def list(self):
+        """All campaigns with their current recipient counts, oldest first"""
+        self.sync()
+        result = []
+        for record in sorted(self.records.values(), key=lambda record: record['created']):
+            recipients = self.recipient_directory.recipients(campaign=record['id'])
+            result.append(dict(record, recipient_count=len(recipients)))
+        return result
+
+    def recipients(self, campaign_id, with_tracking_only=False):
+        return self.recipient_directory.recipients(campaign=campaign_id, with_tracking_only=with_tracking_only)
+
+    def create(self, campaign_id, recipients, template=DEFAULT_TEMPLATE):
+        """Write the recipient CSV and register a new campaign"""
+        if not self.valid_id(campaign_id):
+            raise ValueError("Campaign id may only contain letters, digits, '_' and '-'")
+        csv_path = os.path.join(self.campaigns_dir, f"{campaign_id}.csv")
+        with self.lock, self._file_lock():
+            self._reload()
+            if campaign_id in self.records or os.path.exists(csv_path):
+                raise ValueError(f"Campaign {campaign_id} already exists")
+            os.makedirs(self.campaigns_dir, exist_ok=True)
+            with open(csv_path, 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=RECIPIENT_FIELDS, extrasaction='ignore')
+                writer.writeheader()
+                for recipient in recipients:
+                    writer.writerow({field: recipient.get(field, '') for field in RECIPIENT_FIELDS})
+            record = {
+                'id': campaign_id,
+                'created': datetime.utcnow().isoformat(),
+                'recipients': f"{campaign_id}.csv",
+                'template': template or DEFAULT_TEMPLATE
+            }
+            self.records[campaign_id] = record
+            self._save()
+        self.recipient_directory.refresh(force=True)
+        log.info('CAMPAIGN', 'Created', campaign=campaign_id, recipients=len(recipients))
+        return record
@@ -0,0 +1,534 @@
+#!/usr/bin/env python3
+"""
+/dashboard page: a static shell built once at import, and fragments cached until their counters change
+"""
+
+import re
+import json
+from html import escape
+from urllib.parse import quote
+
+# The page with @@slot@@ markers where per-request content goes
+DASHBOARD_SHELL = '''
+<!DOCTYPE html>
+<html>
+<head>
+    <title>Cyber Tracker Analytics Dashboard</title>
+    <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
+    <style>
+        body { font-family: 'Segoe UI', Arial, sans-serif; margin: 0; padding: 20px; background: #0b0f1a; color: #e2e8f0; }
+        h1 { color: #3b82f6; margin-bottom: 10px; }
+        .subtitle { color: #64748b; margin-bottom: 30px; }
+        
+        /* Navigation Tabs */
+        .tabs { display: flex; gap: 10px; margin-bottom: 30px; border-bottom: 2px solid #334155; }
+        .tab { padding: 12px 24px; cursor: pointer; background: #1a1f2e; border-radius: 8px 8px 0 0; border: none; color: #94a3b8; font-size: 14px; font-weight: 600; }
+        .tab.active { background: #3b82f6; color: white; }
+        .tab:hover:not(.active) { background: #1e293b; color: #e2e8f0; }
+        
+        /* Tab Content */
+        .tab-content { display: none; }
+        .tab-content.active { display: block; }
+        
+        /* Stats Boxes */
+        .stats { display: grid; grid-template-columns: repeat(auto-fit, minmax(200px, 1fr)); gap: 20px; margin: 20px 0; }
+        .stat-box { background: linear-gradient(135deg, #1a1f2e, #0f172a); padding: 25px; border-radius: 12px; border: 1px solid #334155; text-align: center; }
+        .stat-box.danger { border-color: #dc2626; background: linear-gradient(135deg, #1a1f2e, #450a0a); }
+        .stat-box.warning { border-color: #f59e0b; background: linear-gradient(135deg, #1a1f2e, #451a03); }
+        .stat-box.info { border-color: #3b82f6; background: linear-gradient(135deg, #1a1f2e, #172554); }
+        .stat-number { font-size: 42px; font-weight: bold; color: #3b82f6; margin: 10px 0; }
+        .stat-box.danger .stat-number { color: #dc2626; }
+        .stat-box.warning .stat-number { color: #f59e0b; }
+        .stat-box.info .stat-number { color: #10b981; }
+        .stat-label { color: #94a3b8; font-size: 14px; text-transform: uppercase; letter-spacing: 1px; }
+        
+        /* High Risk Section */
+        .high-risk-section { background: linear-gradient(135deg, #450a0a, #1a1f2e); border: 2px solid #dc2626; border-radius: 12px; padding: 30px; margin: 30px 0; }
+        .high-risk-header { display: flex; align-items: center; gap: 15px; margin-bottom: 20px; }
+        .high-risk-header h2 { color: #dc2626; margin: 0; font-size: 24px; }
+        .high-risk-badge { background: #dc2626; color: white; padding: 6px 14px; border-radius: 20px; font-size: 12px; font-weight: bold; }
+        
+        /* Event Tables */
+        .event-table { width: 100%; border-collapse: collapse; margin-top: 20px; font-size: 14px; }
+        .event-table th { background: #1e293b; color: #3b82f6; padding: 14px; text-align: left; font-weight: 600; }
+        .event-table td { padding: 12px 14px; border-bottom: 1px solid #334155; }
+        .event-table tr:hover { background: #1e293b; }
+        .event-table tr.high-risk { background: rgba(220, 38, 38, 0.1); }
+        .event-table tr.high-risk:hover { background: rgba(220, 38, 38, 0.2); }
+        
+        /* Badges */
+        .badge { padding: 6px 12px; border-radius: 12px; font-size: 12px; font-weight: bold; }
+        .badge-click { background: #dc2626; color: white; }
+        .badge-open { background: #10b981; color: white; }
+        .badge-risk { background: #f59e0b; color: #451a03; }
+        
+        /* Charts */
+        .charts { display: grid; grid-template-columns: repeat(auto-fit, minmax(400px, 1fr)); gap: 20px; margin: 30px 0; }
+        .chart-box { background: #1a1f2e; padding: 20px; border-radius: 12px; border: 1px solid #334155; }
+        .chart-title { color: #3b82f6; font-size: 16px; margin-bottom: 15px; font-weight: 600; }
+        
+        /* Actions */
+        .actions { margin: 20px 0; }
+        .btn { background: #3b82f6; color: white; padding: 12px 24px; border: none; border-radius: 8px; cursor: pointer; text-decoration: none; display: inline-block; margin-right: 10px; font-size: 14px; }
+        .btn:hover { background: #2563eb; }
+        .btn-danger { background: #dc2626; }
+        .btn-danger:hover { background: #b91c1c; }
+        
+        /* Info Boxes */
+        .info-box { background: rgba(59, 130, 246, 0.1); border: 1px solid #3b82f6; padding: 20px; border-radius: 8px; margin-bottom: 20px; }
+        .warning-box { background: rgba(245, 158, 11, 0.1); border: 1px solid #f59e0b; padding: 20px; border-radius: 8px; margin-bottom: 20px; }
+        
+        /* Geo text */
+        .geo { color: #94a3b8; font-size: 12px; }
+        
+        /* User Name */
+        .user-name { font-weight: 600; color: #e2e8f0; }
+        .user-name.high-risk { color: #fca5a5; }
+        
+        /* Section Headers */
+        .section-header { display: flex; align-items: center; gap: 10px; margin: 30px 0 20px; padding-bottom: 10px; border-bottom: 2px solid #334155; }
+        .section-header h2 { margin: 0; color: #e2e8f0; }
+        .section-header.opens { border-color: #10b981; }
+        .section-header.clicks { border-color: #dc2626; }
+    </style>
+</head>
+<body>
+    <h1>🔒 Cyber Awareness Analytics Dashboard</h1>
+    <p class="subtitle">Real-time phishing simulation tracking - Monitor email opens and identify high-risk users who click@@campaign_title@@</p>
+    
+    <div class="actions">
+        <button class="btn" onclick="location.reload()">🔄 Refresh</button>
+        <a href="/api/export/csv@@campaign_query@@" class="btn">📥 Export CSV</a>
+        <a href="/api/export/pdf@@campaign_query@@" class="btn">📄 PDF Report</a>
+        <a href="/api/clicks@@campaign_query@@" class="btn" target="_blank">📡 API</a>
+        <select class="btn" onchange="location.href = '/dashboard' + (this.value ? '?campaign=' + encodeURIComponent(this.value) : '')">
+            <option value="">All campaigns</option>
+            @@campaign_options@@
+        </select>
+    </div>
+    
+    <!-- Summary Stats -->
+    @@stats@@
+    
+    <!-- Navigation Tabs -->
+    <div class="tabs">
+        <div class="tab active" onclick="showTab('overview')">📊 Overview</div>
+        <div class="tab" onclick="showTab('highrisk')">🚨 High Risk Users</div>
+        <div class="tab" onclick="showTab('opens')">📧 Email Opens</div>
+        <div class="tab" onclick="showTab('clicks')">⚠️ Click Events</div>
+    </div>
+    
+    <!-- Overview Tab -->
+    <div id="overview" class="tab-content active">
+        <div class="charts">
+            <div class="chart-box">
+                <div class="chart-title">📊 Clicks vs Opens</div>
+                <canvas id="pieChart"></canvas>
+            </div>
+            
+            <div class="chart-box">
+                <div class="chart-title">🌍 Events by Country</div>
+                <canvas id="countryChart"></canvas>
+            </div>
+            
+            <div class="chart-box">
+                <div class="chart-title">📈 Activity Timeline (24h)</div>
+                <canvas id="timelineChart"></canvas>
+            </div>
+            
+            <div class="chart-box">
+                <div class="chart-title">🏢 Top ISPs/Organizations</div>
+                <canvas id="ispChart"></canvas>
+            </div>
+        </div>
+        
+        <div class="info-box">
+            <h3>📋 Dashboard Guide</h3>
+            <p><strong>Email Opens:</strong> Users who opened the email (tracked via pixel). This is normal behavior and not a failure.</p>
+            <p><strong>Link Clicks:</strong> Users who clicked the phishing link. These are <strong>High Risk Users</strong> who need cybersecurity training.</p>
+            <p><strong>High Risk Users:</strong> Anyone who clicked should be enrolled in additional security awareness training.</p>
+        </div>
+    </div>
+    
+    <!-- High Risk Users Tab -->
+    <div id="highrisk" class="tab-content">
+        <div class="high-risk-section">
+            <div class="high-risk-header">
+                <h2>🚨 HIGH RISK USERS</h2>
+                <span class="high-risk-badge" id="highRiskBadge">@@unique_clickers@@ USERS NEED TRAINING</span>
+            </div>
+            <p style="color: #fca5a5; margin-bottom: 20px;">These users clicked on the phishing link. They should be enrolled in cybersecurity awareness training.</p>
+            
+            <table class="event-table" id="highriskTable">
+                <tr>
+                    <th>Time</th>
+                    <th>Name</th>
+                    <th>Risk Level</th>
+                    <th>Location</th>
+                    <th>ISP/Device</th>
+                </tr>
+                @@highrisk_rows@@
+            </table>
+        </div>
+        
+        <div class="warning-box">
+            <h3>⚠️ Recommended Actions</h3>
+            <ul style="margin: 10px 0; padding-left: 20px; color: #fbbf24;">
+                <li>Schedule mandatory cybersecurity training for all High Risk Users</li>
+                <li>Send follow-up educational email about phishing red flags</li>
+                <li>Consider additional MFA requirements for these users</li>
+                <li>Retest in 30 days to measure improvement</li>
+            </ul>
+        </div>
+    </div>
+    
+    <!-- Email Opens Tab -->
+    <div id="opens" class="tab-content">
+        <div class="section-header opens">
+            <h2>📧 Email Opens Tracking</h2>
+            <span style="color: #10b981; font-size: 14px;">Users who opened the email (not a failure - just tracking)</span>
+        </div>
+        
+        <div class="info-box">
+            <p><strong>Note:</strong> Opening an email is normal behavior. These users are NOT high risk - they just opened the email. Only users who click the link are flagged as high risk.</p>
+        </div>
+        
+        <table class="event-table" id="opensTable">
+            <tr>
+                <th>Time</th>
+                <th>Name</th>
+                <th>Status</th>
+                <th>Location</th>
+                <th>ISP/Device</th>
+            </tr>
+            @@opens_rows@@
+        </table>
+    </div>
+    
+    <!-- Click Events Tab -->
+    <div id="clicks" class="tab-content">
+        <div class="section-header clicks">
+            <h2>⚠️ Link Click Events (Failed Test)</h2>
+            <span style="color: #dc2626; font-size: 14px;">Users who clicked the phishing link - SECURITY FAILURE</span>
+        </div>
+        
+        <div class="warning-box">
+            <p style="color: #fbbf24; margin: 0;"><strong>🚨 WARNING:</strong> These users clicked on a phishing link. This represents a security failure and they should be enrolled in training.</p>
+        </div>
+        
+        <table class="event-table" id="clicksTable">
+            <tr>
+                <th>Time</th>
+                <th>Name</th>
+                <th>Status</th>
+                <th>Location</th>
+                <th>ISP/Device</th>
+            </tr>
+            @@clicks_rows@@
+        </table>
+    </div>
+    
+    <script>
+        const chartData = @@chart_data@@;
+        
+        // Tab switching
+        function showTab(tabName) {
+            // Hide all tabs
+            document.querySelectorAll('.tab-content').forEach(tab => tab.classList.remove('active'));
+            document.querySelectorAll('.tab').forEach(tab => tab.classList.remove('active'));
+            
+            // Show selected tab
+            document.getElementById(tabName).classList.add('active');
+            event.target.classList.add('active');
+        }
+        
+        // Pie Chart - Clicks vs Opens
+        const pieChart = new Chart(document.getElementById('pieChart'), {
+            type: 'doughnut',
+            data: {
+                labels: ['Clicks (Failed)', 'Opens (Tracked)'],
+                datasets: [{
+                    data: [chartData.clicks, chartData.opens],
+                    backgroundColor: ['#dc2626', '#10b981'],
+                    borderWidth: 0
+                }]
+            },
+            options: {
+                responsive: true,
+                plugins: {
+                    legend: { position: 'bottom', labels: { color: '#e2e8f0' } }
+                }
+            }
+        });
+        
+        // Bar Chart - Countries
+        const countryLabels = Object.keys(chartData.countries);
+        const countryData = Object.values(chartData.countries);
+        const countryChart = new Chart(document.getElementById('countryChart'), {
+            type: 'bar',
+            data: {
+                labels: countryLabels,
+                datasets: [{
+                    label: 'Events',
+                    data: countryData,
+                    backgroundColor: '#3b82f6'
+                }]
+            },
+            options: {
+                responsive: true,
+                plugins: { legend: { display: false } },
+                scales: {
+                    x: { ticks: { color: '#94a3b8' }, grid: { color: '#334155' } },
+                    y: { ticks: { color: '#94a3b8' }, grid: { color: '#334155' } }
+                }
+            }
+        });
+        
+        // Line Chart - Timeline
+        const hours = Array.from({length: 24}, (_, i) => String(i).padStart(2, '0'));
+        const clickData = hours.map(h => chartData.hourly_clicks[h] || 0);
+        const openData = hours.map(h => chartData.hourly_opens[h] || 0);
+        
+        const timelineChart = new Chart(document.getElementById('timelineChart'), {
+            type: 'line',
+            data: {
+                labels: hours.map(h => h + ':00'),
+                datasets: [
+                    {
+                        label: 'Clicks (Failed)',
+                        data: clickData,
+                        borderColor: '#dc2626',
+                        backgroundColor: 'rgba(220, 38, 38, 0.1)',
+                        fill: true,
+                        tension: 0.4
+                    },
+                    {
+                        label: 'Opens (Tracked)',
+                        data: openData,
+                        borderColor: '#10b981',
+                        backgroundColor: 'rgba(16, 185, 129, 0.1)',
+                        fill: true,
+                        tension: 0.4
+                    }
+                ]
+            },
+            options: {
+                responsive: true,
+                plugins: { legend: { labels: { color: '#e2e8f0' } } },
+                scales: {
+                    x: { ticks: { color: '#94a3b8' }, grid: { color: '#334155' } },
+                    y: { ticks: { color: '#94a3b8' }, grid: { color: '#334155' } }
+                }
+            }
+        });
+        
+        // Horizontal Bar - ISPs
+        const ispLabels = Object.keys(chartData.isps);
+        const ispData = Object.values(chartData.isps);
+        const ispChart = new Chart(document.getElementById('ispChart'), {
+            type: 'bar',
+            data: {
+                labels: ispLabels,
+                datasets: [{
+                    label: 'Events',
+                    data: ispData,
+                    backgroundColor: '#8b5cf6'
+                }]
+            },
+            options: {
+                indexAxis: 'y',
+                responsive: true,
+                plugins: { legend: { display: false } },
+                scales: {
+                    x: { ticks: { color: '#94a3b8' }, grid: { color: '#334155' } },
+                    y: { ticks: { color: '#94a3b8' }, grid: { color: '#334155' } }
+                }
+            }
+        });
+        
+        // Live updates: new events arrive over /api/stream, no reload needed
+        const MAX_ROWS = 50;
+        
+        function addRow(tableId, e, rowClass, nameClass, badgeClass, badgeText) {
+            const table = document.getElementById(tableId);
+            const row = table.insertRow(1);
+            if (rowClass) row.className = rowClass;
+            const cells = [
+                [(e.timestamp || '').substring(11, 19), ''],
+                [e.name || 'Unknown', nameClass],
+                [null, ''],
+                [(e.city || 'Unknown') + ', ' + (e.country || 'Unknown'), 'geo'],
+                [(e.isp || 'Unknown').substring(0, 25), 'geo']
+            ];
+            cells.forEach(([text, className]) => {
+                const cell = row.insertCell();
+                if (className) cell.className = className;
+                if (text === null) {
+                    const badge = document.createElement('span');
+                    badge.className = 'badge ' + badgeClass;
+                    badge.textContent = badgeText;
+                    cell.appendChild(badge);
+                } else {
+                    cell.textContent = text;
+                }
+            });
+            while (table.rows.length > MAX_ROWS + 1) table.deleteRow(table.rows.length - 1);
+        }
+        
+        function bump(chart, label) {
+            let index = chart.data.labels.indexOf(label);
+            if (index === -1) {
+                chart.data.labels.push(label);
+                chart.data.datasets[0].data.push(0);
+                index = chart.data.labels.length - 1;
+            }
+            chart.data.datasets[0].data[index] += 1;
+        }
+        
+        const liveSource = new EventSource('/api/stream@@campaign_query@@');
+        liveSource.onmessage = (message) => {
+            const data = JSON.parse(message.data);
+            const e = data.event;
+            const stats = data.stats;
+            
+            document.getElementById('statClicks').textContent = stats.clicks;
+            document.getElementById('statOpens').textContent = stats.opens;
+            document.getElementById('statHighRisk').textContent = stats.unique_clickers;
+            document.getElementById('statOpeners').textContent = stats.unique_openers;
+            document.getElementById('highRiskBadge').textContent = stats.unique_clickers + ' USERS NEED TRAINING';
+            
+            if (e.event_type === 'click') {
+                addRow('highriskTable', e, 'high-risk', 'user-name high-risk', 'badge-click', 'HIGH RISK - CLICKED');
+                addRow('clicksTable', e, 'high-risk', 'user-name high-risk', 'badge-click', 'CLICKED LINK - FAILED');
+            } else {
+                addRow('opensTable', e, '', 'user-name', 'badge-open', 'OPENED EMAIL');
+            }
+            
+            pieChart.data.datasets[0].data = [stats.clicks, stats.opens];
+            pieChart.update();
+            
+            bump(countryChart, e.country || 'Unknown');
+            countryChart.update();
+            
+            const hour = parseInt((e.timestamp || '').substring(11, 13), 10) || 0;
+            timelineChart.data.datasets[e.event_type === 'click' ? 0 : 1].data[hour] += 1;
+            timelineChart.update();
+            
+            bump(ispChart, (e.isp || 'Unknown').substring(0, 30));
+            ispChart.update();
+        };
+    </script>
+</body>
+</html>
+'''
+
+# Static text at even indexes, slot names at odd ones
+SHELL_PARTS = re.split(r'@@(\w+)@@', DASHBOARD_SHELL)
+
+STAT_BOXES = '''<div class="stats">
+        <div class="stat-box danger">
+            <div class="stat-label">⚠️ Link Clicks (Failed)</div>
+            <div class="stat-number" id="statClicks">{clicks}</div>
+        </div>
+        <div class="stat-box info">
+            <div class="stat-label">📧 Email Opens</div>
+            <div class="stat-number" id="statOpens">{opens}</div>
+        </div>
+        <div class="stat-box danger">
+            <div class="stat-label">🚨 High Risk Users</div>
+            <div class="stat-number" id="statHighRisk">{unique_clickers}</div>
+        </div>
+        <div class="stat-box warning">
+            <div class="stat-label">👥 Unique Openers</div>
+            <div class="stat-number" id="statOpeners">{unique_openers}</div>
+        </div>
+    </div>'''
+
+EVENT_ROW = ("<tr{row_class}><td>{time}</td><td class='{name_class}'>{name}</td>"
+             "<td><span class='badge {badge_class}'>{badge}</span></td>"
+             "<td class='geo'>{city}, {country}</td><td class='geo'>{isp}</td></tr>")
+
+ROWS_SHOWN = 50
+
+def event_rows(events, row_class, name_class, badge_class, badge):
+    """Table rows for events that already carry a 'name'"""
+    return ''.join(EVENT_ROW.format(
+        row_class=f" class='{row_class}'" if row_class else '',
+        time=escape(event.get('timestamp', '')[11:19]),
+        name_class=name_class,
+        name=escape(str(event.get('name') or 'Unknown')),
+        badge_class=badge_class,
+        badge=badge,
+        city=escape(str(event.get('city') or 'Unknown')),
+        country=escape(str(event.get('country') or 'Unknown')),
+        isp=escape(str(event.get('isp') or 'Unknown')[:25])
+    ) for event in events[:ROWS_SHOWN])
+
+class DashboardPage:
+    """Renders /dashboard from cached fragments.
+
+    Each fragment is stored with the key it was built for: the version of
+    the counters it shows (DashboardAggregates.version(), bumped by every
+    click or open and its geolocation) plus, for tables, the recipient
+    directory's generation, since they show names. A request rebuilds only
+    fragments whose key moved; between events it is dictionary lookups and
+    one join. Versions are read before the data, so a fragment built while
+    an event arrives is simply rebuilt on the next request.
+    """
+
+    def __init__(self, resolve_name):
+        self.resolve_name = resolve_name
+        self.fragments = {}  # (counters, slot) -> (key, html)
+
+    def _fragment(self, counters, slot, key, build):
+        cached = self.fragments.get((counters, slot))
+        if cached is None or cached[0] != key:
+            cached = (key, build())
+            self.fragments[(counters, slot)] = cached
+        return cached[1]
+
+    def _latest(self, counters, event_type):
+        events = [dict(event) for event in counters.latest(event_type, ROWS_SHOWN)]
+        for event in events:
+            event['name'] = self.resolve_name(event['tracking_id'])
+        return events
+
+    def _stats(self, counters):
+        chart_data = counters.chart_data()
+        unique_clickers, unique_openers = counters.unique_counts()
+        return STAT_BOXES.format(clicks=chart_data['clicks'], opens=chart_data['opens'],
+                                 unique_clickers=unique_clickers, unique_openers=unique_openers)
+
+    def _click_tables(self, counters):
+        clicks = self._latest(counters, 'click')
+        return (event_rows(clicks, 'high-risk', 'user-name high-risk', 'badge-click', 'HIGH RISK - CLICKED'),
+                event_rows(clicks, 'high-risk', 'user-name high-risk', 'badge-click', 'CLICKED LINK - FAILED'))
+
+    def _chart_data(self, counters):
+        # Inside a <script>: no ISP or country name may close it
+        return json.dumps(counters.chart_data()).replace('<', '\\u003c')
+
+    def render(self, counters, campaign, campaign_ids, names_generation):
+        """The page for `counters` (the campaign's, or the all-campaigns ones)"""
+        clicks = counters.version('click')
+        opens = counters.version('open')
+        highrisk_rows, clicks_rows = self._fragment(counters, 'click_tables', (clicks, names_generation),
+                                                    lambda: self._click_tables(counters))
+        campaign_query = f"?campaign={quote(campaign)}" if campaign else ""
+        slots = {
+            'campaign_title': f" &middot; Campaign: <strong>{escape(campaign)}</strong>" if campaign else "",
+            'campaign_query': campaign_query,
+            'campaign_options': self._fragment(counters, 'campaign_options', (campaign_ids, campaign), lambda: ''.join(
+                f"<option value='{escape(campaign_id)}'{' selected' if campaign_id == campaign else ''}>{escape(campaign_id)}</option>"
+                for campaign_id in campaign_ids
+            )),
+            'stats': self._fragment(counters, 'stats', (clicks, opens), lambda: self._stats(counters)),
+            'unique_clickers': self._fragment(counters, 'unique_clickers', clicks,
+                                              lambda: str(counters.unique_counts()[0])),
+            'highrisk_rows': highrisk_rows,
+            'clicks_rows': clicks_rows,
+            'opens_rows': self._fragment(counters, 'opens_rows', (opens, names_generation), lambda: event_rows(
+                self._latest(counters, 'open'), '', 'user-name', 'badge-open', 'OPENED EMAIL')),
+            'chart_data': self._fragment(counters, 'chart_data', (clicks, opens), lambda: self._chart_data(counters))
+        }
+        return ''.join(slots[part] if index % 2 else part for index, part in enumerate(SHELL_PARTS))
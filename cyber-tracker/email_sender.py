@@ -5,96 +5,21 @@ Simple web form to send test phishing emails
 """
 
 from flask import Flask, request, render_template_string, jsonify
-import smtplib
-import ssl
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-import csv
-import os
-from datetime import datetime
+from recipients import RecipientDirectory
+from templates import render_email
 
 app = Flask(__name__)
 
-# Load name mapping
+# Shared with tracker.py: every campaign CSV, reloaded only when it changes
+recipient_directory = RecipientDirectory("campaigns")
+
 def load_recipients():
-    """Load recipients from campaign CSV"""
-    recipients = []
-    csv_path = "campaigns/test_campaign_with_links.csv"
-    try:
-        if os.path.exists(csv_path):
-            with open(csv_path, 'r') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    recipients.append({
-                        'name': row.get('name', 'Test User'),
-                        'email': row.get('email', ''),
-                        'tracking_id': row.get('tracking_id', ''),
-                        'employee_id': row.get('employee_id', '')
-                    })
-    except:
-        pass
-    return recipients
+    """Recipients with tracking IDs from every campaign CSV"""
+    return recipient_directory.recipients(with_tracking_only=True)
 
-def create_phishing_email(name, email, tracking_id, employee_id):
-    """Create HTML phishing email"""
-    
-    tracking_url = f"https://www.patrickcorr.me/track?id={tracking_id}&url=https://portal.office.com"
-    pixel_url = f"https://www.patrickcorr.me/pixel?id={employee_id}"
-    
-    html = f"""<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="UTF-8">
-</head>
-<body style="font-family: 'Segoe UI', Arial, sans-serif; background: #f3f4f6; padding: 20px; margin: 0;">
-    <div style="max-width: 600px; margin: 0 auto; background: white; padding: 40px; border-radius: 8px; box-shadow: 0 2px 10px rgba(0,0,0,0.1);">
-        
-        <div style="text-align: center; margin-bottom: 30px;">
-            <div style="width: 120px; height: 40px; background: #0078d4; margin: 0 auto; border-radius: 4px; display: flex; align-items: center; justify-content: center; color: white; font-weight: bold;">Microsoft</div>
-        </div>
-        
-        <h2 style="color: #d83b01; text-align: center; margin-bottom: 30px;">⚠️ Security Alert</h2>
-        
-        <p style="font-size: 16px; line-height: 1.5;">Dear {name},</p>
-        
-        <p style="font-size: 16px; line-height: 1.5;">We detected <strong>unusual login activity</strong> on your Microsoft 365 account from an unrecognized device.</p>
-        
-        <div style="background: #fff4ce; border-left: 4px solid #ffc107; padding: 20px; margin: 25px 0; border-radius: 4px;">
-            <p style="margin: 0; font-size: 14px; line-height: 1.6;">
-                <strong>📍 Location:</strong> Unknown (IP: 185.XXX.XXX.XXX)<br/>
-                <strong>🕐 Time:</strong> {datetime.now().strftime('%Y-%m-%d %H:%M UTC')}<br/>
-                <strong>💻 Device:</strong> Windows 10 / Chrome
-            </p>
-        </div>
-        
-        <p style="font-size: 16px; line-height: 1.5;">For your security, please verify your account within <strong style="color: #d83b01;">24 hours</strong> or your account will be temporarily suspended.</p>
-        
-        <div style="text-align: center; margin: 35px 0;">
-            <a href="{tracking_url}" 
-               style="background: #0078d4; color: white; padding: 16px 40px; text-decoration: none; border-radius: 4px; font-weight: bold; font-size: 16px; display: inline-block; box-shadow: 0 4px 6px rgba(0,120,212,0.3);">
-                🔐 Verify Account Now
-            </a>
-        </div>
-        
-        <p style="font-size: 13px; color: #666; margin-top: 30px; line-height: 1.5;">
-            If you recognize this activity, you can <a href="#" style="color: #0078d4;">sign in to your account</a> and review recent activity. 
-            If you don't recognize it, please secure your account immediately.
-        </p>
-        
-        <hr style="border: none; border-top: 1px solid #e5e7eb; margin: 35px 0;" />
-        
-        <div style="font-size: 11px; color: #999; text-align: center; line-height: 1.6;">
-            <p style="margin: 0;">© 2026 Microsoft Corporation. All rights reserved.</p>
-            <p style="margin: 5px 0 0 0;">One Microsoft Way, Redmond, WA 98052, USA</p>
-        </div>
-        
-        <!-- INVISIBLE TRACKING PIXEL - Detects when email is opened -->
-        <img src="{pixel_url}" width="1" height="1" alt="" style="display: none;" />
-    </div>
-</body>
-</html>"""
-    
-    return html
+def create_phishing_email(name, email, tracking_id, employee_id, template=None):
+    """Create HTML phishing email (shared templates, see templates.py)"""
+    return render_email(name, email, tracking_id, employee_id, template)
 
 @app.route('/email-sender')
 def email_sender_page():
@@ -275,12 +200,16 @@ def generate_email_api():
     """API endpoint to generate email HTML"""
     data = request.get_json()
     
-    html = create_phishing_email(
-        name=data.get('name', 'Test User'),
-        email=data.get('email', ''),
-        tracking_id=data.get('trackingId', 'test_123'),
-        employee_id=data.get('employeeId', 'test')
-    )
+    try:
+        html = create_phishing_email(
+            name=data.get('name', 'Test User'),
+            email=data.get('email', ''),
+            tracking_id=data.get('trackingId', 'test_123'),
+            employee_id=data.get('employeeId', 'test'),
+            template=data.get('template')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     return jsonify({'html': html})
 
@@ -0,0 +1,1045 @@
+#!/usr/bin/env python3
+"""
+Event storage backends for the tracker (SQLite or JSON-lines logs)
+"""
+
+import io
+import os
+import sys
+import gzip
+import json
+import time
+import queue
+import heapq
+import shutil
+import sqlite3
+import hashlib
+import itertools
+import threading
+from collections import deque
+from logs import log
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+EVENT_FIELDS = ['event_id', 'event_type', 'timestamp', 'tracking_id', 'target_url',
+                'ip_address', 'user_agent', 'referrer', 'country', 'city', 'isp']
+GEO_FIELDS = ['country', 'city', 'isp']
+DEFAULT_PARTITION = 'default'  # Events that don't belong to any campaign
+PARTITION_NAME_CHARS = set('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_-.')
+WRITE_RETRY_DELAY = 0.05  # Seconds before retrying a failed group commit, doubled per attempt...
+WRITE_RETRY_MAX_DELAY = 5.0  # ...up to this; a batch is retried until it commits (or shutdown runs out of time)
+GEO_LOOKAHEAD = 10000  # JSONL reads: events held back waiting for their geo record before going out without it
+
+class EventStore:
+    """Interface shared by the storage backends"""
+
+    def append(self, event):
+        """Persist one event dict"""
+        raise NotImplementedError
+
+    def update_geo(self, event_id, geo, event_type=None, campaign=None):
+        """Attach country/city/ISP to an already stored event"""
+        raise NotImplementedError
+
+    def write_batch(self, events, geo_updates):
+        """Commit new events, then (event_id, geo, event_type, campaign) updates, as one unit"""
+        raise NotImplementedError
+
+    def query(self, event_type=None, since=None, until=None, tracking_id=None, descending=False, limit=None,
+              tracking_prefix=None):
+        """Yield events matching the filters, oldest first unless descending"""
+        raise NotImplementedError
+
+    def tail(self, watermark=None):
+        """Yield (event, watermark) for everything stored after a watermark.
+
+        Watermarks are opaque and JSON-serialisable; pass the last one seen
+        to resume. Backends that record geolocation separately also yield
+        their {"event_type": "geo"} records.
+        """
+        raise NotImplementedError
+
+    def has_watermark(self, watermark):
+        """False if the data behind a watermark was truncated or replaced"""
+        raise NotImplementedError
+
+    def latest_watermark(self):
+        """Watermark covering everything stored so far"""
+        raise NotImplementedError
+
+    def geo_for(self, event_ids, campaign=None):
+        """{event_id: geo} for events whose geolocation is stored in place.
+
+        Backends that append geo records instead return nothing; their
+        records arrive through tail().
+        """
+        return {}
+
+    def change_token(self):
+        """Opaque value that changes whenever anything is written (for ETags)"""
+        return json.dumps(self.latest_watermark())
+
+    def page(self, event_type=None, since=None, until=None, tracking_id=None, after=None, limit=100):
+        """One page ordered by (timestamp, seq) starting after the (timestamp, seq) cursor.
+
+        Returns a list of ([timestamp, seq], event) pairs. This generic
+        version numbers events by their position in query(); backends with
+        an index override it.
+        """
+        keyed = [((event.get('timestamp', ''), position), event) for position, event
+                 in enumerate(self.query(event_type, since=since, until=until, tracking_id=tracking_id))]
+        keyed.sort(key=lambda item: item[0])
+        if after:
+            after = tuple(after)
+            keyed = [item for item in keyed if item[0] > after]
+        return [(list(key), event) for key, event in keyed[:limit]]
+
+class JSONLEventStore(EventStore):
+    """Append-only JSON lines, one file per event type.
+
+    Geolocation arrives later as a follow-up {"event_type": "geo"} record
+    which is merged back into its event when the log is read.
+
+    With rotation enabled the active log rolls over by size and/or day into
+    compressed segments under segments_dir. Each log keeps a manifest
+    ({log}.manifest.json) listing its segments with a generation number,
+    time range and event count, so reads only open segments that overlap
+    the requested window.
+    """
+
+    def __init__(self, log_files, fsync=False, max_bytes=None, rotate_daily=False,
+                 compression='gzip', segments_dir='segments'):
+        self.log_files = log_files  # event_type -> path
+        self.fsync = fsync
+        self.max_bytes = max_bytes
+        self.rotate_daily = rotate_daily
+        self.compression = compression
+        if compression == 'zstd' and zstandard is None:
+            log.warning('STORE', 'zstandard not installed, compressing segments with gzip')
+            self.compression = 'gzip'
+        self.segments_dir = segments_dir
+        self.lock = threading.Lock()
+        self.manifests = {}
+        self.active_day = {}
+        for log_file in log_files.values():
+            self._recover_rotation(log_file)
+
+    def append(self, event):
+        self.write_batch([event], [])
+
+    def update_geo(self, event_id, geo, event_type=None, campaign=None):
+        self.write_batch([], [(event_id, geo, event_type, campaign)])
+
+    def geo_record(self, event_id, geo):
+        record = {"event_type": "geo", "event_id": event_id}
+        for field in GEO_FIELDS:
+            record[field] = geo.get(field)
+        return record
+
+    def write_batch(self, events, geo_updates):
+        """One write (and optional fsync) per log file for the whole batch"""
+        lines = {}
+        days = {}
+        for event in events:
+            log_file = self.log_files[event['event_type']]
+            lines.setdefault(log_file, []).append(json.dumps(event) + "\n")
+            days.setdefault(log_file, event.get('timestamp', '')[:10])
+        for event_id, geo, event_type, _ in geo_updates:
+            lines.setdefault(self.log_files[event_type or 'click'], []).append(json.dumps(self.geo_record(event_id, geo)) + "\n")
+        with self.lock:
+            for log_file, chunk in lines.items():
+                data = ''.join(chunk)
+                self._maybe_rotate(log_file, len(data.encode('utf-8')), days.get(log_file))
+                with open(log_file, "a") as f:
+                    f.write(data)
+                    if self.fsync:
+                        f.flush()
+                        os.fsync(f.fileno())
+                if log_file in days and not self.active_day.get(log_file):
+                    self.active_day[log_file] = days[log_file]
+
+    # ---- Rotation ----
+
+    def manifest(self, log_file):
+        """Segment manifest for a log: {"generation": n, "segments": [...]}"""
+        if log_file not in self.manifests:
+            path = log_file + '.manifest.json'
+            manifest = {'generation': 0, 'segments': []}
+            try:
+                if os.path.exists(path):
+                    with open(path, 'r') as f:
+                        manifest = json.load(f)
+            except Exception as e:
+                log.error('STORE', 'Error reading manifest', path=path, error=e)
+            self.manifests[log_file] = manifest
+        return self.manifests[log_file]
+
+    def _save_manifest(self, log_file):
+        path = log_file + '.manifest.json'
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.manifests[log_file], f, indent=2)
+        os.replace(path + '.tmp', path)
+
+    def _maybe_rotate(self, log_file, incoming_bytes, day):
+        if not os.path.exists(log_file):
+            return
+        size = os.path.getsize(log_file)
+        if size == 0:
+            return
+        if self.max_bytes and size + incoming_bytes > self.max_bytes:
+            self.rotate(log_file)
+        elif self.rotate_daily and day:
+            if log_file not in self.active_day:
+                self.active_day[log_file] = self._first_timestamp(log_file)[:10]
+            if self.active_day[log_file] and self.active_day[log_file] != day:
+                self.rotate(log_file)
+
+    def _first_timestamp(self, log_file):
+        with open(log_file, 'r') as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except:
+                    continue
+                if event.get('timestamp'):
+                    return event['timestamp']
+        return ''
+
+    def rotate(self, log_file):
+        """Close the active log as a compressed segment and start a new one"""
+        if not os.path.exists(log_file) or os.path.getsize(log_file) == 0:
+            return None
+        # Renaming first means a crash mid-rotation leaves the data in exactly one place
+        os.replace(log_file, log_file + '.rotating')
+        self.active_day.pop(log_file, None)
+        return self._finish_rotation(log_file)
+
+    def _recover_rotation(self, log_file):
+        if os.path.exists(log_file + '.rotating'):
+            log.warning('STORE', 'Completing interrupted rotation', log=log_file)
+            self._finish_rotation(log_file)
+
+    def _finish_rotation(self, log_file):
+        pending = log_file + '.rotating'
+        manifest = self.manifest(log_file)
+        segment = self._write_segment(log_file, pending, manifest['generation'])
+        manifest['segments'].append(segment)
+        manifest['generation'] += 1
+        self._save_manifest(log_file)
+        os.remove(pending)
+        log.info('STORE', 'Rotated', log=log_file, segment=segment['path'], events=segment['events'])
+        return segment['path']
+
+    def _write_segment(self, log_file, source, generation):
+        """Compress a plain log into segments_dir and describe it for the manifest"""
+        first_ts = last_ts = None
+        events = 0
+        raw_bytes = 0
+        with open(source, 'rb') as f:
+            for line in f:
+                raw_bytes += len(line)
+                try:
+                    event = json.loads(line)
+                except:
+                    continue
+                if event.get('event_type') == 'geo':
+                    continue
+                events += 1
+                timestamp = event.get('timestamp')
+                if timestamp:
+                    first_ts = timestamp if first_ts is None or timestamp < first_ts else first_ts
+                    last_ts = timestamp if last_ts is None or timestamp > last_ts else last_ts
+
+        os.makedirs(self.segments_dir, exist_ok=True)
+        suffix = '.zst' if self.compression == 'zstd' else '.gz'
+        stamp = (first_ts or '')[:19].replace('-', '').replace(':', '')
+        segment_path = os.path.join(self.segments_dir, f"{os.path.basename(log_file)}.{generation:06d}.{stamp}{suffix}")
+        with open(source, 'rb') as src, self._open_segment_for_write(segment_path + '.tmp') as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(segment_path + '.tmp', segment_path)
+        return {
+            'generation': generation,
+            'path': segment_path,
+            'first_timestamp': first_ts,
+            'last_timestamp': last_ts,
+            'events': events,
+            'bytes': raw_bytes,
+            'compressed_bytes': os.path.getsize(segment_path)
+        }
+
+    def adopt_segment(self, log_file, path):
+        """Add an old manual backup (e.g. clicks.log.backup.*) as a segment.
+
+        Adopted segments get negative generations so they sort before
+        everything else without renumbering existing segments.
+        """
+        with self.lock:
+            manifest = self.manifest(log_file)
+            oldest = min([segment['generation'] for segment in manifest['segments']] + [0])
+            segment = self._write_segment(log_file, path, oldest - 1)
+            manifest['segments'].insert(0, segment)
+            self._save_manifest(log_file)
+        return segment
+
+    def _open_segment_for_write(self, path):
+        if self.compression == 'zstd':
+            return zstandard.ZstdCompressor().stream_writer(open(path, 'wb'), closefd=True)
+        return gzip.open(path, 'wb')
+
+    def _open_segment(self, path):
+        """Binary file object yielding the uncompressed segment bytes"""
+        if path.endswith('.zst'):
+            if zstandard is None:
+                raise RuntimeError(f"zstandard is required to read {path}")
+            return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True))
+        if path.endswith('.gz'):
+            return gzip.open(path, 'rb')
+        return open(path, 'rb')
+
+    def segments_for(self, log_file, since=None, until=None):
+        """Segments overlapping [since, until), plus the one after the last match,
+        which may hold geo records for events near its boundary"""
+        selected = []
+        take_next = False
+        for segment in self.manifest(log_file)['segments']:
+            first_ts = segment.get('first_timestamp') or ''
+            last_ts = segment.get('last_timestamp') or ''
+            overlaps = (not since or last_ts >= since) and (not until or first_ts < until)
+            if overlaps or take_next:
+                selected.append(segment)
+            take_next = overlaps
+        return selected
+
+    # ---- Reads ----
+
+    def _iter_lines(self, log_file, since=None, until=None):
+        for segment in self.segments_for(log_file, since, until):
+            try:
+                with self._open_segment(segment['path']) as f:
+                    for line in f:
+                        yield line
+            except Exception as e:
+                log.error('STORE', 'Error reading segment', segment=segment['path'], error=e)
+        if os.path.exists(log_file):
+            with open(log_file, 'rb') as f:
+                for line in f:
+                    yield line
+
+    def read_log(self, log_file, since=None, until=None, lookahead=GEO_LOOKAHEAD):
+        """Yield one log's events, merging geo follow-up records into them.
+
+        An event without geolocation is held back, with everything after it,
+        until its geo record turns up or `lookahead` events are waiting.
+        """
+        waiting = deque()  # Events in log order; the oldest goes out once it has its geo
+        by_id = {}  # event_id -> event in `waiting` still without geo
+        for line in self._iter_lines(log_file, since, until):
+            try:
+                event = json.loads(line)
+            except:
+                continue
+            if event.get('event_type') == 'geo':
+                target = by_id.pop(event.get('event_id'), None)
+                if target is not None:
+                    for field in GEO_FIELDS:
+                        target[field] = event.get(field)
+            else:
+                waiting.append(event)
+                if 'event_id' in event and 'country' not in event:
+                    by_id[event['event_id']] = event
+            while waiting and (len(waiting) > lookahead or waiting[0].get('event_id') not in by_id):
+                event = waiting.popleft()
+                by_id.pop(event.get('event_id'), None)
+                yield event
+        yield from waiting
+
+    def query(self, event_type=None, since=None, until=None, tracking_id=None, descending=False, limit=None,
+              tracking_prefix=None):
+        types = [event_type] if event_type else list(self.log_files)
+        events = (event for kind in types for event in self.read_log(self.log_files[kind], since, until)
+                  if event.get('event_type') == kind
+                  and not (since and event.get('timestamp', '') < since)
+                  and not (until and event.get('timestamp', '') >= until)
+                  and not (tracking_id and event.get('tracking_id') != tracking_id)
+                  and not (tracking_prefix and not event.get('tracking_id', '').startswith(tracking_prefix)))
+        if descending:
+            # Newest first needs the whole (filtered) result
+            events = reversed(list(events))
+        return itertools.islice(events, limit) if limit else events
+
+    # ---- Tailing ----
+
+    def _position(self, watermark, log_file):
+        """(generation, byte offset) reached in a log; the start of generation 0 if never read"""
+        return tuple((watermark or {}).get(log_file, (0, 0)))
+
+    def tail(self, watermark=None):
+        """Read everything after the saved (generation, byte offset) of each log"""
+        positions = {log_file: list(self._position(watermark, log_file)) for log_file in self.log_files.values()}
+        for log_file in self.log_files.values():
+            generation, offset = positions[log_file]
+            manifest = self.manifest(log_file)
+            sources = [(segment['generation'], segment['path'], True) for segment in manifest['segments']
+                       if segment['generation'] >= generation]
+            sources.append((manifest['generation'], log_file, False))
+            for source_generation, path, compressed in sources:
+                if not os.path.exists(path):
+                    continue
+                skip = offset if source_generation == generation else 0
+                position = 0
+                with (self._open_segment(path) if compressed else open(path, 'rb')) as f:
+                    if not compressed:
+                        f.seek(skip)
+                        position = skip
+                    for line in f:
+                        if position < skip:
+                            position += len(line)
+                            continue
+                        if not line.endswith(b"\n"):
+                            break  # Partially written line, pick it up next time
+                        position += len(line)
+                        positions[log_file] = [source_generation, position]
+                        try:
+                            event = json.loads(line)
+                        except:
+                            continue
+                        yield event, {key: list(value) for key, value in positions.items()}
+
+    def has_watermark(self, watermark):
+        for log_file in self.log_files.values():
+            generation, offset = self._position(watermark, log_file)
+            manifest = self.manifest(log_file)
+            if generation > manifest['generation']:
+                return False
+            if generation == manifest['generation']:
+                size = os.path.getsize(log_file) if os.path.exists(log_file) else 0
+                if size < offset:
+                    return False
+            elif not any(segment['generation'] == generation for segment in manifest['segments']):
+                return False
+        return True
+
+    def latest_watermark(self):
+        return {log_file: [self.manifest(log_file)['generation'],
+                           os.path.getsize(log_file) if os.path.exists(log_file) else 0]
+                for log_file in self.log_files.values()}
+
+class SQLiteEventStore(EventStore):
+    """Indexed SQLite event table in WAL mode, one connection per thread"""
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS events (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_id TEXT UNIQUE,
+            event_type TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            tracking_id TEXT,
+            target_url TEXT,
+            ip_address TEXT,
+            user_agent TEXT,
+            referrer TEXT,
+            country TEXT,
+            city TEXT,
+            isp TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_events_type_ts ON events (event_type, timestamp);
+        CREATE INDEX IF NOT EXISTS idx_events_tracking_id ON events (tracking_id);
+        CREATE INDEX IF NOT EXISTS idx_events_ts ON events (timestamp);
+        CREATE TABLE IF NOT EXISTS store_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+        INSERT OR IGNORE INTO store_meta (key, value) VALUES ('version', 0);
+    '''
+
+    def __init__(self, path, fsync=False):
+        self.path = path
+        self.fsync = fsync
+        self.local = threading.local()
+        self.connection().executescript(self.SCHEMA)
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=FULL' if self.fsync else 'PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+
+    def append(self, event):
+        self.append_many([event])
+
+    def append_many(self, events):
+        """Insert events in one transaction; duplicates (same event_id) are ignored"""
+        conn = self.connection()
+        with conn:
+            added = conn.executemany(
+                f"INSERT OR IGNORE INTO events ({', '.join(EVENT_FIELDS)}) VALUES ({', '.join('?' * len(EVENT_FIELDS))})",
+                [[event.get(field) for field in EVENT_FIELDS] for event in events]
+            ).rowcount
+            conn.execute("UPDATE store_meta SET value = value + 1 WHERE key = 'version'")
+        return added
+
+    def update_geo(self, event_id, geo, event_type=None, campaign=None):
+        self.write_batch([], [(event_id, geo, event_type, campaign)])
+
+    def write_batch(self, events, geo_updates):
+        """Inserts and geo updates in a single transaction"""
+        conn = self.connection()
+        with conn:
+            if events:
+                conn.executemany(
+                    f"INSERT OR IGNORE INTO events ({', '.join(EVENT_FIELDS)}) VALUES ({', '.join('?' * len(EVENT_FIELDS))})",
+                    [[event.get(field) for field in EVENT_FIELDS] for event in events]
+                )
+            if geo_updates:
+                conn.executemany(
+                    "UPDATE events SET country = ?, city = ?, isp = ? WHERE event_id = ?",
+                    [[geo.get('country'), geo.get('city'), geo.get('isp'), event_id] for event_id, geo, _, _ in geo_updates]
+                )
+            # Geo updates don't move MAX(seq), so bump an explicit version for change_token()
+            conn.execute("UPDATE store_meta SET value = value + 1 WHERE key = 'version'")
+
+    def _where(self, event_type=None, since=None, until=None, tracking_id=None, tracking_prefix=None):
+        clauses = []
+        params = []
+        if event_type:
+            clauses.append("event_type = ?")
+            params.append(event_type)
+        if since:
+            clauses.append("timestamp >= ?")
+            params.append(since)
+        if until:
+            clauses.append("timestamp < ?")
+            params.append(until)
+        if tracking_id:
+            clauses.append("tracking_id = ?")
+            params.append(tracking_id)
+        if tracking_prefix:
+            # Range scan on idx_events_tracking_id; LIKE 'x%' can't use the index
+            clauses.append("tracking_id >= ? AND tracking_id < ?")
+            params.extend([tracking_prefix, tracking_prefix[:-1] + chr(ord(tracking_prefix[-1]) + 1)])
+        return clauses, params
+
+    def query(self, event_type=None, since=None, until=None, tracking_id=None, descending=False, limit=None,
+              tracking_prefix=None):
+        clauses, params = self._where(event_type, since, until, tracking_id, tracking_prefix)
+        sql = f"SELECT {', '.join(EVENT_FIELDS)} FROM events"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY seq DESC" if descending else " ORDER BY seq"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        for row in self.connection().execute(sql, params):
+            yield {key: row[key] for key in row.keys() if row[key] is not None}
+
+    def page(self, event_type=None, since=None, until=None, tracking_id=None, after=None, limit=100):
+        """Keyset pagination on (timestamp, seq), served by the timestamp indexes"""
+        clauses, params = self._where(event_type, since, until, tracking_id)
+        if after:
+            clauses.append("(timestamp, seq) > (?, ?)")
+            params.extend(after)
+        sql = f"SELECT seq, {', '.join(EVENT_FIELDS)} FROM events"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY timestamp, seq LIMIT ?"
+        params.append(limit)
+        return [([row['timestamp'], row['seq']], {key: row[key] for key in EVENT_FIELDS if row[key] is not None})
+                for row in self.connection().execute(sql, params)]
+
+    def change_token(self):
+        return self.connection().execute("SELECT value FROM store_meta WHERE key = 'version'").fetchone()[0]
+
+    def delete_events(self, event_ids):
+        """Remove events by event_id (used when moving them to another partition)"""
+        conn = self.connection()
+        with conn:
+            removed = conn.executemany("DELETE FROM events WHERE event_id = ?", [[event_id] for event_id in event_ids]).rowcount
+            conn.execute("UPDATE store_meta SET value = value + 1 WHERE key = 'version'")
+        return removed
+
+    def tail(self, watermark=None):
+        """Events with a sequence number above the watermark, in order"""
+        sql = f"SELECT seq, {', '.join(EVENT_FIELDS)} FROM events WHERE seq > ? ORDER BY seq"
+        for row in self.connection().execute(sql, [watermark or 0]):
+            yield {key: row[key] for key in EVENT_FIELDS if row[key] is not None}, row['seq']
+
+    def has_watermark(self, watermark):
+        latest = self.connection().execute("SELECT MAX(seq) FROM events").fetchone()[0] or 0
+        return (watermark or 0) <= latest
+
+    def latest_watermark(self):
+        return self.connection().execute("SELECT MAX(seq) FROM events").fetchone()[0] or 0
+
+    def geo_for(self, event_ids, campaign=None):
+        event_ids = list(event_ids)
+        found = {}
+        for start in range(0, len(event_ids), 500):
+            chunk = event_ids[start:start + 500]
+            sql = (f"SELECT event_id, country, city, isp FROM events "
+                   f"WHERE country IS NOT NULL AND event_id IN ({', '.join('?' * len(chunk))})")
+            for row in self.connection().execute(sql, chunk):
+                found[row['event_id']] = {field: row[field] for field in GEO_FIELDS}
+        return found
+
+class PartitionedEventStore(EventStore):
+    """One store per campaign, each in its own directory under root_dir.
+
+    Events are routed by their 'campaign' field. Events without one go to
+    the default partition, which is the store that existed before
+    partitioning (events.db or clicks.log/opens.log), so old history stays
+    where it is. Reads for one campaign open only that partition; reads
+    across campaigns merge the partitions by timestamp.
+
+    Watermarks are {partition: partition watermark} and page() keys are
+    [timestamp, partition, seq].
+    """
+
+    def __init__(self, root_dir, open_partition, default_store):
+        self.root_dir = root_dir
+        self.open_partition = open_partition  # directory -> EventStore
+        self.lock = threading.Lock()
+        self.partitions = {DEFAULT_PARTITION: default_store}
+        os.makedirs(root_dir, exist_ok=True)
+        for name in sorted(os.listdir(root_dir)):
+            if os.path.isdir(os.path.join(root_dir, name)) and self.valid_name(name):
+                self.partition(name)
+
+    @staticmethod
+    def valid_name(name):
+        return bool(name) and not name.startswith('.') and set(name) <= PARTITION_NAME_CHARS
+
+    def partition(self, campaign, create=True):
+        """Store for a campaign (None = default); None if it doesn't exist and create is False"""
+        name = campaign or DEFAULT_PARTITION
+        store = self.partitions.get(name)
+        if store is not None or not create:
+            return store
+        if not self.valid_name(name):
+            raise ValueError(f"Invalid campaign name: {name!r}")
+        with self.lock:
+            store = self.partitions.get(name)
+            if store is None:
+                directory = os.path.join(self.root_dir, name)
+                os.makedirs(directory, exist_ok=True)
+                store = self.partitions[name] = self.open_partition(directory)
+        return store
+
+    def partition_names(self):
+        return sorted(self.partitions)
+
+    def discover(self):
+        """Open partitions another process created since we started; returns their names"""
+        found = []
+        for name in sorted(os.listdir(self.root_dir)):
+            if name not in self.partitions and self.valid_name(name) and os.path.isdir(os.path.join(self.root_dir, name)):
+                self.partition(name)
+                found.append(name)
+        return found
+
+    def _selected(self, campaign):
+        """(name, store) pairs a read touches: one partition, or all of them"""
+        if campaign is None:
+            return [(name, self.partitions[name]) for name in self.partition_names()]
+        store = self.partition(campaign, create=False)
+        return [(campaign, store)] if store is not None else []
+
+    @staticmethod
+    def _labelled(name, events):
+        """Tag events read from a campaign partition with its name"""
+        for event in events:
+            if name != DEFAULT_PARTITION:
+                event['campaign'] = name
+            yield event
+
+    def append(self, event):
+        self.write_batch([event], [])
+
+    def update_geo(self, event_id, geo, event_type=None, campaign=None):
+        self.write_batch([], [(event_id, geo, event_type, campaign)])
+
+    def write_batch(self, events, geo_updates):
+        """Split the batch by partition; each partition commits its part as one unit"""
+        batches = {}
+        for event in events:
+            batches.setdefault(event.get('campaign') or DEFAULT_PARTITION, ([], []))[0].append(event)
+        for update in geo_updates:
+            batches.setdefault(update[3] or DEFAULT_PARTITION, ([], []))[1].append(update)
+        for name, (partition_events, partition_geo) in batches.items():
+            self.partition(name).write_batch(partition_events, partition_geo)
+
+    def query(self, event_type=None, since=None, until=None, tracking_id=None, descending=False, limit=None,
+              tracking_prefix=None, campaign=None):
+        """Events from one campaign's partition, or all partitions merged by timestamp"""
+        sources = [self._labelled(name, store.query(event_type, since=since, until=until, tracking_id=tracking_id,
+                                                    descending=descending, limit=limit, tracking_prefix=tracking_prefix))
+                   for name, store in self._selected(campaign)]
+        if len(sources) == 1:
+            return sources[0]
+        merged = heapq.merge(*sources, key=lambda event: event.get('timestamp', ''), reverse=descending)
+        return itertools.islice(merged, limit) if limit else merged
+
+    def page(self, event_type=None, since=None, until=None, tracking_id=None, after=None, limit=100, campaign=None):
+        """Keyset page across partitions ordered by (timestamp, partition, seq)"""
+        rows = []
+        for name, store in self._selected(campaign):
+            partition_after = None
+            if after:
+                timestamp, after_name, seq = after
+                if name < after_name:
+                    partition_after = [timestamp, 2 ** 63 - 1]  # Only later timestamps
+                elif name == after_name:
+                    partition_after = [timestamp, seq]
+                else:
+                    partition_after = [timestamp, -1]  # Same timestamp onwards
+            for (timestamp, seq), event in store.page(event_type, since=since, until=until, tracking_id=tracking_id,
+                                                      after=partition_after, limit=limit):
+                if name != DEFAULT_PARTITION:
+                    event['campaign'] = name
+                rows.append(([timestamp, name, seq], event))
+        rows.sort(key=lambda row: row[0])
+        return rows[:limit]
+
+    def tail(self, watermark=None):
+        """Everything past each partition's watermark, merged roughly by timestamp"""
+        positions = dict(watermark or {})
+
+        def keyed(name, store):
+            # Geo records carry no timestamp; keep them right behind their event
+            timestamp = ''
+            for event, partition_watermark in store.tail(positions.get(name)):
+                timestamp = event.get('timestamp', timestamp)
+                if name != DEFAULT_PARTITION and event.get('event_type') != 'geo':
+                    event['campaign'] = name
+                yield timestamp, name, event, partition_watermark
+
+        sources = [keyed(name, self.partitions[name]) for name in self.partition_names()]
+        for _, name, event, partition_watermark in heapq.merge(*sources, key=lambda item: item[0]):
+            positions[name] = partition_watermark
+            yield event, dict(positions)
+
+    def has_watermark(self, watermark):
+        if not isinstance(watermark, dict):
+            return watermark is None
+        for name, partition_watermark in watermark.items():
+            store = self.partition(name, create=False)
+            if store is None or not store.has_watermark(partition_watermark):
+                return False
+        return True
+
+    def latest_watermark(self):
+        return {name: self.partitions[name].latest_watermark() for name in self.partition_names()}
+
+    def change_token(self, campaign=None):
+        return json.dumps({name: store.change_token() for name, store in self._selected(campaign)})
+
+    def geo_for(self, event_ids, campaign=None):
+        store = self.partition(campaign, create=False)
+        return store.geo_for(event_ids) if store is not None else {}
+
+    def split_default(self, campaign_for):
+        """Move default-partition events whose tracking ID belongs to a campaign into that partition.
+
+        campaign_for maps a tracking ID to a campaign name or None. Only a
+        SQLite default partition can give events up; JSONL logs are
+        append-only, so their history stays in the default partition.
+        """
+        default = self.partitions[DEFAULT_PARTITION]
+        if not hasattr(default, 'delete_events'):
+            log.info('STORE', 'Default partition is append-only, leaving existing events in place')
+            return 0
+        moved = {}
+        for event in default.query():
+            campaign = campaign_for(event.get('tracking_id', ''))
+            if campaign and self.valid_name(campaign) and campaign != DEFAULT_PARTITION:
+                moved.setdefault(campaign, []).append(dict(event, campaign=campaign))
+        total = 0
+        for campaign, events in moved.items():
+            self.partition(campaign).write_batch(events, [])
+            default.delete_events([event['event_id'] for event in events])
+            total += len(events)
+            log.info('STORE', 'Moved events to their campaign partition', campaign=campaign, events=len(events))
+        return total
+
+def open_event_store(backend, db_path, log_files, fsync=False, rotation=None, partitions_dir=None):
+    """Create the configured backend ('sqlite' or 'jsonl').
+
+    rotation holds JSONLEventStore options (max_bytes, rotate_daily,
+    compression, segments_dir) and is ignored for SQLite. With
+    partitions_dir, the store becomes the default partition of a
+    PartitionedEventStore whose campaign partitions use the same backend.
+    """
+    if backend == 'jsonl':
+        store = JSONLEventStore(log_files, fsync=fsync, **(rotation or {}))
+    elif backend == 'sqlite':
+        store = SQLiteEventStore(db_path, fsync=fsync)
+    else:
+        raise ValueError(f"Unknown event store backend: {backend}")
+    if not partitions_dir:
+        return store
+
+    def open_partition(directory):
+        if backend == 'jsonl':
+            options = dict(rotation or {}, segments_dir=os.path.join(directory, 'segments'))
+            return JSONLEventStore({'click': os.path.join(directory, 'clicks.log'),
+                                    'open': os.path.join(directory, 'opens.log')}, fsync=fsync, **options)
+        return SQLiteEventStore(os.path.join(directory, 'events.db'), fsync=fsync)
+
+    return PartitionedEventStore(partitions_dir, open_partition, store)
+
+class BatchedEventWriter:
+    """Single writer thread that group-commits events to a store.
+
+    Request threads only put onto a queue.SimpleQueue (no Python-level
+    locking). The writer waits for the first item, then gathers more for
+    up to max_latency seconds or max_batch items and commits them with a
+    single write_batch() call. Geo updates travel through the same queue,
+    so they always land after the event they belong to. on_commit(seconds),
+    if given, is called with the duration of every successful commit.
+
+    A batch that fails to commit (e.g. "database is locked") is retried
+    with backoff, holding back everything queued behind it, rather than
+    dropped; only at shutdown, once stop()'s timeout runs out, is it given up.
+    """
+
+    def __init__(self, store, max_batch=500, max_latency=0.05, on_commit=None,
+                 retry_delay=WRITE_RETRY_DELAY, retry_max_delay=WRITE_RETRY_MAX_DELAY):
+        self.store = store
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.on_commit = on_commit
+        self.retry_delay = retry_delay
+        self.retry_max_delay = retry_max_delay
+        self.stop_deadline = None  # monotonic time by which stop() wants the queue flushed
+        self.queue = queue.SimpleQueue()
+        self.batches = 0
+        self.events_written = 0
+        self.geo_written = 0
+        self.errors = 0
+        self.retries = 0
+        self.lost = 0
+        self.last_commit_ms = 0.0
+        self.max_commit_ms = 0.0
+        self.total_commit_ms = 0.0
+        self.thread = threading.Thread(target=self._run, name="event-writer", daemon=True)
+        self.thread.start()
+
+    def append(self, event):
+        self.queue.put(('event', event))
+
+    def update_geo(self, event_id, geo, event_type=None, campaign=None):
+        self.queue.put(('geo', (event_id, geo, event_type, campaign)))
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.max_latency
+            while len(batch) < self.max_batch and batch[-1] is not None:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stopping = batch[-1] is None
+            items = [item for item in batch if item is not None]
+            if items:
+                self._write(items)
+            if stopping:
+                return
+
+    def _write(self, items):
+        delay = self.retry_delay
+        while not self._commit(items):
+            deadline = self.stop_deadline
+            if deadline is not None and time.monotonic() + delay > deadline:
+                self.lost += len(items)
+                log.error('STORE', 'Shutting down with a batch that would not commit; dropped', items=len(items))
+                return
+            self.retries += 1
+            time.sleep(delay)
+            delay = min(delay * 2, self.retry_max_delay)
+
+    def _commit(self, items):
+        events = [payload for kind, payload in items if kind == 'event']
+        geo_updates = [payload for kind, payload in items if kind == 'geo']
+        started = time.perf_counter()
+        try:
+            self.store.write_batch(events, geo_updates)
+        except Exception as e:
+            self.errors += 1
+            log.error('STORE', 'Failed to commit batch, retrying', items=len(items), error=e)
+            return False
+        elapsed = time.perf_counter() - started
+        if self.on_commit is not None:
+            self.on_commit(elapsed)
+        elapsed_ms = elapsed * 1000
+        self.batches += 1
+        self.events_written += len(events)
+        self.geo_written += len(geo_updates)
+        self.last_commit_ms = elapsed_ms
+        self.max_commit_ms = max(self.max_commit_ms, elapsed_ms)
+        self.total_commit_ms += elapsed_ms
+        return True
+
+    def stop(self, timeout=10):
+        """Flush everything queued so far and stop the writer thread"""
+        if self.thread.is_alive():
+            self.stop_deadline = time.monotonic() + timeout
+            self.queue.put(None)
+            self.thread.join(timeout)
+
+    def stats(self):
+        """Queue depth and commit latency for monitoring"""
+        return {
+            'queue_depth': self.queue.qsize(),
+            'batches': self.batches,
+            'events_written': self.events_written,
+            'geo_updates_written': self.geo_written,
+            'errors': self.errors,
+            'retries': self.retries,
+            'events_lost': self.lost,
+            'avg_batch_size': round((self.events_written + self.geo_written) / self.batches, 2) if self.batches else 0.0,
+            'last_commit_ms': round(self.last_commit_ms, 3),
+            'avg_commit_ms': round(self.total_commit_ms / self.batches, 3) if self.batches else 0.0,
+            'max_commit_ms': round(self.max_commit_ms, 3)
+        }
+
+class StoreFollower:
+    """Applies events that other processes write to a shared store, by tailing it on a thread.
+
+    Events this process logged itself are registered with own() and dropped
+    when they come through the tail; the rest go to on_event(event). Their
+    geolocation is handed to on_geo(event, geo) once another process has
+    stored it (geo records in the tail, or geo_for() for backends that
+    update events in place), or as {} after geo_wait seconds.
+    """
+
+    def __init__(self, store, watermark, on_event, on_geo, interval=1.0, geo_wait=60.0):
+        self.store = store
+        self.watermark = watermark
+        self.on_event = on_event
+        self.on_geo = on_geo
+        self.interval = interval
+        self.geo_wait = geo_wait
+        self.own_ids = set()
+        self.pending = {}  # event_id -> (event, monotonic time first seen)
+        self.lock = threading.RLock()  # on_event/on_geo may hold the follower still too
+        self.events_followed = 0
+        self.thread = None
+
+    def own(self, event_id):
+        self.own_ids.add(event_id)
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="store-follower", daemon=True)
+        self.thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.poll()
+            except Exception as e:
+                log.error('FOLLOW', 'Error tailing the event store', error=e)
+
+    def poll(self):
+        """Apply everything past our watermark; returns how many foreign events that was"""
+        with self.lock:
+            if hasattr(self.store, 'discover'):
+                self.store.discover()
+            count = 0
+            for event, watermark in self.store.tail(self.watermark):
+                self.watermark = watermark
+                event_id = event.get('event_id')
+                if event.get('event_type') == 'geo':
+                    pending = self.pending.pop(event_id, None)
+                    if pending:
+                        self.on_geo(pending[0], event)
+                elif event_id in self.own_ids:
+                    self.own_ids.discard(event_id)
+                else:
+                    self.on_event(event)
+                    count += 1
+                    if 'country' not in event and event_id:
+                        self.pending[event_id] = (event, time.monotonic())
+            self.events_followed += count
+            self._poll_geo()
+            return count
+
+    def _poll_geo(self):
+        by_campaign = {}
+        for event_id, (event, _) in self.pending.items():
+            by_campaign.setdefault(event.get('campaign'), []).append(event_id)
+        for campaign, event_ids in by_campaign.items():
+            for event_id, geo in self.store.geo_for(event_ids, campaign).items():
+                self.on_geo(self.pending.pop(event_id)[0], geo)
+        cutoff = time.monotonic() - self.geo_wait
+        for event_id in [event_id for event_id, (_, seen) in self.pending.items() if seen < cutoff]:
+            self.on_geo(self.pending.pop(event_id)[0], {})
+
+    def stats(self):
+        return {'events_followed': self.events_followed, 'awaiting_geo': len(self.pending)}
+
+def import_jsonl(store, log_files):
+    """One-shot import of JSON-lines logs into a store.
+
+    Legacy events without an event_id get one derived from the line itself,
+    so running the import twice doesn't duplicate anything.
+    """
+    imported = 0
+    for log_file in log_files:
+        if not os.path.exists(log_file):
+            continue
+        batch = []
+        geo_updates = []
+        with open(log_file, "r") as f:
+            for line in f:
+                line = line.strip()
+                try:
+                    event = json.loads(line)
+                except:
+                    continue
+                if event.get('event_type') == 'geo':
+                    geo_updates.append(event)
+                    continue
+                if event.get('event_type') not in ('click', 'open'):
+                    continue
+                event.setdefault('event_id', hashlib.sha1(line.encode('utf-8')).hexdigest()[:32])
+                batch.append(event)
+        if hasattr(store, 'append_many'):
+            added = store.append_many(batch)
+        else:
+            for event in batch:
+                store.append(event)
+            added = len(batch)
+        types = {event['event_id']: event['event_type'] for event in batch}
+        for record in geo_updates:
+            if record.get('event_id') in types:
+                store.update_geo(record['event_id'], record, types[record['event_id']])
+        imported += added
+        log.info('STORE', 'Imported events', log=log_file, imported=added, read=len(batch))
+    return imported
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 4 and sys.argv[1] == '--adopt':
+        # Bring old manual backups back into the JSONL store's segment manifest
+        log_file = sys.argv[2]
+        store = JSONLEventStore({'log': log_file})
+        for backup in sys.argv[3:]:
+            segment = store.adopt_segment(log_file, backup)
+            print(f"✅ {backup} -> {segment['path']} ({segment['events']} events)")
+        print("Delete dashboard_state.json so the dashboard recounts the adopted events.")
+        sys.exit(0)
+
+    if len(sys.argv) < 3:
+        print("Usage: python3 event_store.py events.db clicks.log [opens.log ...]")
+        print("       python3 event_store.py --adopt clicks.log clicks.log.backup.* ")
+        sys.exit(1)
+
+    db_path = sys.argv[1]
+    total = import_jsonl(SQLiteEventStore(db_path), sys.argv[2:])
+    print(f"✅ {total} events imported into {db_path}")
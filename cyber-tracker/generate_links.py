@@ -3,66 +3,298 @@
 Generate unique tracking links for email campaign
 """
 
+import io
 import csv
 import uuid
 import sys
 import os
+import json
+import time
+import argparse
+import threading
+import multiprocessing
 from urllib.parse import quote
+from tokens import TokenCodec, load_secret, campaign_number
+from recipients import RecipientDirectory
 
 # Configuration
 BASE_TRACKING_URL = "https://www.patrickcorr.me/track"  # CHANGE THIS
+DEFAULT_TARGET_URL = "https://portal.office.com"
+CHUNK_SIZE = 5000  # Rows per batch (and per task with --workers)
+PROGRESS_EVERY = 10000  # Rows between progress updates
+OUTPUT_BUFFER = 1 << 20  # Bytes buffered before each write to the output CSV
+NUMBERS_SUFFIX = '.numbers.json'  # Next to the campaign CSV: each recipient's token number, kept across runs
 
 def generate_tracking_id(employee_id):
     """Generate unique tracking ID for recipient"""
     random_part = uuid.uuid4().hex[:8]
     return f"{employee_id}_{random_part}"
 
+# Most campaigns send everyone to the same few target URLs
+_encoded_urls = {}
+
 def generate_tracking_link(tracking_id, target_url):
     """Generate full tracking URL"""
-    encoded_url = quote(target_url, safe='')
+    encoded_url = _encoded_urls.get(target_url)
+    if encoded_url is None:
+        encoded_url = quote(target_url, safe='')
+        if len(_encoded_urls) < 10000:
+            _encoded_urls[target_url] = encoded_url
     return f"{BASE_TRACKING_URL}?id={tracking_id}&url={encoded_url}"
 
-def process_campaign(campaign_file):
-    """Process campaign CSV and generate tracking links"""
-    
+def column_layout(header, tokens=None):
+    """Where link_rows() reads the ID / target URL and writes tracking_id / tracking_link.
+
+    tokens: (secret, campaign number) to issue signed tokens instead of random IDs;
+    each recipient's number then comes from recipient_numbers().
+    """
+    fieldnames = list(header)
+    for column in ('tracking_id', 'tracking_link'):
+        if column not in fieldnames:
+            fieldnames.append(column)
+    if 'employee_id' in header:
+        id_column = header.index('employee_id')
+    elif 'email' in header:
+        id_column = header.index('email')
+    else:
+        id_column = None
+    url_column = header.index('target_url') if 'target_url' in header else None
+    return fieldnames, (id_column, url_column, len(fieldnames),
+                        fieldnames.index('tracking_id'), fieldnames.index('tracking_link'), tokens)
+
+# Worker processes build their codec from the secret in the layout, once
+_codecs = {}
+# Recipient key -> token number for the campaign being linked (set in each worker process too)
+_numbers = {}
+
+def token_codec(secret):
+    codec = _codecs.get(secret)
+    if codec is None:
+        codec = _codecs[secret] = TokenCodec(secret)
+    return codec
+
+def _set_numbers(numbers):
+    global _numbers
+    _numbers = numbers
+
+def recipient_key(row, id_column):
+    """Who a row is: its employee ID (else email), or the whole row if it has neither"""
+    value = row[id_column].strip().lower() if id_column is not None and id_column < len(row) else ''
+    return value or ','.join(row).rstrip(',')
+
+def numbers_path(campaign_file):
+    return os.path.splitext(campaign_file)[0] + NUMBERS_SUFFIX
+
+def recipient_numbers(campaign_file, id_column):
+    """Token number for every recipient in the CSV, from <campaign>.numbers.json.
+
+    Recipients keep the number they were first given, however the CSV is
+    later edited or re-sorted, so regenerating links never hands one
+    person's token to another; new recipients get numbers never used
+    before. The file is updated (atomically) when someone new appears.
+    """
+    path = numbers_path(campaign_file)
+    try:
+        with open(path) as f:
+            saved = json.load(f)
+    except FileNotFoundError:
+        saved = {'next': 1, 'recipients': {}}
+    numbers = saved['recipients']
+    next_number = saved['next']
+    with open(campaign_file, newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for row in reader:
+            if not any(row):
+                continue
+            key = recipient_key(row, id_column)
+            if key not in numbers:
+                numbers[key] = next_number
+                next_number += 1
+    if next_number != saved['next']:
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'next': next_number, 'recipients': numbers}, f)
+        os.replace(tmp_path, path)
+    return numbers
+
+def set_link(row, layout, random_part):
+    id_column, url_column, _, tid_column, link_column, tokens = layout
+    if tokens:
+        # Numbers are per recipient, so tokens are unique by construction (and stable across runs);
+        # token links carry no destination (the tracker sends them to /failed-test)
+        secret, campaign_no = tokens
+        tracking_id = token_codec(secret).encode(campaign_no, _numbers[recipient_key(row, id_column)])
+        row[tid_column] = tracking_id
+        row[link_column] = f"{BASE_TRACKING_URL}?id={tracking_id}"
+        return
+    emp_id = row[id_column] if id_column is not None else 'unknown'
+    tracking_id = f"{emp_id}_{random_part}"
+    target_url = (row[url_column] if url_column is not None else '') or DEFAULT_TARGET_URL
+    row[tid_column] = tracking_id
+    row[link_column] = generate_tracking_link(tracking_id, target_url)
+
+def link_rows(rows, layout):
+    """Fill in tracking_id / tracking_link for a batch of CSV rows (lists), in place"""
+    width = layout[2]
+    # One urandom call per batch instead of a uuid4() per row
+    random_parts = '' if layout[5] else os.urandom(4 * len(rows)).hex()
+    for number, row in enumerate(rows):
+        if len(row) < width:
+            row.extend([''] * (width - len(row)))
+        set_link(row, layout, random_parts[number * 8:number * 8 + 8])
+    return rows
+
+def read_chunks(reader, size=CHUNK_SIZE):
+    """Batches of parsed rows, skipping blank lines"""
+    chunk = []
+    for row in reader:
+        if not any(row):
+            continue
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def read_text_chunks(src, size=CHUNK_SIZE):
+    """Batches of raw CSV text, split only between records (a quoted field may span lines)"""
+    lines = []
+    quotes = 0
+    for line in src:
+        lines.append(line)
+        quotes += line.count('"')
+        if len(lines) >= size and quotes % 2 == 0:
+            yield ''.join(lines)
+            lines = []
+            quotes = 0
+    if lines:
+        yield ''.join(lines)
+
+def parse_rows(text):
+    return [row for row in csv.reader(io.StringIO(text)) if any(row)]
+
+def _link_text(task):
+    """--workers task: parse, link and re-serialise a batch; returns (csv text, tracking IDs)"""
+    text, layout = task
+    rows = link_rows(parse_rows(text), layout)
+    out = io.StringIO()
+    csv.writer(out).writerows(rows)
+    return out.getvalue(), [row[layout[3]] for row in rows]
+
+def parallel_chunks(src, layout, workers):
+    """_link_text results in input order, at most a few batches in flight"""
+    # Pool.imap reads its input eagerly; the semaphore stops it from reading the whole file
+    in_flight = threading.BoundedSemaphore(workers * 2)
+
+    def tasks():
+        for text in read_text_chunks(src):
+            in_flight.acquire()
+            yield text, layout
+
+    with multiprocessing.Pool(workers, initializer=_set_numbers, initargs=(_numbers,)) as pool:
+        for result in pool.imap(_link_text, tasks()):
+            in_flight.release()
+            yield result
+
+def collisions_in(ids, seen):
+    """Indexes of IDs already seen; the rest are added to `seen`"""
+    duplicates = []
+    for index, tracking_id in enumerate(ids):
+        key = hash(tracking_id)
+        if key in seen:
+            duplicates.append(index)
+        else:
+            seen.add(key)
+    return duplicates
+
+def resolve_collisions(rows, duplicates, layout, seen):
+    """Give colliding rows fresh tracking IDs until every one is unique"""
+    while duplicates:
+        for index in duplicates:
+            set_link(rows[index], layout, uuid.uuid4().hex[:8])
+        duplicates = [duplicates[i] for i in collisions_in([rows[index][layout[3]] for index in duplicates], seen)]
+
+def process_campaign(campaign_file, workers=1, tokens=True):
+    """Stream a campaign CSV into <name>_with_links.csv, adding tracking IDs and links.
+
+    Rows are read, linked and written in batches, so memory doesn't grow with the
+    file; with workers > 1 the batches are parsed and linked by a process pool.
+    With tokens, each tracking ID is a signed token (tokens.py) for the campaign
+    and the recipient's number (recipient_numbers()); a person listed twice gets
+    the same token. Otherwise it's employee_id_<random> and IDs are
+    checked for collisions across the whole file. The output is
+    written under a temporary name and moved into place at the end, so the
+    tracker never loads a half-written campaign.
+    """
     output_file = campaign_file.replace('.csv', '_with_links.csv')
+    tmp_file = output_file + '.tmp'
     
-    with open(campaign_file, 'r') as f:
-        reader = csv.DictReader(f)
-        fieldnames = reader.fieldnames + ['tracking_id', 'tracking_link']
-        
-        rows = []
-        for row in reader:
-            # Generate tracking ID
-            emp_id = row.get('employee_id', row.get('email', 'unknown'))
-            tracking_id = generate_tracking_id(emp_id)
-            
-            # Get target URL (can be specified in CSV or use default)
-            target_url = row.get('target_url', 'https://portal.office.com')
-            
-            # Generate tracking link
-            tracking_link = generate_tracking_link(tracking_id, target_url)
-            
-            row['tracking_id'] = tracking_id
-            row['tracking_link'] = tracking_link
-            rows.append(row)
-            
-            print(f"✅ {row.get('name', emp_id)}: {tracking_link}")
+    started = time.perf_counter()
+    total = 0
+    collisions = 0
+    seen = set()  # hash() of every tracking ID so far; a false match only costs a regenerated ID
     
-    # Write output
-    with open(output_file, 'w', newline='') as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(rows)
+    with open(campaign_file, 'r', newline='') as src, \
+            open(tmp_file, 'w', newline='', buffering=OUTPUT_BUFFER) as dst:
+        header = next(csv.reader([src.readline()]), None)
+        if not header:
+            print(f"❌ {campaign_file} is empty")
+            dst.close()
+            os.remove(tmp_file)
+            return None
+        # Signed with the tracker's key (token_secret.key / $TRACKER_TOKEN_SECRET)
+        token_key = (load_secret(), campaign_number(RecipientDirectory.campaign_of(campaign_file))) if tokens else None
+        fieldnames, layout = column_layout(header, token_key)
+        _set_numbers(recipient_numbers(campaign_file, layout[0]) if tokens else {})
+        writer = csv.writer(dst)
+        writer.writerow(fieldnames)
+        
+        if workers > 1:
+            batches = parallel_chunks(src, layout, workers)
+        else:
+            batches = (link_rows(rows, layout) for rows in read_chunks(csv.reader(src)))
+            batches = ((rows, [row[layout[3]] for row in rows]) for rows in batches)
+        for batch, ids in batches:
+            # batch: linked rows (serial), or CSV text a worker already linked.
+            # Tokens are unique by construction; only random IDs can collide
+            duplicates = collisions_in(ids, seen) if not tokens else None
+            if duplicates:
+                # 32 random bits per ID: rare, but possible in big campaigns or with duplicate employee IDs
+                collisions += len(duplicates)
+                if isinstance(batch, str):
+                    batch = parse_rows(batch)
+                resolve_collisions(batch, duplicates, layout, seen)
+            if isinstance(batch, str):
+                dst.write(batch)
+            else:
+                writer.writerows(batch)
+            previous = total
+            total += len(ids)
+            if total // PROGRESS_EVERY != previous // PROGRESS_EVERY:
+                elapsed = time.perf_counter() - started
+                print(f"\r⏳ {total:,} recipients ({total / elapsed:,.0f}/s)", end='', file=sys.stderr, flush=True)
     
+    os.replace(tmp_file, output_file)
+    elapsed = time.perf_counter() - started
+    if total >= PROGRESS_EVERY:
+        print(file=sys.stderr)
     print(f"\n📁 Saved to: {output_file}")
-    print(f"📊 Total recipients: {len(rows)}")
+    print(f"📊 Total recipients: {total} in {elapsed:.2f}s"
+          + (f" ({collisions} tracking ID collisions regenerated)" if collisions else ""))
     
     return output_file
 
 if __name__ == '__main__':
-    # Default campaign file
-    campaign_file = sys.argv[1] if len(sys.argv) > 1 else 'campaigns/example_campaign.csv'
+    parser = argparse.ArgumentParser(description="Add tracking IDs and links to a campaign CSV")
+    parser.add_argument('campaign_file', nargs='?', default='campaigns/example_campaign.csv')
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Processes generating links in parallel (for very large CSVs)")
+    parser.add_argument('--legacy-ids', action='store_true',
+                        help="Issue employee_id_<random> IDs with the destination in the link instead of signed tokens")
+    args = parser.parse_args()
+    campaign_file = args.campaign_file
     
     if not os.path.exists(campaign_file):
         print(f"❌ File not found: {campaign_file}")
@@ -88,10 +320,11 @@ emp003,bob.wilson@company.com,Bob Wilson,Sales,https://portal.office.com
     print("=" * 60)
     print(f"Base URL: {BASE_TRACKING_URL}")
     print(f"Campaign: {campaign_file}")
+    print(f"IDs: {'employee_id + random (legacy)' if args.legacy_ids else 'signed tokens (keep token_secret.key with the tracker)'}")
     print("=" * 60)
     print()
     
-    output = process_campaign(campaign_file)
+    output = process_campaign(campaign_file, workers=args.workers, tokens=not args.legacy_ids)
     
     print()
     print("=" * 60)
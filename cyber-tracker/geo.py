@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+"""
+Geolocation lookups and background enrichment for tracker events
+"""
+
+import os
+import sys
+import csv
+import json
+import mmap
+import time
+import fcntl
+import queue
+import atexit
+import socket
+import struct
+import ipaddress
+import threading
+from collections import OrderedDict
+import requests
+from logs import log
+
+# Cache configuration
+GEO_CACHE_FILE = "geo_cache.json"
+GEO_CACHE_MAX_ENTRIES = 50000
+GEO_CACHE_TTL = 7 * 24 * 3600       # Successful lookups
+GEO_CACHE_NEGATIVE_TTL = 15 * 60    # Failed lookups, retried after this
+GEO_CACHE_SAVE_INTERVAL = 30        # Seconds between saves to disk
+
+# Offline range database (see IPRangeDatabase); GEO_OFFLINE disables ip-api.com entirely
+GEO_DB_FILE = "geo_ranges.bin"
+GEO_OFFLINE = False
+
+UNKNOWN_GEO = {"country": "Unknown", "city": "Unknown", "isp": "Unknown"}
+LOCAL_GEO = {"country": "Local", "city": "Local Network", "isp": "Private"}
+
+# Always part of the range table, whatever database is loaded
+PRIVATE_RANGES = ['10.0.0.0/8', '172.16.0.0/12', '192.168.0.0/16', '127.0.0.0/8']
+
+# Compiled database layout (big-endian):
+#   header:  magic, version, record count, string table offset
+#   records: sorted, non-overlapping (start, end, string offset) triples
+#   strings: u16 length + "country\x1fcity\x1fisp" in UTF-8
+DB_MAGIC = b'GEOR'
+DB_VERSION = 1
+DB_HEADER = struct.Struct('>4sHxxII')
+DB_RECORD = struct.Struct('>III')
+DB_STRLEN = struct.Struct('>H')
+
+def build_range_database(rows, output_path):
+    """Compile (start_ip, end_ip, country, city, isp) rows into a database file.
+
+    Private ranges are added automatically and take precedence: a row
+    overlapping one is clipped (or split) around it. Any other row
+    overlapping an earlier range is skipped.
+    """
+    private = []
+    for network in PRIVATE_RANGES:
+        net = ipaddress.ip_network(network)
+        private.append((int(net.network_address), int(net.broadcast_address)))
+    private.sort()
+    ranges = [(start, end, LOCAL_GEO['country'], LOCAL_GEO['city'], LOCAL_GEO['isp']) for start, end in private]
+    skipped = 0
+    for start_ip, end_ip, country, city, isp in rows:
+        start, end = int(ipaddress.IPv4Address(start_ip)), int(ipaddress.IPv4Address(end_ip))
+        pieces = len(ranges)
+        for private_start, private_end in private:
+            if start > end or private_start > end:
+                break
+            if private_end < start:
+                continue
+            if start < private_start:
+                ranges.append((start, private_start - 1, country, city, isp))
+            start = private_end + 1
+        if start <= end:
+            ranges.append((start, end, country, city, isp))
+        if len(ranges) == pieces:
+            skipped += 1  # Reversed, or entirely inside a private range
+    ranges.sort(key=lambda r: r[0])
+
+    records = []
+    strings = bytearray()
+    string_offsets = {}
+    last_end = -1
+    for start, end, country, city, isp in ranges:
+        if start <= last_end:
+            skipped += 1
+            continue
+        text = '\x1f'.join([country or 'Unknown', city or 'Unknown', isp or 'Unknown']).encode('utf-8')
+        if text not in string_offsets:
+            string_offsets[text] = len(strings)
+            strings += DB_STRLEN.pack(len(text)) + text
+        records.append(DB_RECORD.pack(start, end, string_offsets[text]))
+        last_end = end
+
+    strings_offset = DB_HEADER.size + len(records) * DB_RECORD.size
+    tmp_path = output_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(DB_HEADER.pack(DB_MAGIC, DB_VERSION, len(records), strings_offset))
+        f.write(b''.join(records))
+        f.write(strings)
+    os.replace(tmp_path, output_path)
+    return len(records), skipped
+
+def read_range_csv(csv_path):
+    """Yield range rows from a CSV with either network or start_ip/end_ip columns"""
+    with open(csv_path, 'r', newline='') as f:
+        for row in csv.DictReader(f):
+            if row.get('network'):
+                net = ipaddress.ip_network(row['network'], strict=False)
+                if net.version != 4:
+                    continue
+                start_ip, end_ip = str(net.network_address), str(net.broadcast_address)
+            else:
+                start_ip, end_ip = row['start_ip'], row['end_ip']
+            yield start_ip, end_ip, row.get('country'), row.get('city'), row.get('isp')
+
+class IPRangeDatabase:
+    """Memory-mapped IPv4 range table searched with binary search.
+
+    Falls back to an in-memory table of just the private ranges when no
+    database file is present, so the local-network shortcut always goes
+    through the same lookup.
+    """
+
+    def __init__(self, path=GEO_DB_FILE):
+        self.path = path
+        self.file = None
+        self.buffer = None
+        self.count = 0
+        self.strings_offset = 0
+        self.decoded = {}
+        self.open()
+
+    def open(self):
+        try:
+            if os.path.exists(self.path) and os.path.getsize(self.path) >= DB_HEADER.size:
+                self.file = open(self.path, 'rb')
+                self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.buffer = self._compile_private_ranges()
+        except Exception as e:
+            log.error('GEO', 'Error opening range database', path=self.path, error=e)
+            self.close()
+            self.buffer = self._compile_private_ranges()
+
+        magic, version, self.count, self.strings_offset = DB_HEADER.unpack_from(self.buffer, 0)
+        if magic != DB_MAGIC or version != DB_VERSION:
+            log.warning('GEO', f'Not a version {DB_VERSION} range database, using private ranges only', path=self.path)
+            self.close()
+            self.buffer = self._compile_private_ranges()
+            magic, version, self.count, self.strings_offset = DB_HEADER.unpack_from(self.buffer, 0)
+
+    def _compile_private_ranges(self):
+        records = []
+        text = '\x1f'.join([LOCAL_GEO['country'], LOCAL_GEO['city'], LOCAL_GEO['isp']]).encode('utf-8')
+        for network in sorted(PRIVATE_RANGES, key=lambda n: int(ipaddress.ip_network(n).network_address)):
+            net = ipaddress.ip_network(network)
+            records.append(DB_RECORD.pack(int(net.network_address), int(net.broadcast_address), 0))
+        strings_offset = DB_HEADER.size + len(records) * DB_RECORD.size
+        return (DB_HEADER.pack(DB_MAGIC, DB_VERSION, len(records), strings_offset)
+                + b''.join(records) + DB_STRLEN.pack(len(text)) + text)
+
+    def close(self):
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+        if self.file:
+            self.file.close()
+        self.buffer = None
+        self.file = None
+        self.decoded = {}
+
+    def lookup(self, ip_address):
+        """Return a geo dict for an IPv4 address, or None if no range matches"""
+        try:
+            ip = struct.unpack('>I', socket.inet_pton(socket.AF_INET, ip_address))[0]
+        except (OSError, TypeError):
+            return None
+
+        buffer = self.buffer
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = struct.unpack_from('>I', buffer, DB_HEADER.size + mid * DB_RECORD.size)[0]
+            if start <= ip:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            return None
+        start, end, string_offset = DB_RECORD.unpack_from(buffer, DB_HEADER.size + (lo - 1) * DB_RECORD.size)
+        if ip > end:
+            return None
+
+        geo = self.decoded.get(string_offset)
+        if geo is None:
+            position = self.strings_offset + string_offset
+            length = DB_STRLEN.unpack_from(buffer, position)[0]
+            text = bytes(buffer[position + DB_STRLEN.size:position + DB_STRLEN.size + length])
+            country, city, isp = text.decode('utf-8').split('\x1f')
+            geo = {"country": country, "city": city, "isp": isp}
+            self.decoded[string_offset] = geo
+        return dict(geo)
+
+ip_ranges = IPRangeDatabase()
+
+class GeoCache:
+    """Bounded LRU cache of IP -> geo with TTLs, persisted to a JSON file.
+
+    Failed lookups are stored as negative entries (value None) with a
+    shorter TTL so a flaky or rate-limited API isn't hit on every event.
+    """
+
+    def __init__(self, path=GEO_CACHE_FILE, max_entries=GEO_CACHE_MAX_ENTRIES,
+                 ttl=GEO_CACHE_TTL, negative_ttl=GEO_CACHE_NEGATIVE_TTL,
+                 save_interval=GEO_CACHE_SAVE_INTERVAL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.save_interval = save_interval
+        self.entries = OrderedDict()  # ip -> (expires_at, geo or None)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.dirty = False
+        self.last_save = time.time()
+        self.load()
+
+    def get(self, ip_address):
+        """Return (found, geo); geo is None for a cached failure"""
+        with self.lock:
+            entry = self.entries.get(ip_address)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    del self.entries[ip_address]
+                self.misses += 1
+                return False, None
+            self.entries.move_to_end(ip_address)
+            if entry[1] is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return True, entry[1]
+
+    def put(self, ip_address, geo):
+        """Store a lookup result; pass geo=None to record a failure"""
+        ttl = self.ttl if geo is not None else self.negative_ttl
+        with self.lock:
+            self.entries[ip_address] = (time.time() + ttl, geo)
+            self.entries.move_to_end(ip_address)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+            self.dirty = True
+            due = time.time() - self.last_save >= self.save_interval
+        if due:
+            self.save()
+
+    def load(self):
+        """Load unexpired entries from disk, oldest first to keep LRU order"""
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r') as f:
+                    saved = json.load(f)
+                now = time.time()
+                for ip_address, expires_at, geo in saved.get('entries', []):
+                    if expires_at > now:
+                        self.entries[ip_address] = (expires_at, geo)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        except Exception as e:
+            log.error('GEO', 'Error loading cache', path=self.path, error=e)
+
+    def save(self):
+        """Atomically write the cache to disk if it changed.
+
+        Several worker processes share the file, so under its lock the
+        entries on disk are merged in first (the later expiry wins) rather
+        than replaced with just this process's lookups.
+        """
+        with self.lock:
+            if not self.dirty:
+                return
+            snapshot = [[ip, expires_at, geo] for ip, (expires_at, geo) in self.entries.items()]
+            self.dirty = False
+            self.last_save = time.time()
+        try:
+            with open(f"{self.path}.lock", 'a') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                merged = OrderedDict()
+                now = time.time()
+                if os.path.exists(self.path):
+                    with open(self.path, 'r') as f:
+                        for ip_address, expires_at, geo in json.load(f).get('entries', []):
+                            if expires_at > now:
+                                merged[ip_address] = (expires_at, geo)
+                for ip_address, expires_at, geo in snapshot:
+                    saved = merged.pop(ip_address, None)
+                    merged[ip_address] = saved if saved and saved[0] > expires_at else (expires_at, geo)
+                # This process's entries go last, so its most recently used survive the bound
+                entries = [[ip, expires_at, geo] for ip, (expires_at, geo) in merged.items()][-self.max_entries:]
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'w') as f:
+                    json.dump({'entries': entries}, f)
+                os.replace(tmp_path, self.path)
+        except Exception as e:
+            log.error('GEO', 'Error saving cache', path=self.path, error=e)
+
+    def stats(self):
+        """Counters for monitoring cache effectiveness"""
+        with self.lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round((self.hits + self.negative_hits) / lookups, 4) if lookups else 0.0
+            }
+
+geo_cache = GeoCache()
+atexit.register(geo_cache.save)
+
+def lookup_ip_api(ip_address):
+    """Query ip-api.com; returns None when the lookup fails"""
+    try:
+        response = requests.get(f"http://ip-api.com/json/{ip_address}?fields=status,country,city,isp,org", timeout=3)
+        if response.status_code == 200:
+            data = response.json()
+            if data.get('status') == 'success':
+                return {
+                    "country": data.get('country', 'Unknown'),
+                    "city": data.get('city', 'Unknown'),
+                    "isp": data.get('isp', 'Unknown'),
+                    "org": data.get('org', 'Unknown')
+                }
+    except Exception as e:
+        log.warning('GEO', 'ip-api.com lookup failed', ip=ip_address, error=e)
+    return None
+
+def get_geolocation(ip_address):
+    """Get geolocation from IP address: local range table, then cache, then ip-api.com"""
+    geo = ip_ranges.lookup(ip_address)
+    if geo is not None:
+        return geo
+    if GEO_OFFLINE:
+        return dict(UNKNOWN_GEO)
+
+    found, geo = geo_cache.get(ip_address)
+    if not found:
+        geo = lookup_ip_api(ip_address)
+        geo_cache.put(ip_address, geo)
+
+    return dict(geo) if geo is not None else dict(UNKNOWN_GEO)
+
+class GeoEnricher:
+    """Worker pool that fills in country/city/ISP after an event is logged.
+
+    Request handlers call submit() and return immediately; a worker thread
+    runs the (slow) lookup and hands the result to on_result(event, geo),
+    which is responsible for writing it back to the event store.
+    """
+
+    def __init__(self, lookup, on_result, workers=4, max_pending=10000):
+        self.lookup = lookup
+        self.on_result = on_result
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._run, name=f"geo-enricher-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, event):
+        """Queue an event for enrichment; never blocks the caller"""
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except queue.Full:
+            log.warning('GEO', 'Queue full, event left unenriched', tracking_id=event.get('tracking_id'))
+            return False
+
+    def pending(self):
+        """Number of events still waiting for a lookup"""
+        return self.queue.qsize()
+
+    def _run(self):
+        while True:
+            event = self.queue.get()
+            if event is None:
+                self.queue.task_done()
+                return
+            try:
+                geo = self.lookup(event.get('ip_address', ''))
+                self.on_result(event, geo)
+            except Exception as e:
+                log.error('GEO', 'Enrichment failed', tracking_id=event.get('tracking_id'), error=e)
+            finally:
+                self.queue.task_done()
+
+    def stop(self, timeout=10):
+        """Drain outstanding lookups and stop the workers"""
+        for _ in self.threads:
+            try:
+                self.queue.put(None, timeout=timeout)
+            except queue.Full:
+                break
+        for thread in self.threads:
+            thread.join(timeout)
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: python3 geo.py ranges.csv [output.bin]")
+        print("CSV columns: network (CIDR) or start_ip,end_ip, plus country,city,isp")
+        sys.exit(1)
+
+    source = sys.argv[1]
+    output = sys.argv[2] if len(sys.argv) > 2 else GEO_DB_FILE
+    count, skipped = build_range_database(read_range_csv(source), output)
+    print(f"✅ {count} ranges written to {output}" + (f" ({skipped} overlapping rows skipped)" if skipped else ""))
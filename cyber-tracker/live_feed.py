@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Fan-out of newly logged events to Server-Sent Events subscribers
+"""
+
+import json
+import queue
+import threading
+from logs import log
+
+KEEPALIVE_SECONDS = 15
+SUBSCRIBER_BACKLOG = 1000  # Messages buffered per client before it is dropped
+
+class LiveFeed:
+    """Broadcasts events to every open /api/stream connection.
+
+    Each subscriber gets its own bounded queue; a client that stops reading
+    is disconnected instead of holding up publishers. Subscribers pick a
+    topic (a campaign, or None for everything) and only receive messages
+    published to it.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = {}  # queue -> topic
+
+    def has_subscribers(self, topic=None):
+        with self.lock:
+            return topic in self.subscribers.values()
+
+    def subscribe(self, topic=None):
+        subscriber = queue.Queue(maxsize=SUBSCRIBER_BACKLOG)
+        with self.lock:
+            self.subscribers[subscriber] = topic
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.pop(subscriber, None)
+
+    def publish(self, message, event_id=None, topic=None):
+        """Send a JSON-serialisable message to the subscribers of a topic"""
+        payload = f"id: {event_id}\n" if event_id else ""
+        payload += f"data: {json.dumps(message)}\n\n"
+        with self.lock:
+            subscribers = [subscriber for subscriber, subscribed in self.subscribers.items() if subscribed == topic]
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(payload)
+            except queue.Full:
+                log.warning('LIVE', 'Dropping slow subscriber')
+                self.unsubscribe(subscriber)
+                with subscriber.mutex:
+                    subscriber.queue.clear()
+                subscriber.put_nowait(None)
+
+    def stream(self, subscriber):
+        """SSE body for one client; yields keepalive comments while idle"""
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    payload = subscriber.get(timeout=KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if payload is None:
+                    return
+                yield payload
+        finally:
+            self.unsubscribe(subscriber)
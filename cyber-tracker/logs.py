@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Structured, rate-limited logging; formatting and writing happen on a background thread
+"""
+
+import sys
+import json
+import time
+import queue
+import atexit
+import threading
+from datetime import datetime, timezone
+
+LOG_FORMAT = "text"  # "text" (timestamp LEVEL [TAG] message key=value ...) or "json" (one object per line)
+LOG_RATE = 20  # Lines per second each tag may write once its burst is used up...
+LOG_BURST = 100  # ...and the burst
+LOG_SUPPRESSED_REPORT = 10  # Seconds between "lines suppressed" summaries
+
+class EventLog:
+    """Logger whose callers only check a rate limit and put a tuple on a queue.
+
+    Lines are tagged like the old print() output ([CLICK], [GEO], ...) and
+    carry their details as fields. Each tag is a token bucket: past
+    LOG_BURST lines it may write LOG_RATE a second, and what is dropped is
+    counted and reported every LOG_SUPPRESSED_REPORT seconds instead.
+    """
+
+    def __init__(self, stream=None, fmt=LOG_FORMAT, rate=LOG_RATE, burst=LOG_BURST,
+                 report_interval=LOG_SUPPRESSED_REPORT):
+        self.stream = stream  # None: whatever sys.stdout is when the line is written
+        self.fmt = fmt
+        self.rate = rate
+        self.burst = burst
+        self.report_interval = report_interval
+        self.buckets = {}  # tag -> (tokens, time of last refill)
+        self.suppressed = {}  # tag -> lines dropped since the last report
+        self.lock = threading.Lock()
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self._run, name="event-log", daemon=True)
+        self.thread.start()
+
+    def info(self, tag, message='', **fields):
+        self._log('INFO', tag, message, fields)
+
+    def warning(self, tag, message='', **fields):
+        self._log('WARNING', tag, message, fields)
+
+    def error(self, tag, message='', **fields):
+        self._log('ERROR', tag, message, fields)
+
+    def _log(self, level, tag, message, fields):
+        now = time.time()
+        with self.lock:
+            tokens, refilled = self.buckets.get(tag, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - refilled) * self.rate)
+            if tokens < 1:
+                self.buckets[tag] = (tokens, now)
+                self.suppressed[tag] = self.suppressed.get(tag, 0) + 1
+                return
+            self.buckets[tag] = (tokens - 1, now)
+        self.queue.put((now, level, tag, message, fields))
+
+    def format(self, timestamp, level, tag, message, fields):
+        when = datetime.fromtimestamp(timestamp, timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+        fields = {key: value for key, value in fields.items() if value is not None}
+        if self.fmt == "json":
+            record = {'ts': when, 'level': level, 'tag': tag}
+            if message:
+                record['msg'] = message
+            record.update(fields)
+            return json.dumps(record, default=str)
+        parts = [when, level, f"[{tag}]"]
+        if message:
+            parts.append(message)
+        for key, value in fields.items():
+            value = str(value)
+            if not value or any(c in value for c in ' ="\n'):
+                value = json.dumps(value)
+            parts.append(f"{key}={value}")
+        return ' '.join(parts)
+
+    def _report_suppressed(self):
+        with self.lock:
+            suppressed, self.suppressed = self.suppressed, {}
+        return [self.format(time.time(), 'WARNING', 'LOG', 'lines suppressed by the rate limit',
+                            {'source': tag, 'lines': count})
+                for tag, count in suppressed.items()]
+
+    def _run(self):
+        next_report = time.monotonic() + self.report_interval
+        while True:
+            lines = []
+            stopping = False
+            try:
+                item = self.queue.get(timeout=max(0.0, next_report - time.monotonic()))
+                while True:
+                    if item is None:
+                        stopping = True
+                        break
+                    lines.append(self.format(*item))
+                    item = self.queue.get_nowait()
+            except queue.Empty:
+                pass
+            if stopping or time.monotonic() >= next_report:
+                lines.extend(self._report_suppressed())
+                next_report = time.monotonic() + self.report_interval
+            if lines:
+                stream = self.stream or sys.stdout
+                try:
+                    stream.write('\n'.join(lines) + '\n')
+                    stream.flush()
+                except Exception:
+                    pass
+            if stopping:
+                return
+
+    def stop(self, timeout=5):
+        """Write out everything queued so far"""
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(timeout)
+
+# Shared by every module. Imported before they register their atexit handlers, so (atexit runs
+# in reverse) it stops last and still writes what they log
+log = EventLog()
+atexit.register(log.stop)
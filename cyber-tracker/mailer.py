@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""
+Bulk email dispatch over a pool of persistent, authenticated SMTP connections
+"""
+
+import sys
+import csv
+import ssl
+import time
+import json
+import queue
+import atexit
+import smtplib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+
+SMTP_BACKEND = "smtplib"  # "smtplib" (a thread per connection) or "asyncio" (see async_mailer.py)
+SMTP_BACKENDS = ("smtplib", "asyncio")
+SMTP_POOL_SIZE = 4  # Connections (and sending threads) per SMTP server/account
+SMTP_TIMEOUT = 30
+SMTP_MAX_MESSAGES = 100  # Recycle a connection after this many messages
+SMTP_IDLE_CHECK = 30  # Seconds idle before a pooled connection is NOOP-checked
+SMTP_RETRIES = 3  # Extra attempts after a transient (4xx / dropped connection) failure
+SMTP_RETRY_BACKOFF = 1.0  # Seconds, doubled per attempt
+DEFAULT_SUBJECT = '⚠️ Action Required: Verify Your Microsoft 365 Account'
+DEFAULT_FROM_NAME = 'Microsoft 365 Security'
+
+def build_message(from_email, to_email, subject, html, from_name=None, to_name=None):
+    """MIME message as sent by the tracker (HTML alternative part)"""
+    msg = MIMEMultipart('alternative')
+    msg['Subject'] = subject
+    msg['From'] = f'{from_name} <{from_email}>' if from_name else from_email
+    msg['To'] = f'{to_name} <{to_email}>' if to_name else to_email
+    msg.attach(MIMEText(html, 'html'))
+    return msg
+
+def classify_error(error):
+    """(transient, smtp_code) for a send failure; transient ones are retried on a new connection"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in error.recipients.values()]
+        return bool(codes) and all(400 <= code < 500 for code in codes), (codes[0] if codes else None)
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500, error.smtp_code
+    if isinstance(error, smtplib.SMTPNotSupportedError):
+        return False, None
+    # Dropped connections, timeouts, refused connects
+    return isinstance(error, OSError), None
+
+class PooledConnection:
+    def __init__(self, smtp):
+        self.smtp = smtp
+        self.messages = 0
+        self.last_used = time.monotonic()
+
+class SMTPConnectionPool:
+    """Bounded pool of logged-in SMTP connections to one server/account.
+
+    A connection does the connect/STARTTLS/login handshake once and then
+    sends messages back to back until it has sent max_messages, goes
+    stale or fails; at most `size` connections are open at a time.
+    """
+
+    backend = 'smtplib'
+
+    def __init__(self, host, port=587, user=None, password=None, size=SMTP_POOL_SIZE, starttls=True,
+                 use_ssl=False, timeout=SMTP_TIMEOUT, max_messages=SMTP_MAX_MESSAGES):
+        self.host = host
+        self.port = int(port)
+        self.user = user
+        self.password = password
+        self.size = size
+        self.starttls = starttls
+        self.use_ssl = use_ssl or self.port == 465
+        self.timeout = timeout
+        self.max_messages = max_messages
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+        self.lock = threading.Lock()
+        self.connections_opened = 0
+        self.messages_sent = 0
+        self.discarded = 0
+        self._ssl_context = None
+
+    def ssl_context(self):
+        # Loading the CA bundle takes tens of ms, so it's done once per pool, and only if TLS is used
+        if self._ssl_context is None:
+            self._ssl_context = ssl.create_default_context()
+        return self._ssl_context
+
+    def _connect(self):
+        if self.use_ssl:
+            smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout, context=self.ssl_context())
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            smtp.ehlo()
+            if self.starttls and not self.use_ssl:
+                if not smtp.has_extn('starttls'):
+                    raise smtplib.SMTPNotSupportedError(f"{self.host} does not offer STARTTLS")
+                smtp.starttls(context=self.ssl_context())
+                smtp.ehlo()
+            if self.user:
+                smtp.login(self.user, self.password)
+        except Exception:
+            self._close(smtp)
+            raise
+        with self.lock:
+            self.connections_opened += 1
+        return PooledConnection(smtp)
+
+    @staticmethod
+    def _close(smtp):
+        try:
+            smtp.quit()
+        except Exception:
+            try:
+                smtp.close()
+            except Exception:
+                pass
+
+    def acquire(self):
+        """A ready connection; blocks while all `size` connections are in use"""
+        self.slots.acquire()
+        try:
+            while True:
+                try:
+                    conn = self.idle.get_nowait()
+                except queue.Empty:
+                    return self._connect()
+                if time.monotonic() - conn.last_used < SMTP_IDLE_CHECK:
+                    return conn
+                try:
+                    if conn.smtp.noop()[0] == 250:
+                        return conn
+                except Exception:
+                    pass
+                self._close(conn.smtp)
+        except Exception:
+            self.slots.release()
+            raise
+
+    def release(self, conn, healthy=True):
+        """Return a connection; unhealthy or worn-out ones are closed"""
+        try:
+            if healthy and conn.messages < self.max_messages:
+                conn.last_used = time.monotonic()
+                self.idle.put(conn)
+            else:
+                if not healthy:
+                    with self.lock:
+                        self.discarded += 1
+                self._close(conn.smtp)
+        finally:
+            self.slots.release()
+
+    def send(self, msg, from_addr, to_addrs):
+        """Send one message on a pooled connection (no retries)"""
+        conn = self.acquire()
+        try:
+            conn.smtp.send_message(msg, from_addr, to_addrs)
+        except Exception as e:
+            transient, _ = classify_error(e)
+            # Permanent rejections leave the session usable; anything transient gets a fresh connection
+            self.release(conn, healthy=not transient)
+            raise
+        conn.messages += 1
+        with self.lock:
+            self.messages_sent += 1
+        self.release(conn)
+
+    def close(self):
+        while True:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            self._close(conn.smtp)
+
+    def stats(self):
+        return {
+            'host': self.host,
+            'port': self.port,
+            'backend': self.backend,
+            'size': self.size,
+            'idle': self.idle.qsize(),
+            'connections_opened': self.connections_opened,
+            'connections_discarded': self.discarded,
+            'messages_sent': self.messages_sent
+        }
+
+# One pool per server/account, shared by every request in the process
+_pools = {}
+_pools_lock = threading.Lock()
+
+def pool_class(backend=None):
+    backend = backend or SMTP_BACKEND
+    if backend == 'asyncio':
+        from async_mailer import AsyncSMTPPool
+        return AsyncSMTPPool
+    if backend == 'smtplib':
+        return SMTPConnectionPool
+    raise ValueError(f"Unknown SMTP backend: {backend} (expected one of {', '.join(SMTP_BACKENDS)})")
+
+def get_pool(host, port=587, user=None, password=None, starttls=True, size=SMTP_POOL_SIZE, backend=None):
+    backend = backend or SMTP_BACKEND
+    key = (host, int(port), user, password, starttls, backend)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = pool_class(backend)(host, port, user, password, size=size, starttls=starttls)
+        return pool
+
+def pool_stats():
+    with _pools_lock:
+        return [pool.stats() for pool in _pools.values()]
+
+@atexit.register
+def close_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+
+def send_with_retry(pool, msg, from_addr, to_addr, retries=SMTP_RETRIES, backoff=SMTP_RETRY_BACKOFF):
+    """Send one message, retrying transient failures; returns a status dict"""
+    attempts = 0
+    while True:
+        attempts += 1
+        try:
+            pool.send(msg, from_addr, [to_addr])
+            return {'status': 'sent', 'attempts': attempts}
+        except Exception as e:
+            transient, code = classify_error(e)
+            if not transient or attempts > retries:
+                return {'status': 'failed', 'attempts': attempts, 'code': code, 'error': str(e)}
+            time.sleep(backoff * (2 ** (attempts - 1)))
+
+class BulkSender:
+    """Sends one message per recipient through a connection pool, in parallel.
+
+    render(recipient) returns the MIME message for a recipient; each
+    recipient dict needs at least 'email'. Recipients without a tracking
+    ID are skipped rather than sent an untracked email.
+    """
+
+    def __init__(self, pool, from_addr, render, retries=SMTP_RETRIES, backoff=SMTP_RETRY_BACKOFF):
+        self.pool = pool
+        self.from_addr = from_addr
+        self.render = render
+        self.retries = retries
+        self.backoff = backoff
+
+    def _prepare(self, recipient):
+        """(result, msg); msg is None when the recipient is skipped or can't be rendered"""
+        result = {'email': recipient.get('email', ''), 'name': recipient.get('name', ''),
+                  'tracking_id': recipient.get('tracking_id', '')}
+        if not result['email'] or not result['tracking_id']:
+            result.update(status='skipped', attempts=0, error='Missing email or tracking_id')
+            return result, None
+        try:
+            return result, self.render(recipient)
+        except Exception as e:
+            result.update(status='failed', attempts=0, error=f"Render failed: {e}")
+            return result, None
+
+    def send_one(self, recipient):
+        result, msg = self._prepare(recipient)
+        if msg is not None:
+            result.update(send_with_retry(self.pool, msg, self.from_addr, result['email'], self.retries, self.backoff))
+        return result
+
+    def send(self, recipients, on_result=None):
+        """Per-recipient results in input order; on_result is called as each one finishes"""
+        if self.pool.backend == 'asyncio':
+            return self._send_async(recipients, on_result)
+
+        def task(recipient):
+            result = self.send_one(recipient)
+            if on_result:
+                on_result(result)
+            return result
+
+        with ThreadPoolExecutor(max_workers=self.pool.size, thread_name_prefix="smtp-send") as executor:
+            return list(executor.map(task, recipients))
+
+    def _send_async(self, recipients, on_result):
+        # This thread renders and submits; the pool's event loop runs all the SMTP sessions.
+        # Submissions are capped a few messages per session ahead so memory stays bounded.
+        window = threading.BoundedSemaphore(self.pool.size * 4)
+        results = []
+        futures = {}
+        for recipient in recipients:
+            result, msg = self._prepare(recipient)
+            results.append(result)
+            if msg is None:
+                if on_result:
+                    on_result(result)
+                continue
+            window.acquire()
+            future = self.pool.submit(msg, self.from_addr, result['email'], self.retries, self.backoff)
+            future.add_done_callback(lambda _: window.release())
+            futures[future] = result
+            for done in [f for f in futures if f.done()]:
+                self._collect(futures.pop(done), done, on_result)
+        for done in as_completed(futures):
+            self._collect(futures[done], done, on_result)
+        return results
+
+    @staticmethod
+    def _collect(result, future, on_result):
+        try:
+            result.update(future.result())
+        except Exception as e:
+            result.update(status='failed', error=str(e))
+        if on_result:
+            on_result(result)
+
+def read_recipients(csv_path):
+    """Recipient rows from a campaign CSV (normally the _with_links one)"""
+    with open(csv_path, 'r', newline='') as f:
+        return [{
+            'name': row.get('name') or row.get('employee_id') or '',
+            'email': row.get('email', '') or '',
+            'tracking_id': row.get('tracking_id', '') or '',
+            'employee_id': row.get('employee_id', '') or ''
+        } for row in csv.DictReader(f)]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Send a campaign CSV through pooled SMTP connections")
+    parser.add_argument('csv', help="Campaign CSV with tracking_id column (see generate_links.py)")
+    parser.add_argument('--config', default='smtp_config.json', help="SMTP settings saved by the tracker")
+    parser.add_argument('--host')
+    parser.add_argument('--port', type=int)
+    parser.add_argument('--user')
+    parser.add_argument('--password')
+    parser.add_argument('--from', dest='from_email')
+    parser.add_argument('--from-name', default=DEFAULT_FROM_NAME)
+    parser.add_argument('--subject', default=DEFAULT_SUBJECT)
+    parser.add_argument('--template', help="Email template in email_templates/ (default microsoft365)")
+    parser.add_argument('--pool', type=int, default=SMTP_POOL_SIZE, help="Parallel SMTP connections")
+    parser.add_argument('--no-tls', action='store_true', help="Skip STARTTLS (local test servers only)")
+    parser.add_argument('--backend', choices=SMTP_BACKENDS, default=SMTP_BACKEND,
+                        help="asyncio runs every connection from one event-loop thread")
+    args = parser.parse_args()
+
+    try:
+        with open(args.config, 'r') as f:
+            config = json.load(f)
+    except (OSError, ValueError):
+        config = {}
+    host = args.host or config.get('smtpHost', 'smtp.gmail.com')
+    port = args.port or int(config.get('smtpPort', 587))
+    user = args.user if args.user is not None else config.get('smtpUser', '')
+    password = args.password if args.password is not None else config.get('smtpPass', '')
+    from_email = args.from_email or config.get('fromEmail') or user
+
+    from templates import render_email, library
+    library.get(args.template)  # Unknown template: fail before connecting
+
+    def render(recipient):
+        html = render_email(recipient['name'], recipient['email'], recipient['tracking_id'], recipient['employee_id'],
+                            args.template)
+        return build_message(from_email, recipient['email'], args.subject, html, args.from_name, recipient['name'])
+
+    recipients = read_recipients(args.csv)
+    pool = pool_class(args.backend)(host, port, user or None, password, size=args.pool, starttls=not args.no_tls)
+    sender = BulkSender(pool, from_email, render)
+    print(f"📧 Sending {len(recipients)} emails via {host}:{port} ({args.pool} {args.backend} connections)")
+    started = time.perf_counter()
+
+    def report(result):
+        icon = {'sent': '✅', 'failed': '❌', 'skipped': '⏭️'}[result['status']]
+        print(f"{icon} {result['email'] or '(no email)'} {result['status']}"
+              + (f" - {result['error']}" if result.get('error') else ""))
+
+    results = sender.send(recipients, on_result=report)
+    pool.close()
+    elapsed = time.perf_counter() - started
+    sent = sum(1 for result in results if result['status'] == 'sent')
+    print(f"\nSent {sent}/{len(results)} in {elapsed:.2f}s ({sent / elapsed if elapsed else 0:.1f} msg/s), "
+          f"{pool.connections_opened} connections opened")
+    sys.exit(0 if sent == sum(1 for result in results if result['status'] != 'skipped') else 1)
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Prometheus-style counters, gauges and latency histograms, rendered as text for /metrics
+"""
+
+import os
+import json
+import time
+import fcntl
+import bisect
+import threading
+from logs import log
+
+# Seconds: from a sub-millisecond pixel up to a slow ip-api.com lookup or export
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+RETIRED_FILE = "retired.json"  # SharedMetrics: totals of worker processes that have exited
+
+def _label_text(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+def _number(value):
+    if isinstance(value, float):
+        return '+Inf' if value == float('inf') else repr(value)
+    return str(value)
+
+class Counter:
+    """Monotonic count per label combination"""
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.series = {}  # label values -> count
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.series[label_values] = self.series.get(label_values, 0) + amount
+
+    def snapshot(self):
+        with self.lock:
+            return [[list(key), value] for key, value in self.series.items()]
+
+    @staticmethod
+    def merge(into, value):
+        return value if into is None else into + value
+
+    def render(self, series):
+        return [f"{self.name}{_label_text(self.labels, key)} {_number(value)}" for key, value in series]
+
+class Gauge(Counter):
+    """Current value read from a callback when the metrics are rendered"""
+    kind = 'gauge'
+
+    def __init__(self, name, help, read):
+        super().__init__(name, help)
+        self.read = read
+
+    def snapshot(self):
+        try:
+            return [[[], self.read()]]
+        except Exception:
+            return []
+
+class _Timer:
+    __slots__ = ('histogram', 'label_values', 'started')
+
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.label_values)
+        return False
+
+class Histogram:
+    """Observations counted into fixed buckets, plus their sum, per label combination.
+
+    Each series is stored as per-bucket (not cumulative) counts with a last
+    +Inf bucket, followed by the sum; render() makes them cumulative.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.series = {}  # label values -> [count per bucket..., count over the last bucket, sum]
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.series.get(label_values)
+            if counts is None:
+                counts = self.series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def time(self, *label_values):
+        """Context manager observing the seconds its block takes"""
+        return _Timer(self, label_values)
+
+    def snapshot(self):
+        with self.lock:
+            return [[list(key), list(counts)] for key, counts in self.series.items()]
+
+    def merge(self, into, counts):
+        if len(counts) != len(self.buckets) + 2:
+            return into  # Written with other buckets (older code): can't be combined
+        return list(counts) if into is None else [a + b for a, b in zip(into, counts)]
+
+    def render(self, series):
+        lines = []
+        for key, counts in series:
+            cumulative = 0
+            for le, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_label_text(self.labels, key, [('le', _number(float(le)))])} {cumulative}")
+            labels = _label_text(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_number(round(counts[-1], 9))}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class Registry:
+    """The metrics a process exposes, in registration order"""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def _register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._register(Counter(name, help, labels))
+
+    def gauge(self, name, help, read):
+        return self._register(Gauge(name, help, read))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def snapshot(self):
+        """JSON-serialisable copy of every series"""
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def render(self, snapshots=None):
+        """Prometheus text format of the given snapshots added together (default: this process)"""
+        if snapshots is None:
+            snapshots = [self.snapshot()]
+        lines = []
+        for name, metric in self.metrics.items():
+            merged = {}
+            for snapshot in snapshots:
+                for key, value in snapshot.get(name, []):
+                    key = tuple(key)
+                    merged[key] = metric.merge(merged.get(key), value)
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(metric.render((key, value) for key, value in merged.items() if value is not None))
+        return '\n'.join(lines) + '\n'
+
+class SharedMetrics:
+    """Several worker processes' registries combined for /metrics.
+
+    Every process writes its snapshot to <directory>/<pid>.json every
+    `interval` seconds and at exit; collect() adds the other processes'
+    files to this process's live numbers. Files left by workers that have
+    exited (a reload) are folded into RETIRED_FILE so totals never go
+    backwards. Their gauges are dropped: they describe a process that is gone.
+    """
+
+    def __init__(self, registry, directory, interval=5.0):
+        self.registry = registry
+        self.directory = directory
+        self.interval = interval
+        self.path = os.path.join(directory, f"{os.getpid()}.json")
+        self.thread = None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.thread = threading.Thread(target=self._run, name="metrics-writer", daemon=True)
+        self.thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.write()
+
+    def write(self):
+        """Publish this process's snapshot for the other workers"""
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(self.registry.snapshot(), f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            log.error('METRICS', 'Error writing snapshot', path=self.path, error=e)
+
+    def _read(self, path):
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def collect(self):
+        """Snapshots of every worker, this one's taken now, ready for Registry.render()"""
+        snapshots = [self.registry.snapshot()]
+        retired_path = os.path.join(self.directory, RETIRED_FILE)
+        with open(os.path.join(self.directory, '.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            retired = self._read(retired_path) or {}
+            folded = False
+            for filename in os.listdir(self.directory):
+                pid = filename[:-len('.json')]
+                if not filename.endswith('.json') or not pid.isdigit() or int(pid) == os.getpid():
+                    continue
+                path = os.path.join(self.directory, filename)
+                snapshot = self._read(path)
+                if snapshot is None:
+                    continue
+                if _alive(int(pid)):
+                    snapshots.append(snapshot)
+                    continue
+                for name, metric in self.registry.metrics.items():
+                    if metric.kind == 'gauge' or name not in snapshot:
+                        continue
+                    series = {tuple(key): value for key, value in retired.get(name, [])}
+                    for key, value in snapshot[name]:
+                        merged = metric.merge(series.get(tuple(key)), value)
+                        if merged is not None:
+                            series[tuple(key)] = merged
+                    retired[name] = [[list(key), value] for key, value in series.items()]
+                os.remove(path)
+                folded = True
+            if folded:
+                tmp_path = f"{retired_path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'w') as f:
+                    json.dump(retired, f)
+                os.replace(tmp_path, retired_path)
+        snapshots.append(retired)
+        return snapshots
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
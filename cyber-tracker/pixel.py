@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+"""
+Open-tracking pixel: a constant GIF body and header set, built once at import
+"""
+
+import base64
+from flask import Response
+
+# Base64 encoded 1x1 transparent GIF pixel
+PIXEL_GIF = base64.b64decode('R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7')
+
+# Every open must reach the tracker, so nothing along the way may cache the image
+PIXEL_HEADERS = (
+    ('Content-Type', 'image/gif'),
+    ('Cache-Control', 'no-store, no-cache, must-revalidate, private, max-age=0'),
+    ('Pragma', 'no-cache'),
+    ('Expires', '0')
+)
+
+def pixel_response():
+    """The pixel without send_file(): no BytesIO, mimetype guessing or conditional-request handling.
+
+    A fresh Response around the shared bytes, so after_request hooks can
+    still add headers to it safely.
+    """
+    return Response(PIXEL_GIF, headers=PIXEL_HEADERS)
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Recipient directory: campaign CSVs loaded once and indexed for lookups
+"""
+
+import os
+import csv
+import glob
+import time
+import hashlib
+import threading
+from logs import log
+
+LINKS_SUFFIX = '_with_links'  # generate_links.py output for a campaign CSV
+
+class PrefixIndex:
+    """Character trie mapping IDs to values.
+
+    longest_match() returns the value of the longest stored key that
+    equals the query or is followed in it by an '_' (so
+    'patrick_corr_153334' matches 'patrick_corr_153334_83ecb12d', but
+    'pat' never matches 'patrick'). Exact keys are answered from a dict;
+    anything else is one walk down the trie, with no split() and no
+    intermediate lists or slices.
+    """
+
+    VALUE = ''  # Iterating a str never yields '', so it can't clash with a character
+
+    def __init__(self):
+        self.root = {}
+        self.exact = {}
+
+    def insert(self, key, value):
+        """Add a key; the first value stored for a key wins"""
+        if not key:
+            return
+        node = self.root
+        for ch in key:
+            child = node.get(ch)
+            if child is None:
+                child = node[ch] = {}
+            node = child
+        if self.VALUE not in node:
+            node[self.VALUE] = value
+            self.exact[key] = value
+
+    def __len__(self):
+        return len(self.exact)
+
+    def longest_match(self, query):
+        value = self.exact.get(query)
+        if value is not None:
+            return value
+        node = self.root
+        best = None
+        for ch in query:
+            if ch == '_':
+                value = node.get(self.VALUE)
+                if value is not None:
+                    best = value
+            node = node.get(ch)
+            if node is None:
+                return best
+        value = node.get(self.VALUE)
+        return value if value is not None else best
+
+class RecipientDirectory:
+    """All campaign CSVs under a directory, reloaded per file when they change.
+
+    Each file is re-read only when its (inode, mtime, size) changes, and
+    the stat checks themselves run at most once per check_interval seconds,
+    so callers can use the directory on every request.
+    """
+
+    def __init__(self, campaigns_dir, check_interval=1.0):
+        self.campaigns_dir = campaigns_dir
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.files = {}  # path -> {'stat': (inode, mtime, size), 'recipients': [...]}
+        self.last_check = 0.0
+        self.by_tracking_id = {}
+        self.by_employee_id = {}
+        self.prefix_index = PrefixIndex()
+        self.generation = 0  # Bumped whenever the indexes are rebuilt (names may have changed)
+        self.refresh(force=True)
+
+    def refresh(self, force=False):
+        """Reload changed, added or removed CSVs; cheap when nothing changed"""
+        now = time.monotonic()
+        if not force and now - self.last_check < self.check_interval:
+            return False
+        with self.lock:
+            self.last_check = now
+            changed = False
+            paths = set(glob.glob(os.path.join(self.campaigns_dir, '*.csv')))
+            for path in list(self.files):
+                if path not in paths:
+                    del self.files[path]
+                    changed = True
+            for path in paths:
+                try:
+                    info = os.stat(path)
+                except OSError:
+                    continue
+                signature = (info.st_ino, info.st_mtime_ns, info.st_size)
+                entry = self.files.get(path)
+                if entry and entry['stat'] == signature:
+                    continue
+                self.files[path] = {'stat': signature, 'recipients': self._read_csv(path)}
+                changed = True
+            if changed:
+                self._rebuild_indexes()
+            return changed
+
+    @staticmethod
+    def campaign_of(path):
+        """Campaign name for a CSV; foo.csv and foo_with_links.csv are both 'foo'"""
+        name = os.path.splitext(os.path.basename(path))[0]
+        return name[:-len(LINKS_SUFFIX)] if name.endswith(LINKS_SUFFIX) else name
+
+    def _read_csv(self, path):
+        campaign = self.campaign_of(path)
+        recipients = []
+        try:
+            with open(path, 'r', newline='') as f:
+                for row in csv.DictReader(f):
+                    employee_id = row.get('employee_id', '') or ''
+                    recipients.append({
+                        'name': row.get('name') or employee_id or 'Test User',
+                        'email': row.get('email', '') or '',
+                        'tracking_id': row.get('tracking_id', '') or '',
+                        'employee_id': employee_id,
+                        'department': row.get('department', '') or '',
+                        'campaign': campaign
+                    })
+        except Exception as e:
+            log.error('NAMES', 'Error loading recipients', path=path, error=e)
+        return recipients
+
+    def _rebuild_indexes(self):
+        by_tracking_id = {}
+        by_employee_id = {}
+        prefix_index = PrefixIndex()
+        # Sorted so the result doesn't depend on directory listing order
+        for path in sorted(self.files):
+            for recipient in self.files[path]['recipients']:
+                if recipient['employee_id']:
+                    by_employee_id.setdefault(recipient['employee_id'], recipient)
+                    prefix_index.insert(recipient['employee_id'], recipient)
+                if recipient['tracking_id']:
+                    by_tracking_id.setdefault(recipient['tracking_id'], recipient)
+                    # Pixel IDs are the tracking ID without its random suffix
+                    prefix_index.insert(recipient['tracking_id'], recipient)
+                    prefix_index.insert(recipient['tracking_id'].rsplit('_', 1)[0], recipient)
+        self.by_tracking_id = by_tracking_id
+        self.by_employee_id = by_employee_id
+        self.prefix_index = prefix_index
+        self.generation += 1
+
+    def lookup(self, tracking_id):
+        """Recipient for a full tracking ID, else the longest known ID prefix"""
+        self.refresh()
+        return self.prefix_index.longest_match(tracking_id)
+
+    def issued(self, tracking_id):
+        """Recipient whose tracking, employee or pixel ID is exactly this one, else None"""
+        self.refresh()
+        return self.prefix_index.exact.get(tracking_id)
+
+    def name_for(self, tracking_id):
+        """Display name, falling back to the tracking ID itself"""
+        recipient = self.lookup(tracking_id)
+        return recipient['name'] if recipient else tracking_id
+
+    def recipients(self, campaign=None, with_tracking_only=False):
+        """Recipients from every campaign CSV (or just one), one row per person per campaign.
+
+        foo.csv and foo_with_links.csv list the same people, so rows are
+        matched on employee ID (else email) within a campaign, and the row
+        with a tracking ID wins, keeping the position of the first.
+        """
+        self.refresh()
+        index = {}  # (campaign, employee ID or email) -> position in result
+        result = []
+        for path in sorted(self.files):
+            for recipient in self.files[path]['recipients']:
+                if campaign and recipient['campaign'] != campaign:
+                    continue
+                if with_tracking_only and not recipient['tracking_id']:
+                    continue
+                person = recipient['employee_id'] or recipient['email'].lower()
+                if not person:
+                    result.append(recipient)
+                    continue
+                key = (recipient['campaign'], person)
+                position = index.get(key)
+                if position is None:
+                    index[key] = len(result)
+                    result.append(recipient)
+                elif recipient['tracking_id'] and not result[position]['tracking_id']:
+                    result[position] = recipient
+        return result
+
+    def signature(self):
+        """Digest of every CSV's (inode, mtime, size): the same in every process until a file changes"""
+        self.refresh()
+        with self.lock:
+            files = sorted((path, entry['stat']) for path, entry in self.files.items())
+        return hashlib.sha1(repr(files).encode('utf-8')).hexdigest()
+
+    def campaigns(self):
+        """Names of all campaigns with a CSV in the directory"""
+        self.refresh()
+        return sorted({self.campaign_of(path) for path in self.files})
@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+"""
+PDF phishing-simulation report, written page by page, and the on-disk cache of finished reports
+"""
+
+import os
+import zlib
+import threading
+from datetime import datetime
+from logs import log
+
+REPORT_LAYOUT = 1  # Bump when the layout changes, so cached reports are rebuilt
+REPORT_CACHE_DIR = "reports"
+REPORT_CACHE_MAX = 20  # Finished reports kept; the least recently served go first
+
+# A4 in points, and the printable area
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+MARGIN = 40
+FOOTER_Y = 25
+
+# PDF object numbers fixed up front; pages are numbered from FIRST_PAGE_OBJECT as they are written
+CATALOG = 1
+PAGES = 2
+FONT_REGULAR = 3
+FONT_BOLD = 4
+INFO = 5
+FIRST_PAGE_OBJECT = 6
+
+# RGB operands, as they appear in the content streams
+DARK_BLUE = b'0.102 0.212 0.365'
+HEADER_BLUE = b'0.118 0.227 0.373'
+BLUE = b'0.231 0.51 0.965'
+RED = b'0.863 0.149 0.149'
+GRAY = b'0.42 0.447 0.502'
+LIGHT_GRAY = b'0.953 0.957 0.965'
+ROW_SHADE = b'0.976 0.98 0.984'
+AMBER_LIGHT = b'0.996 0.953 0.78'
+AMBER = b'0.961 0.62 0.043'
+BLACK = b'0 0 0'
+WHITE = b'1 1 1'
+
+# High-risk users table: (heading, width in points, field)
+TABLE_COLUMNS = (
+    ('First click (UTC)', 92, 'first_click'),
+    ('Name', 118, 'name'),
+    ('Tracking ID', 100, 'tracking_id'),
+    ('Clicks', 32, 'clicks'),
+    ('Location', 95, 'location'),
+    ('ISP', 78, 'isp')
+)
+TABLE_FONT_SIZE = 8.5
+ROW_HEIGHT = 16
+
+# Helvetica advance widths (1/1000 em) of ' ' through '~', from its AFM metrics; anything else counts as 556
+HELVETICA_WIDTHS = (
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584
+)
+_WINANSI_WIDTHS = [556] * 32 + list(HELVETICA_WIDTHS) + [556] * 129  # Indexed by WinAnsi byte
+
+RECOMMENDATIONS = (
+    "Training Topics: focus on recognizing suspicious senders, urgency tactics, and hovering before clicking.",
+    "Retest: schedule a follow-up phishing test in 30 days to measure improvement.",
+    "Policy: consider additional MFA requirements for high-risk users."
+)
+
+def pdf_string(text):
+    """A (literal) PDF string in WinAnsi; characters it lacks become '?'"""
+    data = ' '.join(str(text).split()).encode('cp1252', 'replace')
+    return b'(' + data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+
+def text_width(text, size):
+    """Width of text in regular Helvetica, in points"""
+    return sum(map(_WINANSI_WIDTHS.__getitem__, text.encode('cp1252', 'replace'))) * size / 1000
+
+def fit(text, width, size):
+    """Text cut short with '...' if it wouldn't fit in `width` points"""
+    text = ' '.join(str(text).split())[:200]
+    widths = [_WINANSI_WIDTHS[byte] for byte in text.encode('cp1252', 'replace')]  # One byte per character
+    room = width * 1000 / size
+    if sum(widths) <= room:
+        return text
+    room -= 3 * _WINANSI_WIDTHS[ord('.')]
+    used = 0
+    for index, glyph in enumerate(widths):
+        used += glyph
+        if used > room:
+            return text[:index] + '...'
+    return text
+
+def wrap(text, width, size):
+    """Split text into lines of at most `width` points"""
+    lines, line = [], ''
+    for word in text.split():
+        candidate = f"{line} {word}" if line else word
+        if line and text_width(candidate, size) > width:
+            lines.append(line)
+            line = word
+        else:
+            line = candidate
+    return lines + ([line] if line else [])
+
+class Canvas:
+    """Drawing operations for one page, collected into its content stream"""
+
+    def __init__(self):
+        self.ops = []
+
+    def text(self, x, y, text, size=10, bold=False, color=BLACK):
+        self.ops.append(b'BT /%s %.2f Tf %s rg %.2f %.2f Td %s Tj ET' % (
+            b'F2' if bold else b'F1', size, color, x, y, pdf_string(text)))
+
+    def text_row(self, y, cells, size):
+        """Several (x, text, color) pieces on one baseline, in one text object"""
+        ops = [b'BT /F1 %.2f Tf' % size]
+        ops.extend(b'%s rg 1 0 0 1 %.2f %.2f Tm %s Tj' % (color, x, y, pdf_string(text)) for x, text, color in cells)
+        ops.append(b'ET')
+        self.ops.append(b' '.join(ops))
+
+    def rect(self, x, y, width, height, color):
+        self.ops.append(b'%s rg %.2f %.2f %.2f %.2f re f' % (color, x, y, width, height))
+
+    def line(self, x1, y1, x2, y2, color=BLACK, width=1):
+        self.ops.append(b'%s RG %.2f w %.2f %.2f m %.2f %.2f l S' % (color, width, x1, y1, x2, y2))
+
+    def content(self):
+        return b'\n'.join(self.ops)
+
+class PDFWriter:
+    """Minimal PDF 1.4 writer that hands back each object's bytes as soon as it is written.
+
+    Only object offsets are remembered, so a document of any length is
+    produced in constant memory. The page tree object is written last,
+    once the number of pages is known; its number is fixed in advance so
+    pages can point at it.
+    """
+
+    def __init__(self):
+        self.offsets = {}  # object number -> byte offset
+        self.position = 0
+        self.next_number = FIRST_PAGE_OBJECT
+        self.page_objects = []
+
+    def _object(self, number, body):
+        data = b'%d 0 obj\n%s\nendobj\n' % (number, body)
+        self.offsets[number] = self.position
+        self.position += len(data)
+        return data
+
+    def start(self, title, created):
+        header = b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n'
+        self.position = len(header)
+        font = b'<< /Type /Font /Subtype /Type1 /BaseFont /%s /Encoding /WinAnsiEncoding >>'
+        return (header
+                + self._object(CATALOG, b'<< /Type /Catalog /Pages %d 0 R >>' % PAGES)
+                + self._object(FONT_REGULAR, font % b'Helvetica')
+                + self._object(FONT_BOLD, font % b'Helvetica-Bold')
+                + self._object(INFO, b'<< /Title %s /Producer (Cyber Awareness Tracker) /CreationDate (D:%s) >>' % (
+                    pdf_string(title), created.strftime('%Y%m%d%H%M%S').encode('ascii'))))
+
+    def page(self, canvas):
+        stream = zlib.compress(canvas.content())
+        contents, page = self.next_number, self.next_number + 1
+        self.next_number += 2
+        self.page_objects.append(page)
+        return (self._object(contents, b'<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream' % (len(stream), stream))
+                + self._object(page, b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %d %d] '
+                                     b'/Resources << /Font << /F1 %d 0 R /F2 %d 0 R >> >> /Contents %d 0 R >>' % (
+                                         PAGES, PAGE_WIDTH, PAGE_HEIGHT, FONT_REGULAR, FONT_BOLD, contents)))
+
+    def finish(self):
+        kids = b' '.join(b'%d 0 R' % number for number in self.page_objects)
+        data = self._object(PAGES, b'<< /Type /Pages /Kids [%s] /Count %d >>' % (kids, len(self.page_objects)))
+        xref = [b'xref\n0 %d\n' % self.next_number, b'0000000000 65535 f \n']
+        xref.extend(b'%010d 00000 n \n' % self.offsets[number] for number in range(1, self.next_number))
+        trailer = b'trailer\n<< /Size %d /Root %d 0 R /Info %d 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (
+            self.next_number, CATALOG, INFO, self.position)
+        return data + b''.join(xref) + trailer
+
+class ReportPages:
+    """Lays the report out onto pages, handing each one to the writer when it is full"""
+
+    def __init__(self, writer, title):
+        self.writer = writer
+        self.title = title
+        self.number = 0
+        self.canvas = None
+        self.y = 0
+
+    def new_page(self):
+        """Finish the current page (returning its bytes) and start the next"""
+        data = self.close_page()
+        self.number += 1
+        self.canvas = Canvas()
+        self.y = PAGE_HEIGHT - MARGIN
+        return data
+
+    def close_page(self):
+        if self.canvas is None:
+            return b''
+        self.canvas.line(MARGIN, FOOTER_Y + 12, PAGE_WIDTH - MARGIN, FOOTER_Y + 12, LIGHT_GRAY, 0.5)
+        self.canvas.text(MARGIN, FOOTER_Y, f"Cyber Awareness Tracker - {self.title}", 8, color=GRAY)
+        label = f"Page {self.number}"
+        self.canvas.text(PAGE_WIDTH - MARGIN - text_width(label, 8), FOOTER_Y, label, 8, color=GRAY)
+        data = self.writer.page(self.canvas)
+        self.canvas = None
+        return data
+
+    def room(self, height):
+        """True if `height` more points fit above the footer"""
+        return self.y - height >= FOOTER_Y + 25
+
+    def table_header(self):
+        canvas = self.canvas
+        canvas.rect(MARGIN, self.y - ROW_HEIGHT - 2, PAGE_WIDTH - 2 * MARGIN, ROW_HEIGHT + 2, HEADER_BLUE)
+        x = MARGIN
+        for heading, width, _ in TABLE_COLUMNS:
+            canvas.text(x + 4, self.y - ROW_HEIGHT + 3, heading, TABLE_FONT_SIZE, bold=True, color=WHITE)
+            x += width
+        self.y -= ROW_HEIGHT + 2
+
+    def table_row(self, index, user):
+        canvas = self.canvas
+        if index % 2:
+            canvas.rect(MARGIN, self.y - ROW_HEIGHT, PAGE_WIDTH - 2 * MARGIN, ROW_HEIGHT, ROW_SHADE)
+        cells = []
+        x = MARGIN
+        for _, width, field in TABLE_COLUMNS:
+            cells.append((x + 4, fit(user.get(field, ''), width - 8, TABLE_FONT_SIZE), RED if field == 'name' else BLACK))
+            x += width
+        canvas.text_row(self.y - ROW_HEIGHT + 5, cells, TABLE_FONT_SIZE)
+        self.y -= ROW_HEIGHT
+
+def render_report(summary, high_risk_users, campaign=None, since=None, until=None, generated=None):
+    """Yield the report as PDF bytes: the header, each page as soon as it is laid out, then the trailer.
+
+    summary holds the totals ('opens', 'unique_openers', 'clicks',
+    'high_risk_users'); high_risk_users is an iterable of one dict per
+    clicker with the TABLE_COLUMNS fields, consumed as pages are filled.
+    """
+    generated = generated or datetime.utcnow()
+    title = "Phishing Simulation Report"
+    writer = PDFWriter()
+    pages = ReportPages(writer, title)
+    yield writer.start(title + (f" - {campaign}" if campaign else ""), generated)
+    pages.new_page()
+    canvas = pages.canvas
+    width = PAGE_WIDTH - 2 * MARGIN
+
+    canvas.text(MARGIN, pages.y - 22, title, 22, bold=True, color=DARK_BLUE)
+    canvas.line(MARGIN, pages.y - 34, PAGE_WIDTH - MARGIN, pages.y - 34, BLUE, 2)
+    details = [f"Generated: {generated.strftime('%Y-%m-%d %H:%M')} UTC"]
+    if campaign:
+        details.append(f"Campaign: {campaign}")
+    if since or until:
+        details.append(f"Period: {since or 'start'} to {until or 'now'}")
+    canvas.text(MARGIN, pages.y - 52, '  |  '.join(details), 10, color=GRAY)
+    pages.y -= 85
+
+    canvas.text(MARGIN, pages.y, "Executive Summary", 14, bold=True, color=DARK_BLUE)
+    pages.y -= 15
+    box_width = (width - 2 * 15) / 3
+    stats = ((summary['opens'], "Emails Opened", BLUE),
+             (summary['clicks'], "Link Clicks (Failed)", RED),
+             (summary['high_risk_users'], "High Risk Users", RED))
+    for i, (value, label, color) in enumerate(stats):
+        x = MARGIN + i * (box_width + 15)
+        canvas.rect(x, pages.y - 70, box_width, 70, LIGHT_GRAY)
+        canvas.text(x + 12, pages.y - 38, str(value), 26, bold=True, color=color)
+        canvas.text(x + 12, pages.y - 58, label, 10, color=GRAY)
+    pages.y -= 100
+
+    canvas.text(MARGIN, pages.y, "Email Opens (Tracking Only)", 14, bold=True, color=DARK_BLUE)
+    opens_line = (f"Total opens: {summary['opens']}  |  Unique openers: {summary['unique_openers']}"
+                  if summary['opens'] else "No emails have been opened yet.")
+    canvas.text(MARGIN, pages.y - 20, opens_line, 10)
+    pages.y -= 50
+
+    recommendations = [f"High Risk Users: {summary['high_risk_users']} users clicked the phishing link and "
+                       f"should receive mandatory security awareness training.", *RECOMMENDATIONS]
+    lines = [(index, line) for index, text in enumerate(recommendations) for line in wrap(text, width - 40, 10)]
+    box_height = 34 + 14 * len(lines) + 4 * len(recommendations)
+    canvas.rect(MARGIN, pages.y - box_height, width, box_height, AMBER_LIGHT)
+    canvas.rect(MARGIN, pages.y - box_height, 4, box_height, AMBER)
+    canvas.text(MARGIN + 16, pages.y - 22, "Recommendations", 14, bold=True, color=DARK_BLUE)
+    y = pages.y - 40
+    previous = None
+    for index, line in lines:
+        if index != previous:
+            y -= 4
+            canvas.text(MARGIN + 16, y, "-", 10)
+            previous = index
+        canvas.text(MARGIN + 28, y, line, 10)
+        y -= 14
+    pages.y -= box_height + 35
+
+    pages.canvas.text(MARGIN, pages.y, "High Risk Users (Clicked Link)", 14, bold=True, color=RED)
+    pages.y -= 12
+    count = 0
+    for user in high_risk_users:
+        if count == 0 or not pages.room(ROW_HEIGHT):
+            if not pages.room(2 * ROW_HEIGHT + 2):
+                yield pages.new_page()
+            pages.table_header()
+        pages.table_row(count, user)
+        count += 1
+    if count == 0:
+        pages.canvas.text(MARGIN, pages.y - 14, "No users clicked the phishing link. Great job!", 10)
+    yield pages.close_page()
+    yield writer.finish()
+
+class ReportCache:
+    """Finished reports on disk, named by a key that changes with the data behind them.
+
+    store() wraps a report being streamed to a client: it writes the bytes
+    to a temporary file as they pass and renames it into place only once
+    the whole report has been sent, so a dropped download leaves nothing.
+    """
+
+    def __init__(self, directory=REPORT_CACHE_DIR, max_reports=REPORT_CACHE_MAX):
+        self.directory = directory
+        self.max_reports = max_reports
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.pdf")
+
+    def get(self, key):
+        """Path of the cached report for `key`, or None"""
+        path = self.path(key)
+        try:
+            os.utime(path)  # Most recently served survive pruning
+        except OSError:
+            return None
+        return path
+
+    def store(self, key, chunks):
+        """Pass `chunks` through, keeping a copy as the report for `key`"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        complete = False
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield chunk
+            os.replace(tmp_path, path)
+            complete = True
+            self.prune()
+        finally:
+            if not complete and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def prune(self):
+        """Drop the least recently served reports beyond max_reports"""
+        try:
+            reports = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith('.pdf')]
+            reports.sort(key=os.path.getmtime, reverse=True)
+            for path in reports[self.max_reports:]:
+                os.remove(path)
+        except OSError as e:
+            log.error('REPORT', 'Error pruning the cache', path=self.directory, error=e)
@@ -5,7 +5,7 @@ cd /home/admin/.openclaw/workspace/cyber-tracker
 
 while true; do
     echo "Starting tracker at $(date)"
-    ./venv/bin/python tracker.py
+    ./venv/bin/python serve.py
     echo "Tracker exited at $(date), restarting in 2 seconds..."
     sleep 2
 done
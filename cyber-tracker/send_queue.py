@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+"""
+Durable send queue: a SQLite journal of bulk-send jobs worked off by background threads
+"""
+
+import json
+import time
+import fcntl
+import uuid
+import sqlite3
+import threading
+from mailer import get_pool, classify_error
+from logs import log
+
+SEND_QUEUE_DB = "send_queue.db"
+SEND_WORKERS = 4  # Sending threads shared by all jobs
+SEND_RATE = 2.0  # Default messages per second per SMTP host...
+SEND_BURST = 10  # ...with bursts of up to this many
+SEND_RATE_LIMITS = {'smtp.gmail.com': (1.0, 5)}  # host -> (rate, burst)
+SEND_MAX_ATTEMPTS = 5
+SEND_BACKOFF = 30  # Seconds before the first retry, doubled per attempt...
+SEND_BACKOFF_MAX = 3600  # ...up to this
+SEND_LEASE = 300  # A message still 'sending' after this long was interrupted (crash/restart)
+SEND_JOURNAL_RETRY = 1.0  # Seconds a worker waits after a journal (SQLite) error
+
+# Message states. 'unknown' = the process died mid-send; never retried, since it may have been delivered
+PENDING, SENDING, SENT, FAILED, UNKNOWN, CANCELLED = 'pending', 'sending', 'sent', 'failed', 'unknown', 'cancelled'
+STATES = [PENDING, SENDING, SENT, FAILED, UNKNOWN, CANCELLED]
+
+class TokenBucket:
+    """Allows `rate` sends per second on average, `burst` back to back"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        """Wait until a token is available and take it"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def refund(self):
+        """Give back a token that ended up unused"""
+        with self.lock:
+            self.tokens = min(self.burst, self.tokens + 1)
+
+class SendQueue:
+    """Bulk-send jobs journaled in SQLite and sent by a pool of worker threads.
+
+    Every message is a row that moves pending -> sending -> sent/failed.
+    The move to 'sending' is committed before the SMTP transaction starts,
+    so after a crash a message is either still pending (safe to send),
+    or 'sending' and later marked 'unknown' instead of being sent again.
+    Transient failures go back to pending with exponential backoff; sends
+    are spaced per SMTP host with a token bucket, waited on before the
+    claim, so a message is never 'sending' while it sits out the rate
+    limit. render(settings, recipient) builds the MIME message for a
+    recipient.
+
+    SMTP passwords are never journaled. The process that enqueued a job
+    keeps its password in memory; a job resumed after a restart, or sent
+    by another process, gets it from credentials(settings).
+
+    Any number of processes may enqueue and read status, but only the one
+    holding an exclusive lock on <journal>.lock runs the sending threads,
+    so recovery and rate limits never race another sender. The others
+    wait on the lock and take over if that process exits.
+    """
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id TEXT PRIMARY KEY,
+            campaign TEXT,
+            created REAL NOT NULL,
+            finished REAL,
+            state TEXT NOT NULL DEFAULT 'active',
+            settings TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id TEXT NOT NULL,
+            email TEXT NOT NULL,
+            name TEXT,
+            tracking_id TEXT,
+            employee_id TEXT,
+            state TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt REAL NOT NULL DEFAULT 0,
+            claimed_at REAL,
+            sent_at REAL,
+            code INTEGER,
+            error TEXT,
+            UNIQUE (job_id, email)
+        );
+        CREATE INDEX IF NOT EXISTS idx_messages_state ON messages (state, next_attempt);
+        CREATE INDEX IF NOT EXISTS idx_messages_job ON messages (job_id, state);
+        CREATE INDEX IF NOT EXISTS idx_messages_sent_at ON messages (sent_at);
+    '''
+
+    def __init__(self, path, render, workers=SEND_WORKERS, rate_limits=None, credentials=None):
+        self.path = path
+        self.render = render
+        self.credentials = credentials or (lambda settings: None)
+        self.passwords = {}  # job_id -> SMTP password of a job enqueued (or resumed) by this process
+        self.sending = False  # Whether this process runs the sending threads
+        self.workers = workers
+        self.rate_limits = SEND_RATE_LIMITS if rate_limits is None else rate_limits
+        self.local = threading.local()
+        self.buckets = {}
+        self.buckets_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopping = False
+        self.threads = []
+        self.lock_file = None
+        self.connection().executescript(self.SCHEMA)
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            # Autocommit mode; writes that must be atomic open BEGIN IMMEDIATE themselves
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=FULL')
+            self.local.conn = conn
+        return conn
+
+    def _transaction(self, work):
+        """Run work(conn) inside BEGIN IMMEDIATE, so claims are exclusive across threads and processes"""
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            result = work(conn)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return result
+
+    def bucket(self, host):
+        with self.buckets_lock:
+            bucket = self.buckets.get(host)
+            if bucket is None:
+                rate, burst = self.rate_limits.get(host, (SEND_RATE, SEND_BURST))
+                bucket = self.buckets[host] = TokenBucket(rate, burst)
+            return bucket
+
+    # ---- Jobs ----
+
+    def enqueue(self, recipients, settings, campaign=None):
+        """Journal a job; recipients need email/name/tracking_id/employee_id. Returns the job id"""
+        job_id = uuid.uuid4().hex[:12]
+        settings = dict(settings)
+        password = settings.pop('password', None)
+        if password:
+            self.passwords[job_id] = password
+
+        def work(conn):
+            conn.execute("INSERT INTO jobs (job_id, campaign, created, settings) VALUES (?, ?, ?, ?)",
+                         [job_id, campaign, time.time(), json.dumps(settings)])
+            # UNIQUE (job_id, email): a recipient listed twice is only sent once
+            return conn.executemany(
+                "INSERT OR IGNORE INTO messages (job_id, email, name, tracking_id, employee_id) VALUES (?, ?, ?, ?, ?)",
+                [[job_id, r['email'], r.get('name', ''), r.get('tracking_id', ''), r.get('employee_id', '')]
+                 for r in recipients if r.get('email')]
+            ).rowcount
+
+        queued = self._transaction(work)
+        log.info('QUEUE', 'Job queued', job_id=job_id, messages=queued)
+        self.wakeup.set()
+        return job_id
+
+    def cancel(self, job_id):
+        """Stop a job; messages already sent or in flight are unaffected"""
+        def work(conn):
+            conn.execute("UPDATE jobs SET state = 'cancelled', finished = ? WHERE job_id = ? AND state = 'active'",
+                         [time.time(), job_id])
+            return conn.execute("UPDATE messages SET state = ? WHERE job_id = ? AND state = ?",
+                                [CANCELLED, job_id, PENDING]).rowcount
+        return self._transaction(work)
+
+    # ---- Workers ----
+
+    def _recover(self, claimed_before):
+        """Mark sends that were in flight when a process died as 'unknown' (never re-sent)"""
+        def work(conn):
+            stuck = conn.execute("UPDATE messages SET state = ?, error = 'Interrupted mid-send; not retried to avoid a duplicate' "
+                                 "WHERE state = ? AND claimed_at < ?", [UNKNOWN, SENDING, claimed_before]).rowcount
+            if stuck:
+                conn.execute("UPDATE jobs SET state = 'done', finished = ? WHERE state = 'active' AND NOT EXISTS "
+                             "(SELECT 1 FROM messages WHERE messages.job_id = jobs.job_id AND state IN (?, ?))",
+                             [time.time(), PENDING, SENDING])
+            return stuck
+        return self._transaction(work)
+
+    def start(self):
+        """Become the sending process now, or in the background once the current one exits"""
+        self.lock_file = open(self.path + '.lock', 'a')
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            log.info('QUEUE', 'Another process is sending; this one only enqueues until it exits')
+            threading.Thread(target=self._standby, name="send-queue-standby", daemon=True).start()
+            return self
+        return self._start_workers()
+
+    def _standby(self):
+        fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+        if not self.stopping:
+            log.info('QUEUE', 'Took over sending')
+            self._start_workers()
+
+    def _start_workers(self):
+        """Resume journaled jobs; anything left 'sending' by the previous sender becomes 'unknown'"""
+        stuck = self._recover(time.time())
+        if stuck:
+            log.warning('QUEUE', 'Messages were mid-send at the last shutdown; marked unknown, not re-sent', messages=stuck)
+        self.sending = True
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"send-queue-{number}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def stop(self, timeout=5):
+        """Let in-flight sends finish; pending messages stay journaled for the next start"""
+        self.stopping = True
+        self.wakeup.set()
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def _next_host(self):
+        """SMTP host of the next message due, or None"""
+        row = self.connection().execute(
+            "SELECT json_extract(j.settings, '$.host') FROM messages m JOIN jobs j ON j.job_id = m.job_id "
+            "WHERE m.state = ? AND m.next_attempt <= ? AND j.state = 'active' ORDER BY m.next_attempt, m.id LIMIT 1",
+            [PENDING, time.time()]
+        ).fetchone()
+        return row[0] if row else None
+
+    def _claim(self, host):
+        """Move the next due message for this SMTP host to 'sending'"""
+        now = time.time()
+
+        def work(conn):
+            row = conn.execute(
+                "SELECT m.*, j.settings FROM messages m JOIN jobs j ON j.job_id = m.job_id "
+                "WHERE m.state = ? AND m.next_attempt <= ? AND j.state = 'active' AND json_extract(j.settings, '$.host') = ? "
+                "ORDER BY m.next_attempt, m.id LIMIT 1",
+                [PENDING, now, host]
+            ).fetchone()
+            if row is not None:
+                conn.execute("UPDATE messages SET state = ?, claimed_at = ?, attempts = attempts + 1 WHERE id = ?",
+                             [SENDING, now, row['id']])
+            return row
+
+        return self._transaction(work)
+
+    def _next_due(self):
+        row = self.connection().execute(
+            "SELECT MIN(next_attempt) FROM messages WHERE state = ?", [PENDING]).fetchone()
+        return row[0]
+
+    def _run(self):
+        last_recovery = time.monotonic()
+        while not self.stopping:
+            try:
+                if time.monotonic() - last_recovery > SEND_LEASE:
+                    # Claims held longer than the lease belong to a process that died
+                    self._recover(time.time() - SEND_LEASE)
+                    last_recovery = time.monotonic()
+                host = self._next_host()
+                if host is None:
+                    next_due = self._next_due()
+                    wait = 5.0 if next_due is None else min(5.0, max(0.05, next_due - time.time()))
+                    self.wakeup.wait(wait)
+                    self.wakeup.clear()
+                    continue
+                # Rate limit first: a crash while waiting must leave the message pending, not 'sending'
+                bucket = self.bucket(host)
+                bucket.take()
+                claim = None if self.stopping else self._claim(host)
+                if claim is None:
+                    bucket.refund()  # Another worker took it, or we are shutting down
+                    continue
+            except sqlite3.Error as e:
+                log.error('QUEUE', 'Journal error', error=e)
+                self.wakeup.wait(SEND_JOURNAL_RETRY)
+                continue
+            try:
+                self._send(claim)
+            except Exception as e:
+                # Past the SMTP transaction (recording its result failed): it may have been delivered
+                log.error('QUEUE', 'Unexpected error sending a message', job_id=claim['job_id'], email=claim['email'], error=e)
+                try:
+                    self._finish(claim['id'], claim['job_id'], UNKNOWN, error=f"Unexpected error, may have been sent: {e}")
+                except Exception:
+                    pass  # Still 'sending': once the lease runs out it is marked unknown
+
+    def _finish(self, message_id, job_id, state, code=None, error=None, retry_at=None):
+        def work(conn):
+            if retry_at is not None:
+                conn.execute("UPDATE messages SET state = ?, next_attempt = ?, code = ?, error = ? WHERE id = ?",
+                             [PENDING, retry_at, code, error, message_id])
+            else:
+                conn.execute("UPDATE messages SET state = ?, sent_at = ?, code = ?, error = ? WHERE id = ?",
+                             [state, time.time() if state == SENT else None, code, error, message_id])
+            conn.execute("UPDATE jobs SET state = 'done', finished = ? WHERE job_id = ? AND state = 'active' AND NOT EXISTS "
+                         "(SELECT 1 FROM messages WHERE job_id = ? AND state IN (?, ?))",
+                         [time.time(), job_id, job_id, PENDING, SENDING])
+        self._transaction(work)
+
+    def _password(self, job_id, settings):
+        password = self.passwords.get(job_id)
+        if password is None and settings.get('user'):
+            password = self.credentials(settings)
+            if password is None:
+                raise ValueError("SMTP password not available to the sending process; save it with /api/smtp-config")
+            self.passwords[job_id] = password
+        return password
+
+    def _send(self, claim):
+        settings = json.loads(claim['settings'])
+        recipient = {key: claim[key] for key in ('email', 'name', 'tracking_id', 'employee_id')}
+        try:
+            msg = self.render(settings, recipient)
+            # Stable per message, so a receiving server can spot a duplicate
+            domain = settings['from_email'].rsplit('@', 1)[-1]
+            msg['Message-ID'] = f"<{claim['job_id']}.{claim['id']}@{domain}>"
+        except Exception as e:
+            self._finish(claim['id'], claim['job_id'], FAILED, error=f"Render failed: {e}")
+            return
+        try:
+            password = self._password(claim['job_id'], settings)
+        except Exception as e:
+            self._finish(claim['id'], claim['job_id'], FAILED, error=str(e))
+            return
+        try:
+            # Connecting (and logging in) happens before anything is sent, so its errors retry like a send's
+            pool = get_pool(settings['host'], settings['port'], settings.get('user') or None, password,
+                            starttls=settings.get('starttls', True), backend=settings.get('backend'))
+            pool.send(msg, settings['from_email'], [claim['email']])
+        except Exception as e:
+            transient, code = classify_error(e)
+            if transient and claim['attempts'] + 1 < SEND_MAX_ATTEMPTS:
+                delay = min(SEND_BACKOFF * 2 ** claim['attempts'], SEND_BACKOFF_MAX)
+                self._finish(claim['id'], claim['job_id'], PENDING, code, str(e), retry_at=time.time() + delay)
+            else:
+                self._finish(claim['id'], claim['job_id'], FAILED, code, str(e))
+            return
+        self._finish(claim['id'], claim['job_id'], SENT)
+
+    # ---- Progress ----
+
+    def _job_status(self, conn, job):
+        counts = dict.fromkeys(STATES, 0)
+        for row in conn.execute("SELECT state, COUNT(*) AS n FROM messages WHERE job_id = ? GROUP BY state", [job['job_id']]):
+            counts[row['state']] = row['n']
+        total = sum(counts.values())
+        now = time.time()
+        recent = conn.execute("SELECT COUNT(*) FROM messages WHERE job_id = ? AND state = ? AND sent_at >= ?",
+                              [job['job_id'], SENT, now - 60]).fetchone()[0]
+        elapsed = (job['finished'] or now) - job['created']
+        settings = json.loads(job['settings'])
+        per_minute = recent / 60.0
+        return {
+            'job_id': job['job_id'],
+            'campaign': job['campaign'],
+            'state': job['state'],
+            'smtp_host': settings.get('host'),
+            'created': job['created'],
+            'finished': job['finished'],
+            'total': total,
+            **counts,
+            'done': job['state'] != 'active',
+            'elapsed_seconds': round(elapsed, 3),
+            'messages_per_second': round(counts[SENT] / elapsed, 3) if elapsed > 0 else 0.0,
+            'messages_per_second_last_minute': round(per_minute, 3),
+            'eta_seconds': round((counts[PENDING] + counts[SENDING]) / per_minute) if per_minute else None
+        }
+
+    def status(self, job_id, with_results=True, state=None):
+        """Counts, throughput and (optionally) per-recipient rows for one job; None if unknown"""
+        conn = self.connection()
+        job = conn.execute("SELECT * FROM jobs WHERE job_id = ?", [job_id]).fetchone()
+        if job is None:
+            return None
+        status = self._job_status(conn, job)
+        if with_results:
+            sql = ("SELECT email, name, tracking_id, state AS status, attempts, code, error FROM messages "
+                   "WHERE job_id = ?")
+            params = [job_id]
+            if state:
+                sql += " AND state = ?"
+                params.append(state)
+            status['results'] = [dict(row) for row in conn.execute(sql + " ORDER BY id", params)]
+        return status
+
+    def jobs(self):
+        """Summary of every job, newest first"""
+        conn = self.connection()
+        return [self._job_status(conn, job) for job in conn.execute("SELECT * FROM jobs ORDER BY created DESC")]
+
+    def stats(self):
+        """Queue-wide counts and throughput over the last minute"""
+        conn = self.connection()
+        counts = dict.fromkeys(STATES, 0)
+        for row in conn.execute("SELECT state, COUNT(*) AS n FROM messages GROUP BY state"):
+            counts[row['state']] = row['n']
+        recent = conn.execute("SELECT COUNT(*) FROM messages WHERE sent_at >= ?", [time.time() - 60]).fetchone()[0]
+        return {
+            **counts,
+            'workers': self.workers,
+            'active_jobs': conn.execute("SELECT COUNT(*) FROM jobs WHERE state = 'active'").fetchone()[0],
+            'messages_per_second_last_minute': round(recent / 60.0, 3)
+        }
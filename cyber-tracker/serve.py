@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Production server: tracker.py under gunicorn with several pre-forked worker processes
+
+    python3 serve.py                  # start (SERVER_WORKERS processes x SERVER_THREADS threads)
+    python3 serve.py --workers 8      # override the worker count
+    python3 serve.py --reload         # graceful reload of the running server
+    python3 serve.py --stop           # graceful shutdown
+
+A reload (SIGHUP to the master) starts fresh workers with the current code
+and lets the old ones finish every request they already accepted, for up
+to SERVER_GRACEFUL_TIMEOUT seconds, so no click redirect is dropped.
+"""
+
+import os
+import sys
+import signal
+import argparse
+
+# Configuration
+SERVER_BIND = "0.0.0.0:5000"
+SERVER_WORKERS = 4  # Processes
+SERVER_THREADS = 8  # Threads per process (each open /api/stream dashboard holds one)
+SERVER_GRACEFUL_TIMEOUT = 30  # Seconds old workers get to finish in-flight requests on reload/stop
+SERVER_TIMEOUT = 60  # A worker silent for this long is restarted
+SERVER_PID_FILE = "serve.pid"
+SERVER_ACCESS_LOG = None  # e.g. "access.log"; None = off, "-" = stdout
+
+def signal_server(signum):
+    """Send a signal to the running master; False if there isn't one"""
+    try:
+        with open(SERVER_PID_FILE, 'r') as f:
+            pid = int(f.read().strip())
+        os.kill(pid, signum)
+        return True
+    except (OSError, ValueError):
+        return False
+
+def run(workers=SERVER_WORKERS, bind=SERVER_BIND, threads=SERVER_THREADS):
+    from gunicorn.app.base import BaseApplication
+
+    # Each worker imports tracker.py itself after the fork (no preload): its threads
+    # (event writer, geo, send queue) must start inside the process that uses them.
+    # tracker.py reads this to switch on its multi-process handling.
+    os.environ['TRACKER_WORKERS'] = str(workers)
+
+    class TrackerApplication(BaseApplication):
+        def load_config(self):
+            settings = {
+                'bind': bind,
+                'workers': workers,
+                'worker_class': 'gthread',
+                'threads': threads,
+                'graceful_timeout': SERVER_GRACEFUL_TIMEOUT,
+                'timeout': SERVER_TIMEOUT,
+                'pidfile': SERVER_PID_FILE,
+                'accesslog': SERVER_ACCESS_LOG,
+                'preload_app': False,
+                'proc_name': 'cyber-tracker'
+            }
+            for key, value in settings.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from tracker import app
+            return app
+
+    print(f"[SERVE] {workers} workers x {threads} threads on {bind}; "
+          f"'python3 serve.py --reload' for a graceful reload")
+    TrackerApplication().run()
+
+if __name__ == '__main__':
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description="Run the tracker under gunicorn")
+    parser.add_argument('--workers', type=int, default=SERVER_WORKERS)
+    parser.add_argument('--threads', type=int, default=SERVER_THREADS)
+    parser.add_argument('--bind', default=SERVER_BIND)
+    parser.add_argument('--reload', action='store_true', help="Gracefully reload the running server")
+    parser.add_argument('--stop', action='store_true', help="Gracefully stop the running server")
+    args = parser.parse_args()
+
+    if args.reload or args.stop:
+        if not signal_server(signal.SIGHUP if args.reload else signal.SIGTERM):
+            print(f"❌ No running server found ({SERVER_PID_FILE})")
+            sys.exit(1)
+        print("✅ Reloading" if args.reload else "✅ Stopping")
+        sys.exit(0)
+    run(args.workers, args.bind, args.threads)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Email templates: HTML files under email_templates/ compiled once into static text + slots
+"""
+
+import os
+import re
+import sys
+import time
+import threading
+from html import escape
+from urllib.parse import quote
+from campaigns import DEFAULT_TEMPLATE
+from tokens import default_codec
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "email_templates")
+BASE_URL = "https://www.patrickcorr.me"
+SLOT_PATTERN = re.compile(r'\{\{\s*(\w+)\s*\}\}')
+URL_SAFE = re.compile(r'[A-Za-z0-9_.~-]*').fullmatch  # Characters quote() leaves alone
+
+# Values a template can use as {{slot}}; all are HTML-escaped when rendered
+SLOTS = {
+    'name': "Recipient's display name",
+    'email': "Recipient's address",
+    'tracking_id': "Tracking ID (click link)",
+    'employee_id': "Employee ID (open pixel)",
+    'tracking_url': "Tracked link that lands on /failed-test",
+    'pixel_url': "Open-tracking pixel (keyed by the token when tracking_id is one)",
+    'sent_time': "Current time, e.g. 2026-02-13 09:45 UTC",
+    'reference_date': "Today as DDMMYY"
+}
+
+class EmailTemplate:
+    """A template split into static segments and named slots.
+
+    render() copies the segment list, drops the values into the slot
+    positions and joins it; no parsing or formatting per recipient.
+    """
+
+    def __init__(self, name, text):
+        parts = SLOT_PATTERN.split(text)
+        # split() alternates static text and slot names: parts[1::2] are the slots
+        unknown = sorted(set(parts[1::2]) - set(SLOTS))
+        if unknown:
+            raise ValueError(f"Template {name}: unknown slot(s) {', '.join(unknown)}")
+        self.name = name
+        self.parts = parts
+        self.slots = [(index, parts[index]) for index in range(1, len(parts), 2)]
+
+    def render(self, values):
+        out = self.parts[:]
+        for index, slot in self.slots:
+            out[index] = values[slot]
+        return ''.join(out)
+
+class TemplateLibrary:
+    """Named templates from TEMPLATE_DIR (<name>.html), each read and compiled on first use"""
+
+    def __init__(self, directory=TEMPLATE_DIR):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.compiled = {}
+
+    def names(self):
+        try:
+            return sorted(f[:-len('.html')] for f in os.listdir(self.directory) if f.endswith('.html'))
+        except OSError:
+            return []
+
+    def exists(self, name):
+        return name in self.compiled or name in self.names()
+
+    def get(self, name=None):
+        name = name or DEFAULT_TEMPLATE
+        template = self.compiled.get(name)
+        if template is None:
+            if not re.fullmatch(r'[\w-]+', name):
+                raise ValueError(f"Invalid template name: {name}")
+            with self.lock:
+                template = self.compiled.get(name)
+                if template is None:
+                    path = os.path.join(self.directory, f"{name}.html")
+                    try:
+                        with open(path, 'r', encoding='utf-8') as f:
+                            template = EmailTemplate(name, f.read())
+                    except FileNotFoundError:
+                        raise ValueError(f"Unknown email template: {name}")
+                    self.compiled[name] = template
+        return template
+
+library = TemplateLibrary()
+
+_clock = {'minute': None, 'values': None}
+
+def clock_values():
+    """sent_time / reference_date, formatted once per minute instead of per email"""
+    minute = int(time.time() // 60)
+    if _clock['minute'] != minute:
+        now = time.gmtime(minute * 60)
+        _clock['values'] = {
+            'sent_time': time.strftime('%Y-%m-%d %H:%M UTC', now),
+            'reference_date': time.strftime('%d%m%y', now)
+        }
+        _clock['minute'] = minute
+    return _clock['values']
+
+def quote_part(value):
+    # IDs are nearly always plain [A-Za-z0-9_-], which quote() would return unchanged
+    return value if URL_SAFE(value) else quote(value, safe='')
+
+def quote_name(name):
+    """The name as it appears inside the quoted /failed-test URL (quoted twice)"""
+    if URL_SAFE(name.replace(' ', '')):
+        return name.replace(' ', '%2520')
+    return quote(quote(name), safe='')
+
+# The link is /track?id=<tid>&url=<quoted /failed-test?id=<tid>&name=<quoted name>>&dest=failed;
+# the constant pieces are quoted once here. Quoted text holds no HTML specials, so only the
+# separators need escaping ('&amp;').
+TRACK_PREFIX = f"{BASE_URL}/track?id="
+FAILED_PREFIX = "&amp;url=" + quote(f"{BASE_URL}/failed-test?id=", safe='')
+FAILED_NAME = quote("&name=", safe='')
+TRACK_SUFFIX = "&amp;dest=failed"
+PIXEL_PREFIX = f"{BASE_URL}/pixel?id="
+
+def recipient_values(name, email, tracking_id, employee_id):
+    """Slot values for one recipient, already HTML-escaped"""
+    if default_codec().is_token(tracking_id):
+        # Signed tokens are plain base62: /track sends them to /failed-test and finds the name itself
+        tracking_url = TRACK_PREFIX + tracking_id
+        pixel_url = PIXEL_PREFIX + tracking_id
+    else:
+        quoted_id = quote_part(tracking_id)
+        tracking_url = (TRACK_PREFIX + quoted_id + FAILED_PREFIX + quote_part(quoted_id) + FAILED_NAME
+                        + quote_name(name) + TRACK_SUFFIX)
+        pixel_url = PIXEL_PREFIX + quote_part(employee_id)
+    values = {
+        'name': escape(name),
+        'email': escape(email),
+        'tracking_id': escape(tracking_id),
+        'employee_id': escape(employee_id),
+        'tracking_url': tracking_url,
+        'pixel_url': pixel_url
+    }
+    values.update(clock_values())
+    return values
+
+def render_email(name, email, tracking_id, employee_id, template=None):
+    """HTML body of the phishing email for one recipient"""
+    return library.get(template).render(recipient_values(name, email, tracking_id, employee_id))
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    for template_name in library.names():
+        library.get(template_name)
+        start = time.perf_counter()
+        for i in range(count):
+            render_email(f"User {i}", f"user{i}@example.com", f"emp{i:05d}_{i:08x}", f"emp{i:05d}", template_name)
+        elapsed = time.perf_counter() - start
+        print(f"[TEMPLATE] {template_name:<16} {count} emails in {elapsed * 1000:7.1f} ms "
+              f"({elapsed / count * 1e6:.1f} us/email)")
@@ -0,0 +1,48 @@
+"""
+Shared pytest setup: the tracker's modules live flat in cyber-tracker/, one level up
+"""
+
+import os
+import sys
+import socket
+import pytest
+from aiosmtpd.controller import Controller
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SERVER_IDLE_TIMEOUT = 0.5  # Seconds before the test SMTP server drops an idle session
+
+class Recorder:
+    """aiosmtpd handler: keeps what it accepted; 'reject*' gets a 550, 'busy*' a 451 the first time"""
+
+    def __init__(self):
+        self.messages = []
+        self.sessions = set()
+        self.deferred = set()
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith('reject'):
+            return '550 5.1.1 No such user'
+        if address.startswith('busy') and address not in self.deferred:
+            self.deferred.add(address)
+            return '451 4.3.0 Try again later'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append((envelope.rcpt_tos[0], envelope.content))
+        self.sessions.add(session.peer)
+        return '250 OK'
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+@pytest.fixture
+def server():
+    """Local SMTP server on a free port; server.handler is its Recorder"""
+    controller = Controller(Recorder(), hostname='127.0.0.1', port=free_port(), timeout=SERVER_IDLE_TIMEOUT)
+    controller.start()
+    yield controller
+    controller.stop()
@@ -0,0 +1,166 @@
+"""
+The asyncio SMTP client: dot-stuffing, multi-line replies, PIPELINING and STARTTLS failures
+"""
+
+import asyncio
+import smtplib
+import pytest
+from email.mime.text import MIMEText
+from async_mailer import AsyncSMTPConnection, AsyncSMTPPool, event_loop, message_bytes
+from mailer import build_message, send_with_retry
+
+class ScriptedServer:
+    """Bare-bones SMTP server with canned replies, run on the shared sending loop.
+
+    replies maps a command prefix (e.g. 'STARTTLS', 'RCPT TO:<bad') to the
+    reply text, which may span several lines; anything else gets a 250.
+    A STARTTLS reply starting with 220 is followed by bytes that aren't TLS.
+    """
+
+    def __init__(self, ehlo=('PIPELINING', 'SIZE 1000000'), replies=None):
+        self.ehlo = ['fake.test'] + list(ehlo)
+        self.replies = replies or {}
+        self.commands = []
+        self.messages = []
+        self.server = asyncio.run_coroutine_threadsafe(
+            asyncio.start_server(self.handle, '127.0.0.1', 0), event_loop()).result(5)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    def reply_to(self, command):
+        for prefix, reply in self.replies.items():
+            if command.upper().startswith(prefix.upper()):
+                return reply
+        if command.upper().startswith('EHLO'):
+            return '\r\n'.join(f"250{' ' if number == len(self.ehlo) - 1 else '-'}{line}"
+                               for number, line in enumerate(self.ehlo))
+        if command.upper() == 'DATA':
+            return '354 End data with <CR><LF>.<CR><LF>'
+        if command.upper() == 'QUIT':
+            return '221 Bye'
+        return '250 OK'
+
+    async def handle(self, reader, writer):
+        writer.write(b'220 fake.test ESMTP\r\n')
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            command = line.decode('ascii').rstrip('\r\n')
+            self.commands.append(command)
+            reply = self.reply_to(command)
+            writer.write(reply.encode('ascii') + b'\r\n')
+            if command.upper() == 'DATA' and reply.startswith('354'):
+                data = b''
+                while True:
+                    line = await reader.readline()
+                    if line in (b'.\r\n', b''):
+                        break
+                    data += line
+                self.messages.append(data)
+                writer.write(b'250 Queued\r\n')
+            elif command.upper() == 'STARTTLS' and reply.startswith('220'):
+                writer.write(b'this is not a TLS handshake\r\n')
+                break
+            elif command.upper() == 'QUIT':
+                break
+        writer.close()
+
+    def close(self):
+        self.server.close()
+
+@pytest.fixture
+def scripted():
+    servers = []
+
+    def start(**kwargs):
+        servers.append(ScriptedServer(**kwargs))
+        return servers[-1]
+
+    yield start
+    for server in servers:
+        server.close()
+
+def run(coroutine):
+    return asyncio.run_coroutine_threadsafe(coroutine, event_loop()).result(10)
+
+def text_message(body):
+    msg = MIMEText(body, 'plain')
+    msg['Subject'] = 'Dots'
+    return msg
+
+def test_leading_dots_are_stuffed():
+    data = message_bytes(text_message(".hidden\n.\nmiddle\n..two\nend"))
+
+    assert b'\r\n..hidden\r\n' in data
+    assert b'\r\n..\r\n' in data  # A lone dot must not end the message early
+    assert b'\r\n...two\r\n' in data
+    assert data.endswith(b'end\r\n')
+    assert b'\n' not in data.replace(b'\r\n', b'')
+
+def test_dotted_lines_arrive_intact(server):
+    pool = AsyncSMTPPool(server.hostname, server.port, starttls=False, size=1)
+    try:
+        pool.send(text_message(".hidden\n.\nend"), 'it@example.test', ['user@example.test'])
+    finally:
+        pool.close()
+
+    content = server.handler.messages[0][1]
+    assert b'\r\n.hidden\r\n.\r\nend' in content
+
+def test_multiline_replies_and_pipelining(scripted):
+    server = scripted(ehlo=('PIPELINING', 'SIZE 1000000', 'AUTH PLAIN LOGIN'),
+                      replies={'RCPT TO:<bad': '550-5.1.1 No such user here\r\n550 5.1.1 Check the address'})
+    conn = AsyncSMTPConnection('127.0.0.1', server.port, timeout=5)
+
+    async def session():
+        await conn.connect(lambda: None, starttls=False)
+        refused = await conn.send(b'Subject: hi\r\n\r\nhello\r\n', 'it@example.test',
+                                  ['good@example.test', 'bad@example.test'])
+        await conn.close()
+        return refused
+
+    refused = run(session())
+
+    assert set(conn.features) == {'pipelining', 'size', 'auth'}
+    assert conn.features['auth'] == 'PLAIN LOGIN'
+    assert refused == {'bad@example.test': (550, b'5.1.1 No such user here\n5.1.1 Check the address')}
+    assert server.commands[1:5] == ['MAIL FROM:<it@example.test>', 'RCPT TO:<good@example.test>',
+                                    'RCPT TO:<bad@example.test>', 'DATA']
+    assert server.messages == [b'Subject: hi\r\n\r\nhello\r\n']
+
+def test_multiline_rejection_of_every_recipient(scripted):
+    server = scripted(replies={'RCPT': '550-5.7.1 Relaying denied\r\n550 5.7.1 Authenticate first'})
+    conn = AsyncSMTPConnection('127.0.0.1', server.port, timeout=5)
+
+    async def session():
+        await conn.connect(lambda: None, starttls=False)
+        try:
+            await conn.send(b'Subject: hi\r\n\r\nhello\r\n', 'it@example.test', ['someone@example.test'])
+        finally:
+            await conn.close()
+
+    with pytest.raises(smtplib.SMTPRecipientsRefused) as refused:
+        run(session())
+
+    assert refused.value.recipients == {'someone@example.test': (550, b'5.7.1 Relaying denied\n5.7.1 Authenticate first')}
+    assert 'RSET' in server.commands  # The pipelined DATA was closed off and the session reset
+
+@pytest.mark.parametrize('ehlo, replies, attempts, code', [
+    (('SIZE 1000000',), {}, 1, None),  # STARTTLS not offered: permanent
+    (('STARTTLS',), {'STARTTLS': '454 4.7.0 TLS not available due to temporary reason'}, 3, 454),
+    (('STARTTLS',), {'STARTTLS': '220 Ready to start TLS'}, 3, None),  # Handshake fails
+], ids=['not-offered', 'refused', 'handshake'])
+def test_starttls_failures_are_reported_and_release_the_slot(scripted, ehlo, replies, attempts, code):
+    server = scripted(ehlo=ehlo, replies=replies)
+    pool = AsyncSMTPPool('127.0.0.1', server.port, starttls=True, size=1, timeout=5)
+    msg = build_message('it@example.test', 'user@example.test', 'Subject', '<p>Hello</p>')
+
+    first = send_with_retry(pool, msg, 'it@example.test', 'user@example.test', retries=2, backoff=0)
+    # With size=1, a slot leaked by a failed connect would make this one hang
+    second = send_with_retry(pool, msg, 'it@example.test', 'user@example.test', retries=0, backoff=0)
+
+    assert first['status'] == 'failed' and first['attempts'] == attempts and first['code'] == code
+    assert second['status'] == 'failed'
+    assert pool.stats()['connections_opened'] == 0
+    assert server.messages == []
+    assert not any(command.startswith('MAIL') for command in server.commands)
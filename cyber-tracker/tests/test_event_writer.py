@@ -0,0 +1,51 @@
+"""
+BatchedEventWriter: a failed group commit is retried, not dropped
+"""
+
+import sqlite3
+import threading
+from event_store import BatchedEventWriter
+
+class FlakyStore:
+    """Store whose first `failures` write_batch() calls raise like a locked SQLite database"""
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.events = []
+        self.geo_updates = []
+        self.lock = threading.Lock()
+
+    def write_batch(self, events, geo_updates):
+        with self.lock:
+            if self.failures:
+                self.failures -= 1
+                raise sqlite3.OperationalError("database is locked")
+            self.events.extend(events)
+            self.geo_updates.extend(geo_updates)
+
+def event(number):
+    return {'event_id': f"e{number}", 'event_type': 'click', 'tracking_id': 't', 'timestamp': '2026-10-18T00:00:00'}
+
+def test_failed_batches_are_retried_until_they_commit():
+    store = FlakyStore(failures=3)
+    writer = BatchedEventWriter(store, max_latency=0.01, retry_delay=0.01)
+    for number in range(50):
+        writer.append(event(number))
+    writer.update_geo('e0', {'country': 'Ireland'}, 'click')
+    writer.stop()
+
+    assert [e['event_id'] for e in store.events] == [f"e{number}" for number in range(50)]
+    assert [update[0] for update in store.geo_updates] == ['e0']
+    stats = writer.stats()
+    assert stats['errors'] == 3 and stats['retries'] == 3
+    assert stats['events_written'] == 50 and stats['events_lost'] == 0
+
+def test_shutdown_gives_up_only_when_its_timeout_runs_out():
+    store = FlakyStore(failures=10 ** 9)
+    writer = BatchedEventWriter(store, max_latency=0.01, retry_delay=0.01, retry_max_delay=0.05)
+    writer.append(event(1))
+    writer.stop(timeout=0.5)
+
+    assert not writer.thread.is_alive()
+    assert store.events == []
+    assert writer.stats()['events_lost'] == 1
@@ -0,0 +1,38 @@
+"""
+generate_links.py: a recipient keeps their token when the campaign CSV is edited and regenerated
+"""
+
+import csv
+import pytest
+from generate_links import process_campaign
+from tokens import TokenCodec, TOKEN_SECRET_ENV
+
+SECRET = '00' * 32
+
+def write_campaign(path, employees):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['employee_id', 'email', 'name'])
+        for employee in employees:
+            writer.writerow([employee, f"{employee}@example.test", employee.title()])
+
+def tokens_by_employee(output):
+    with open(output, newline='') as f:
+        return {row['employee_id']: row['tracking_id'] for row in csv.DictReader(f)}
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_tokens_survive_edits_to_the_csv(tmp_path, monkeypatch, workers):
+    monkeypatch.setenv(TOKEN_SECRET_ENV, SECRET)
+    campaign = str(tmp_path / 'quarterly.csv')
+    write_campaign(campaign, ['emp1', 'emp2', 'emp3'])
+    first = tokens_by_employee(process_campaign(campaign, workers=workers))
+
+    # Someone is removed, someone added at the top, and the rest re-sorted
+    write_campaign(campaign, ['emp9', 'emp3', 'emp1'])
+    second = tokens_by_employee(process_campaign(campaign, workers=workers))
+
+    assert second['emp1'] == first['emp1'] and second['emp3'] == first['emp3']
+    assert second['emp9'] not in first.values()
+    codec = TokenCodec(bytes.fromhex(SECRET))
+    numbers = {employee: codec.decode(token)[1] for employee, token in second.items()}
+    assert numbers == {'emp1': 1, 'emp3': 3, 'emp9': 4}  # emp2's number is never handed out again
@@ -0,0 +1,64 @@
+"""
+SMTP connection pools (both backends) against a local aiosmtpd server
+"""
+
+import time
+import pytest
+from conftest import SERVER_IDLE_TIMEOUT
+from mailer import BulkSender, build_message, pool_class, send_with_retry
+
+@pytest.fixture(params=['smtplib', 'asyncio'])
+def pool(request, server):
+    pool = pool_class(request.param)(server.hostname, server.port, starttls=False, size=2)
+    yield pool
+    pool.close()
+
+def message(to):
+    return build_message('it@example.test', to, 'Subject', '<p>Hello</p>')
+
+def test_sequential_sends_reuse_one_connection(pool, server):
+    for number in range(5):
+        to = f"user{number}@example.test"
+        pool.send(message(to), 'it@example.test', [to])
+
+    assert [to for to, _ in server.handler.messages] == [f"user{number}@example.test" for number in range(5)]
+    assert len(server.handler.sessions) == 1
+    stats = pool.stats()
+    assert stats['connections_opened'] == 1 and stats['messages_sent'] == 5 and stats['idle'] == 1
+
+def test_reconnects_after_the_server_closes_the_session(pool, server):
+    pool.send(message('first@example.test'), 'it@example.test', ['first@example.test'])
+    time.sleep(SERVER_IDLE_TIMEOUT * 3)  # The server times the pooled session out and hangs up
+
+    result = send_with_retry(pool, message('second@example.test'), 'it@example.test', 'second@example.test',
+                             retries=2, backoff=0)
+
+    assert result == {'status': 'sent', 'attempts': 2}
+    assert [to for to, _ in server.handler.messages] == ['first@example.test', 'second@example.test']
+    stats = pool.stats()
+    assert stats['connections_opened'] == 2 and stats['connections_discarded'] == 1
+
+def test_bulk_send_reports_each_recipient(pool, server):
+    recipients = [
+        {'email': 'ok@example.test', 'tracking_id': 't1'},
+        {'email': 'reject@example.test', 'tracking_id': 't2'},
+        {'email': 'busy@example.test', 'tracking_id': 't3'},
+        {'email': 'untracked@example.test', 'tracking_id': ''},
+        {'email': 'broken@example.test', 'tracking_id': 't5'},
+    ]
+
+    def render(recipient):
+        if recipient['email'].startswith('broken'):
+            raise ValueError("template error")
+        return message(recipient['email'])
+
+    reported = []
+    results = BulkSender(pool, 'it@example.test', render, retries=2, backoff=0).send(recipients, reported.append)
+
+    assert [r['email'] for r in results] == [r['email'] for r in recipients]
+    assert [(r['status'], r['attempts']) for r in results] == [
+        ('sent', 1), ('failed', 1), ('sent', 2), ('skipped', 0), ('failed', 0)]
+    assert results[1]['code'] == 550
+    assert 'template error' in results[4]['error']
+    assert sorted(r['email'] for r in reported) == sorted(r['email'] for r in recipients)
+    assert sorted(to for to, _ in server.handler.messages) == ['busy@example.test', 'ok@example.test']
@@ -0,0 +1,33 @@
+"""
+RecipientDirectory: a campaign's plain and _with_links CSVs describe the same people
+"""
+
+import csv
+import os
+from recipients import RecipientDirectory
+
+def write_csv(path, rows, fields):
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+
+def test_linked_and_plain_csvs_are_counted_once(tmp_path):
+    people = [{'employee_id': 'paddy001', 'email': 'paddy@example.com', 'name': 'Paddy'},
+              {'employee_id': 'jack001', 'email': 'jack@example.com', 'name': 'Jack'},
+              {'employee_id': '', 'email': 'Ann@example.com', 'name': 'Ann'}]
+    write_csv(tmp_path / 'q3.csv', people + [{'employee_id': 'new001', 'email': 'new@example.com', 'name': 'New'}],
+              ['employee_id', 'email', 'name'])
+    write_csv(tmp_path / 'q3_with_links.csv',
+              [dict(person, email=person['email'].lower(), tracking_id=f"tok{number}") for number, person in enumerate(people)],
+              ['employee_id', 'email', 'name', 'tracking_id'])
+    write_csv(tmp_path / 'q4.csv', people[:1], ['employee_id', 'email', 'name'])
+
+    directory = RecipientDirectory(str(tmp_path))
+
+    q3 = directory.recipients(campaign='q3')
+    assert [r['name'] for r in q3] == ['Paddy', 'Jack', 'Ann', 'New']
+    assert [r['tracking_id'] for r in q3] == ['tok0', 'tok1', 'tok2', '']
+    assert len(directory.recipients(campaign='q3', with_tracking_only=True)) == 3
+    # The same person in another campaign is another recipient
+    assert len(directory.recipients()) == 5
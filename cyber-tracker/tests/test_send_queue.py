@@ -0,0 +1,44 @@
+"""
+SendQueue: the rate-limit wait happens before a message is claimed
+"""
+
+import time
+import sqlite3
+from mailer import build_message
+from send_queue import SendQueue, TokenBucket, SENDING
+
+class WatchedBucket(TokenBucket):
+    """Records how many messages were 'sending' each time a worker waits for a token"""
+
+    def __init__(self, journal, rate, burst):
+        super().__init__(rate, burst)
+        self.journal = journal
+        self.sending_while_waiting = []
+
+    def take(self):
+        with sqlite3.connect(self.journal) as conn:
+            self.sending_while_waiting.append(
+                conn.execute("SELECT COUNT(*) FROM messages WHERE state = ?", [SENDING]).fetchone()[0])
+        super().take()
+
+def render(settings, recipient):
+    return build_message(settings['from_email'], recipient['email'], 'Subject', '<p>Hello</p>')
+
+def test_messages_are_claimed_only_after_the_rate_limit_wait(tmp_path, server):
+    journal = str(tmp_path / 'send_queue.db')
+    queue = SendQueue(journal, render, workers=1)
+    bucket = queue.buckets[server.hostname] = WatchedBucket(journal, rate=20.0, burst=1)
+    settings = {'host': server.hostname, 'port': server.port, 'starttls': False, 'from_email': 'it@example.test'}
+    job_id = queue.enqueue([{'email': f"user{number}@example.test", 'tracking_id': f"t{number}"}
+                            for number in range(4)], settings)
+    queue.start()
+    deadline = time.monotonic() + 10
+    while not queue.status(job_id, with_results=False)['done'] and time.monotonic() < deadline:
+        time.sleep(0.05)
+    queue.stop()
+
+    status = queue.status(job_id, with_results=False)
+    assert status['done'] and status['sent'] == 4
+    assert len(server.handler.messages) == 4
+    assert len(bucket.sending_while_waiting) == 4
+    assert bucket.sending_while_waiting == [0, 0, 0, 0]
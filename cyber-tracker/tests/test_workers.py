@@ -0,0 +1,106 @@
+"""
+serve.py with two workers on one SQLite store: the saved dashboard state counts exactly what its watermark covers
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import sqlite3
+import threading
+import subprocess
+import urllib.request
+from urllib.error import URLError, HTTPError
+from conftest import free_port
+
+TRACKER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Stores and caches a running tracker leaves behind; the copy starts without them
+RUNTIME_STATE = ('events', 'events.db*', 'dashboard_state.json', 'send_queue.db*', 'geo_cache.json*', 'reports',
+                 'metrics', 'quick_send', 'token_secret.key*', '*.lock', 'serve.pid', 'tests', '__pycache__')
+
+class NoRedirects(urllib.request.HTTPRedirectHandler):
+    """Leave /track's redirect to the phishing target unfollowed"""
+
+    def redirect_request(self, *args):
+        return None
+
+opener = urllib.request.build_opener(NoRedirects)
+
+def get(url):
+    with urllib.request.urlopen(url, timeout=5) as response:
+        return response.status
+
+def start_server(directory, port):
+    server = subprocess.Popen([sys.executable, 'serve.py', '--workers', '2', '--bind', f"127.0.0.1:{port}"],
+                              cwd=directory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                              env=dict(os.environ, TRACKER_TOKEN_SECRET='11' * 32))
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            get(f"http://127.0.0.1:{port}/api/writer-stats")
+            return server
+        except (URLError, ConnectionError):
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("serve.py did not start")
+
+def counted_up_to(db_path, seq):
+    """Clicks and opens stored in a partition up to a watermark"""
+    totals = {'click': 0, 'open': 0}
+    with sqlite3.connect(db_path) as conn:
+        for event_type, count in conn.execute(
+                "SELECT event_type, COUNT(*) FROM events WHERE seq <= ? GROUP BY event_type", [seq or 0]):
+            totals[event_type] = count
+    return totals
+
+def test_saved_state_matches_its_watermark(tmp_path):
+    directory = str(tmp_path / 'tracker')
+    shutil.copytree(TRACKER_DIR, directory, ignore=shutil.ignore_patterns(*RUNTIME_STATE))
+    port = free_port()
+    server = start_server(directory, port)
+
+    # Campaign clicks and opens (test_campaign partition) and a logged legacy pixel (default partition),
+    # still arriving at both workers while the server shuts down
+    urls = [f"http://127.0.0.1:{port}/track?id=paddy001_2ca6c5f3", f"http://127.0.0.1:{port}/pixel?id=paddy001",
+            f"http://127.0.0.1:{port}/pixel?id=tim_151851"]
+    sent = []
+
+    def hammer(url):
+        while True:
+            try:
+                opener.open(url, timeout=5).close()
+            except HTTPError:
+                pass  # The 302 from /track
+            except (URLError, ConnectionError):
+                return  # The server has gone
+            sent.append(url)
+
+    threads = [threading.Thread(target=hammer, args=(url,)) for url in urls for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    time.sleep(2)
+    server.send_signal(signal.SIGTERM)
+    assert server.wait(60) == 0
+    for thread in threads:
+        thread.join(10)
+
+    with open(os.path.join(directory, 'dashboard_state.json')) as f:
+        state = json.load(f)
+    watermark = state['watermark']
+    assert set(watermark) >= {'default', 'test_campaign'}
+    expected = {'click': 0, 'open': 0}
+    for partition, seq in watermark.items():
+        db_path = os.path.join(directory, 'events.db') if partition == 'default' else \
+            os.path.join(directory, 'events', partition, 'events.db')
+        for event_type, count in counted_up_to(db_path, seq).items():
+            expected[event_type] += count
+    assert state['totals'] == expected
+    assert len(sent) > 50 and expected['click'] > 4 and expected['open'] > 3  # More than the imported history
+
+    # Saved separately (the last worker to exit may not be the one that saved the file above)
+    with open(os.path.join(directory, 'events', 'test_campaign', 'dashboard_state.json')) as f:
+        campaign_state = json.load(f)
+    assert campaign_state['totals'] == counted_up_to(
+        os.path.join(directory, 'events', 'test_campaign', 'events.db'), campaign_state['watermark'])
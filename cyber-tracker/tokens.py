@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Compact, self-verifying tracking tokens: base62(recipient, campaign) + truncated HMAC tag
+"""
+
+import os
+import sys
+import hmac
+import zlib
+import string
+import hashlib
+import threading
+from logs import log
+
+TOKEN_SECRET_FILE = "token_secret.key"  # Created on first use; every issued link depends on it
+TOKEN_SECRET_ENV = "TRACKER_TOKEN_SECRET"  # Hex secret, overrides the file
+ALPHABET = string.digits + string.ascii_uppercase + string.ascii_lowercase
+TAG_BYTES = 6  # 48-bit tag: a forger needs ~2^47 guesses per valid token
+TAG_LENGTH = 9  # base62 digits for TAG_BYTES (62^9 > 2^48)
+MAX_TOKEN_LENGTH = 32
+
+_DIGITS = {ch: value for value, ch in enumerate(ALPHABET)}
+
+def b62encode(number, width=0):
+    digits = []
+    while number:
+        number, digit = divmod(number, 62)
+        digits.append(ALPHABET[digit])
+    return ''.join(reversed(digits)).rjust(width, '0') or '0'
+
+def b62decode(text):
+    """Integer value; ValueError for anything outside [0-9A-Za-z]"""
+    number = 0
+    try:
+        for ch in text:
+            number = number * 62 + _DIGITS[ch]
+    except KeyError:
+        raise ValueError(f"Not base62: {text!r}")
+    return number
+
+def campaign_number(campaign_id):
+    """Stable 32-bit number for a campaign id (no registry lookup needed to compute it)"""
+    return zlib.crc32(campaign_id.encode('utf-8'))
+
+class TokenCodec:
+    """Encodes (campaign number, recipient number) as base62 followed by a fixed-width HMAC tag.
+
+    decode() checks length, alphabet and tag before anything else, so a
+    forged or garbage ID costs one HMAC and is never logged or looked up.
+    """
+
+    def __init__(self, secret):
+        # Keyed once; each tag copies the keyed state instead of re-hashing the key
+        self.keyed = hmac.new(secret, digestmod=hashlib.sha256)
+
+    def _mac(self, body):
+        mac = self.keyed.copy()
+        mac.update(body.encode('ascii'))
+        return mac.digest()[:TAG_BYTES]
+
+    def encode(self, campaign_no, recipient_no):
+        body = b62encode((recipient_no << 32) | campaign_no)
+        return body + b62encode(int.from_bytes(self._mac(body), 'big'), TAG_LENGTH)
+
+    def decode(self, token):
+        """(campaign number, recipient number), or None if the token isn't genuine"""
+        if not token or not TAG_LENGTH < len(token) <= MAX_TOKEN_LENGTH:
+            return None
+        body, tag = token[:-TAG_LENGTH], token[-TAG_LENGTH:]
+        try:
+            payload = b62decode(body)
+            tag = b62decode(tag).to_bytes(TAG_BYTES, 'big')
+        except (ValueError, OverflowError):
+            return None
+        if not hmac.compare_digest(self._mac(body), tag):
+            return None
+        return payload & 0xFFFFFFFF, payload >> 32
+
+    def is_token(self, token):
+        return self.decode(token) is not None
+
+def load_secret(path=TOKEN_SECRET_FILE):
+    """Secret from $TRACKER_TOKEN_SECRET, else the key file (created with 32 random bytes)"""
+    env = os.environ.get(TOKEN_SECRET_ENV)
+    if env:
+        return bytes.fromhex(env)
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+    secret = os.urandom(32)
+    # Written in full aside, then linked into place: another process never reads a partial key,
+    # and if one creates the key at the same moment, link() fails and theirs is used
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(secret)
+            f.flush()
+            os.fsync(f.fileno())
+        os.link(tmp_path, path)
+    except FileExistsError:
+        with open(path, 'rb') as f:
+            return f.read()
+    finally:
+        os.remove(tmp_path)
+    log.warning('TOKEN', 'Created a new key; back it up - links issued with it stop verifying without it', path=path)
+    return secret
+
+_codec = None
+_codec_lock = threading.Lock()
+
+def default_codec():
+    """Codec for the tracker's secret, loaded once per process"""
+    global _codec
+    with _codec_lock:
+        if _codec is None:
+            _codec = TokenCodec(load_secret())
+        return _codec
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print("Usage: python3 tokens.py TOKEN")
+        sys.exit(1)
+    decoded = default_codec().decode(sys.argv[1])
+    if decoded is None:
+        print("❌ Not a valid token for this tracker's secret")
+        sys.exit(1)
+    print(f"✅ campaign #{decoded[0]}, recipient #{decoded[1]}")
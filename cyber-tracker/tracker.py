@@ -4,15 +4,38 @@ Cyber Awareness Link Tracker v3 - With Visual Analytics
 Tracks email link clicks + email opens + geolocation + Charts
 """
 
-from flask import Flask, request, redirect, render_template_string, jsonify, send_file
+from flask import Flask, request, redirect, render_template_string, jsonify, Response, stream_with_context, send_file, g
+import re
 import json
 import csv
+import time
 import uuid
-import requests
 from datetime import datetime, timedelta
 from urllib.parse import quote, unquote
+from html import escape
 import os
 import base64
+import atexit
+import fcntl
+import io
+import zlib
+import hashlib
+from contextlib import nullcontext
+from geo import get_geolocation, GeoEnricher, geo_cache
+from event_store import open_event_store, import_jsonl, BatchedEventWriter, StoreFollower, DEFAULT_PARTITION
+from aggregates import DashboardAggregates
+from live_feed import LiveFeed
+from logs import log
+from metrics import Registry, SharedMetrics
+from pixel import pixel_response
+from dashboard import DashboardPage
+from report import render_report, ReportCache, REPORT_LAYOUT
+from recipients import RecipientDirectory
+from campaigns import CampaignRegistry
+from templates import render_email, library as template_library
+from tokens import default_codec, campaign_number
+from mailer import get_pool, pool_stats, build_message, send_with_retry, DEFAULT_SUBJECT, DEFAULT_FROM_NAME, SMTP_BACKENDS
+from send_queue import SendQueue, SEND_QUEUE_DB, SEND_WORKERS
 
 app = Flask(__name__)
 
@@ -20,117 +43,384 @@ app = Flask(__name__)
 LOG_FILE = "clicks.log"
 OPENS_LOG = "opens.log"
 CAMPAIGNS_DIR = "campaigns"
-CAMPAIGN_CSV = "campaigns/test_campaign_with_links.csv"
+GEO_WORKERS = 4  # Background threads resolving IP geolocation
+EVENT_STORE = "sqlite"  # "sqlite" or "jsonl" (the legacy clicks.log/opens.log files)
+EVENT_DB = "events.db"
+EVENT_PARTITIONS_DIR = "events"  # One sub-directory of events per campaign
+EVENT_FSYNC = False  # fsync after every committed batch
+WRITER_MAX_BATCH = 500  # Events per group commit
+WRITER_MAX_LATENCY = 0.05  # Seconds an event may wait for its batch
+LOG_MAX_BYTES = 50 * 1024 * 1024  # JSONL store: roll the active log over at this size...
+LOG_ROTATE_DAILY = True  # ...or when the day changes
+LOG_COMPRESSION = "gzip"  # "gzip" or "zstd" (needs the zstandard package)
+DASHBOARD_STATE = "dashboard_state.json"  # Saved aggregates + the event-store watermark they cover
+STARTUP_LOCK = "tracker.lock"  # Held while a process opens (and if needed migrates) the stores
+FOLLOW_INTERVAL = 1.0  # With several workers: seconds between reads of the other workers' events
+FOLLOW_GEO_WAIT = 60  # ...and how long to wait for another worker to geolocate one of them
+LEGACY_TRACKING_IDS = True  # Also accept employee_id_xxxxxxxx IDs issued before signed tokens (in a campaign CSV or the event history)
+LEGACY_ID = re.compile(r'[\w.@+-]{1,128}')  # Shape a legacy ID must have to be looked up at all
+LEGACY_SUFFIX = re.compile(r'[0-9a-f]{8}')  # Random part of a legacy click ID; the ID without it is the pixel ID
+QUICK_SEND_CAMPAIGN = 0  # Campaign number of tokens /api/generate-email issues outside any campaign
+QUICK_SEND_DIR = "quick_send"  # recipients.csv: who each Quick Send token went to, appended as they are issued
+REPORT_CACHE_DIR = "reports"  # Finished PDF reports, named after the event-store state they cover...
+REPORT_CACHE_MAX = 20  # ...at most this many
+METRICS_DIR = "metrics"  # With several workers: each one's latest metrics, combined by /metrics...
+METRICS_SYNC_INTERVAL = 5.0  # ...written this often (seconds)
 
-# Base64 encoded 1x1 transparent GIF pixel
-PIXEL_GIF = base64.b64decode('R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7')
+# Instrumentation served on /metrics; everything below only adds to these
+metrics = Registry()
+REQUESTS = metrics.counter('tracker_http_requests_total', 'HTTP requests by route, method and status',
+                           ('route', 'method', 'status'))
+REQUEST_SECONDS = metrics.histogram('tracker_http_request_duration_seconds',
+                                    'Time to build each response (not to stream it), by route', ('route',))
+GEO_SECONDS = metrics.histogram('tracker_geolocation_seconds', 'IP geolocation lookups: range table, cache, then ip-api.com')
+LOG_SECONDS = metrics.histogram('tracker_event_log_seconds',
+                                'Logging a click or open on the request thread (queue, count, submit for geolocation)',
+                                ('event_type',))
+COMMIT_SECONDS = metrics.histogram('tracker_event_commit_seconds', 'Event writer group commits to the store')
+NAME_SECONDS = metrics.histogram('tracker_name_resolution_seconds', 'Tracking ID to display name lookups')
+AGGREGATION_SECONDS = metrics.histogram('tracker_dashboard_aggregation_seconds',
+                                        'Rendering /dashboard, re-rendering fragments whose counters changed, by scope (all or campaign)',
+                                        ('scope',))
 
-def load_name_mapping():
-    """Load employee ID to name mapping from campaign CSV"""
-    names = {}
-    try:
-        if os.path.exists(CAMPAIGN_CSV):
-            with open(CAMPAIGN_CSV, 'r') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    emp_id = row.get('employee_id', '')
-                    name = row.get('name', emp_id)
-                    tracking_id = row.get('tracking_id', '')
-                    # Map both base ID and full tracking ID to name
-                    names[emp_id] = name
-                    names[tracking_id] = name
-                    # Also map pixel ID (without random suffix)
-                    if '_' in tracking_id:
-                        base_id = tracking_id.split('_')[0]
-                        names[base_id] = name
-    except Exception as e:
-        print(f"[NAMES] Error loading names: {e}")
-    return names
+# Every campaign CSV under CAMPAIGNS_DIR, reloaded only when a file changes
+recipient_directory = RecipientDirectory(CAMPAIGNS_DIR)
+campaign_registry = CampaignRegistry(CAMPAIGNS_DIR, recipient_directory)
 
-def get_geolocation(ip_address):
-    """Get geolocation from IP address using ip-api.com"""
-    try:
-        if ip_address.startswith(('192.168.', '10.', '172.16.', '127.')):
-            return {"country": "Local", "city": "Local Network", "isp": "Private"}
-        
-        response = requests.get(f"http://ip-api.com/json/{ip_address}?fields=status,country,city,isp,org", timeout=3)
-        if response.status_code == 200:
-            data = response.json()
-            if data.get('status') == 'success':
-                return {
-                    "country": data.get('country', 'Unknown'),
-                    "city": data.get('city', 'Unknown'),
-                    "isp": data.get('isp', 'Unknown'),
-                    "org": data.get('org', 'Unknown')
-                }
-    except Exception as e:
-        print(f"[GEO] Error: {e}")
-    
-    return {"country": "Unknown", "city": "Unknown", "isp": "Unknown"}
+# Quick Send recipients, read like a campaign CSV so every worker sees the names
+QUICK_SEND_FILE = os.path.join(QUICK_SEND_DIR, 'recipients.csv')
+quick_send_directory = RecipientDirectory(QUICK_SEND_DIR)
 
-def log_click(tracking_id, target_url, ip_address, user_agent, referrer):
-    """Log a click event with geolocation"""
-    timestamp = datetime.utcnow().isoformat()
-    geo = get_geolocation(ip_address)
-    
+# Signed tracking tokens (tokens.py) carry their campaign's number, so they resolve without a lookup
+token_codec = default_codec()
+_campaign_numbers = {}
+
+# Unsigned IDs in the event history when this process started (see legacy_ids_in)
+logged_legacy_ids = frozenset()
+
+def campaign_for_number(number):
+    """Campaign whose campaign_number() is `number`, or None"""
+    if number not in _campaign_numbers:
+        # New campaign since the last miss: re-map the registry
+        _campaign_numbers.update((campaign_number(campaign_id), campaign_id) for campaign_id in campaign_registry.ids())
+    return _campaign_numbers.get(number)
+
+def check_tracking_id(tracking_id):
+    """(valid, campaign) for an ID from a link.
+
+    Tokens are verified by their HMAC tag; a forged or mangled token is
+    invalid. Legacy IDs are only accepted while LEGACY_TRACKING_IDS is
+    set, and only if a campaign CSV issued exactly that ID or it was
+    already logged (Quick Send IDs from before tokens were in no CSV).
+    """
+    decoded = token_codec.decode(tracking_id)
+    if decoded is not None:
+        return True, campaign_for_number(decoded[0])
+    if not LEGACY_TRACKING_IDS or not LEGACY_ID.fullmatch(tracking_id):
+        return False, None
+    recipient = recipient_directory.issued(tracking_id)
+    if recipient is None:
+        return logged_legacy_id(tracking_id), None
+    return True, recipient['campaign'] if recipient['campaign'] != DEFAULT_PARTITION else None
+
+def legacy_ids_in(tracking_ids):
+    """The unsigned IDs among these, plus the pixel ID of each click ID (employee_id_xxxxxxxx)"""
+    legacy_ids = set()
+    for tracking_id in tracking_ids:
+        if not tracking_id or token_codec.is_token(tracking_id):
+            continue
+        legacy_ids.add(tracking_id)
+        base, _, suffix = tracking_id.rpartition('_')
+        if base and LEGACY_SUFFIX.fullmatch(suffix):
+            legacy_ids.add(base)
+    return frozenset(legacy_ids)
+
+def logged_legacy_id(tracking_id):
+    """Whether this unsigned ID, or the pixel ID of the same email, was in the event history at startup"""
+    if tracking_id in logged_legacy_ids:
+        return True
+    base, _, suffix = tracking_id.rpartition('_')
+    return bool(base) and base in logged_legacy_ids and LEGACY_SUFFIX.fullmatch(suffix) is not None
+
+def campaign_for(tracking_id):
+    """Campaign a tracking ID was issued for, or None"""
+    return check_tracking_id(tracking_id)[1]
+
+# Number of worker processes serving the app (set by serve.py). Each worker has its own
+# copy of everything below; the event store (SQLite) is what they share
+WORKER_PROCESSES = int(os.environ.get('TRACKER_WORKERS', '1'))
+if WORKER_PROCESSES > 1 and EVENT_STORE != "sqlite":
+    raise RuntimeError("The JSONL event store has a single writer; use EVENT_STORE = 'sqlite' with several workers")
+
+# Event storage, partitioned by campaign. The pre-partitioning store (events.db / the
+# JSONL logs) is the default partition; on first start with SQLite, bring the existing
+# JSONL history across, and on first start with partitions, move campaign events out.
+# Workers start at the same time, so only one at a time looks at (and migrates) the files
+with open(STARTUP_LOCK, 'a') as _startup_lock:
+    fcntl.flock(_startup_lock, fcntl.LOCK_EX)
+    _new_event_db = EVENT_STORE == "sqlite" and not os.path.exists(EVENT_DB)
+    _new_partitions = not os.path.isdir(EVENT_PARTITIONS_DIR)
+    event_store = open_event_store(EVENT_STORE, EVENT_DB, {'click': LOG_FILE, 'open': OPENS_LOG}, fsync=EVENT_FSYNC,
+                                   rotation={'max_bytes': LOG_MAX_BYTES, 'rotate_daily': LOG_ROTATE_DAILY,
+                                             'compression': LOG_COMPRESSION},
+                                   partitions_dir=EVENT_PARTITIONS_DIR)
+    if _new_event_db:
+        import_jsonl(event_store.partition(None), [LOG_FILE, OPENS_LOG])
+    if _new_partitions:
+        event_store.split_default(campaign_for)
+    if not os.path.exists(QUICK_SEND_FILE):
+        os.makedirs(QUICK_SEND_DIR, exist_ok=True)
+        with open(QUICK_SEND_FILE, 'w', newline='') as f:
+            f.write('tracking_id,name,email\r\n')
+
+# Dashboard counters: restore the saved state, then read only what was logged since
+aggregates = DashboardAggregates()
+aggregates.load(DASHBOARD_STATE, EVENT_STORE)
+aggregates.catch_up(event_store)
+# Every legacy ID logged from now on was in a campaign CSV, so the history so far is all check_tracking_id needs
+logged_legacy_ids = legacy_ids_in(aggregates.tracking_ids())
+
+# Per-campaign counters, each saved inside its own partition directory
+campaign_aggregates = {}
+follower = None  # StoreFollower, started further down once there are several workers
+
+def campaign_state_path(campaign):
+    return os.path.join(EVENT_PARTITIONS_DIR, campaign, DASHBOARD_STATE)
+
+def aggregates_for(campaign):
+    """Dashboard counters for one campaign, read from its partition on first use.
+
+    Call it before the event it is for is logged: the partition is read
+    when the counters are created, and add() would count that event again.
+    With several workers, the partition is read only as far as the follower
+    has got (holding it still meanwhile); it delivers everything after that.
+    """
+    counters = campaign_aggregates.get(campaign)
+    if counters is not None:
+        return counters
+    with follower.lock if follower is not None else nullcontext():
+        counters = campaign_aggregates.get(campaign)
+        if counters is None:
+            counters = DashboardAggregates()
+            store = event_store.partition(campaign, create=False)
+            if store is not None:
+                counters.load(campaign_state_path(campaign), EVENT_STORE)
+                until = None
+                if WORKER_PROCESSES > 1:
+                    # Before the follower starts, it starts from where the main counters are
+                    followed = follower.watermark if follower is not None else aggregates.watermark
+                    until = (followed or {}).get(campaign, 0)
+                counters.catch_up(store, until)
+            counters = campaign_aggregates.setdefault(campaign, counters)
+    return counters
+
+for _campaign in event_store.partition_names():
+    if _campaign != DEFAULT_PARTITION:
+        aggregates_for(_campaign)
+
+def save_dashboard_state():
+    """Persist aggregates; runs at exit after the geo workers and event writer have drained"""
+    if follower is not None:
+        # Other workers may still be logging: save exactly what has been counted
+        follower.poll()
+        watermark = follower.watermark or {}
+    else:
+        watermark = event_store.latest_watermark()
+    aggregates.watermark = watermark
+    aggregates.save(DASHBOARD_STATE, EVENT_STORE)
+    for campaign, counters in list(campaign_aggregates.items()):
+        store = event_store.partition(campaign, create=False)
+        if store is not None:
+            counters.watermark = watermark.get(campaign) if follower is not None else store.latest_watermark()
+            counters.save(campaign_state_path(campaign), EVENT_STORE)
+
+atexit.register(save_dashboard_state)
+
+# All writes go through one group-committing thread instead of the request handlers
+event_writer = BatchedEventWriter(event_store, max_batch=WRITER_MAX_BATCH, max_latency=WRITER_MAX_LATENCY,
+                                  on_commit=COMMIT_SECONDS.observe)
+atexit.register(event_writer.stop)
+
+def recipient_for(tracking_id):
+    """Campaign (or Quick Send) recipient of a tracking ID, else None"""
+    return recipient_directory.lookup(tracking_id) or quick_send_directory.lookup(tracking_id)
+
+def resolve_name(tracking_id):
+    """Display name for a tracking ID, falling back to the ID itself"""
+    with NAME_SECONDS.time():
+        recipient = recipient_for(tracking_id)
+        return recipient['name'] if recipient else tracking_id
+
+# /api/export/pdf: finished reports, served again until new events arrive
+report_cache = ReportCache(REPORT_CACHE_DIR, REPORT_CACHE_MAX)
+
+# /dashboard: prebuilt page shell plus fragments cached per set of counters
+dashboard_page = DashboardPage(resolve_name)
+
+# Open /api/stream connections (dashboard live updates)
+live_feed = LiveFeed()
+
+def live_message(event, counters):
+    unique_clickers, unique_openers = counters.unique_counts()
+    chart_data = counters.chart_data()
+    return {
+        'event': dict(event, name=resolve_name(event['tracking_id'])),
+        'stats': {
+            'clicks': chart_data['clicks'],
+            'opens': chart_data['opens'],
+            'unique_clickers': unique_clickers,
+            'unique_openers': unique_openers
+        }
+    }
+
+def publish_event(event):
+    """Push a name-resolved, geo-enriched event to live dashboards (all campaigns, and its own)"""
+    if live_feed.has_subscribers():
+        live_feed.publish(live_message(event, aggregates), event_id=event.get('event_id'))
+    campaign = event.get('campaign')
+    if campaign and live_feed.has_subscribers(campaign):
+        live_feed.publish(live_message(event, aggregates_for(campaign)), event_id=event.get('event_id'), topic=campaign)
+
+def apply_geolocation(event, geo):
+    """Count a geolocated event and push it to live dashboards"""
+    aggregates.apply_geo(event['event_id'], geo)
+    if event.get('campaign'):
+        aggregates_for(event['campaign']).apply_geo(event['event_id'], geo)
+    publish_event(dict(event, country=geo.get('country'), city=geo.get('city'), isp=geo.get('isp')))
+
+def record_geolocation(event, geo):
+    """Write enrichment results back to the stored event"""
+    event_writer.update_geo(event['event_id'], geo, event['event_type'], event.get('campaign'))
+    apply_geolocation(event, geo)
+    log.info('GEO', tracking_id=event['tracking_id'], city=geo.get('city'), country=geo.get('country'))
+
+def timed_geolocation(ip_address):
+    with GEO_SECONDS.time():
+        return get_geolocation(ip_address)
+
+# Geolocation runs on a background pool so /track and /pixel never wait on ip-api.com
+geo_enricher = GeoEnricher(timed_geolocation, record_geolocation, workers=GEO_WORKERS)
+atexit.register(geo_enricher.stop)
+
+metrics.gauge('tracker_event_writer_queue_depth', 'Events and geo updates waiting for the event writer',
+              event_writer.queue.qsize)
+metrics.gauge('tracker_geo_queue_depth', 'Events waiting for a geolocation lookup', geo_enricher.pending)
+
+def follow_event(event):
+    """An event another worker logged: count it here too"""
+    aggregates.add(event, pending_geo=True)
+    campaign = event.get('campaign')
+    # Campaign counters created later read their partition, this event included, when they are
+    if campaign in campaign_aggregates:
+        campaign_aggregates[campaign].add(event, pending_geo=True)
+    if 'country' in event:
+        publish_event(event)
+
+# With several workers, each one reads the events the others log from the shared store
+if WORKER_PROCESSES > 1:
+    follower = StoreFollower(event_store, aggregates.watermark, follow_event, apply_geolocation,
+                             interval=FOLLOW_INTERVAL, geo_wait=FOLLOW_GEO_WAIT).start()
+
+# ...and publishes its metrics for the others to include on /metrics
+shared_metrics = None
+if WORKER_PROCESSES > 1:
+    shared_metrics = SharedMetrics(metrics, METRICS_DIR, interval=METRICS_SYNC_INTERVAL).start()
+    atexit.register(shared_metrics.write)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def count_request(response):
+    """Per-route request count and latency (routes by their rule, so /api/bulk-send/<job_id> is one series)"""
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    started = g.get('request_started')
+    if started is not None:
+        REQUEST_SECONDS.observe(time.perf_counter() - started, route)
+    REQUESTS.inc(route, request.method, str(response.status_code))
+    return response
+
+def log_click(tracking_id, target_url, ip_address, user_agent, referrer, campaign=None):
+    """Log a click event; geolocation is filled in asynchronously"""
+    started = time.perf_counter()
     log_entry = {
         "event_type": "click",
-        "timestamp": timestamp,
+        "event_id": uuid.uuid4().hex,
+        "timestamp": datetime.utcnow().isoformat(),
         "tracking_id": tracking_id,
         "target_url": target_url,
         "ip_address": ip_address,
         "user_agent": user_agent,
-        "referrer": referrer,
-        "country": geo.get('country'),
-        "city": geo.get('city'),
-        "isp": geo.get('isp')
+        "referrer": referrer
     }
+    if campaign:
+        log_entry["campaign"] = campaign
     
-    with open(LOG_FILE, "a") as f:
-        f.write(json.dumps(log_entry) + "\n")
+    # Created (and caught up) before the event is written, so this is its only count
+    campaign_counters = aggregates_for(campaign) if campaign else None
+    if follower is not None:
+        follower.own(log_entry["event_id"])
+    event_writer.append(log_entry)
+    aggregates.add(log_entry, pending_geo=True)
+    if campaign_counters is not None:
+        campaign_counters.add(log_entry, pending_geo=True)
+    if not geo_enricher.submit(log_entry):
+        publish_event(log_entry)
     
-    print(f"[CLICK] {tracking_id} from {geo.get('city')}, {geo.get('country')}")
+    LOG_SECONDS.observe(time.perf_counter() - started, 'click')
+    log.info('CLICK', tracking_id=tracking_id, ip=ip_address, campaign=campaign)
     return log_entry
 
-def log_email_open(tracking_id, ip_address, user_agent):
-    """Log email open event with geolocation"""
-    timestamp = datetime.utcnow().isoformat()
-    geo = get_geolocation(ip_address)
-    
+def log_email_open(tracking_id, ip_address, user_agent, campaign=None):
+    """Log email open event; geolocation is filled in asynchronously"""
+    started = time.perf_counter()
     log_entry = {
         "event_type": "open",
-        "timestamp": timestamp,
+        "event_id": uuid.uuid4().hex,
+        "timestamp": datetime.utcnow().isoformat(),
         "tracking_id": tracking_id,
         "ip_address": ip_address,
-        "user_agent": user_agent,
-        "country": geo.get('country'),
-        "city": geo.get('city'),
-        "isp": geo.get('isp')
+        "user_agent": user_agent
     }
+    if campaign:
+        log_entry["campaign"] = campaign
     
-    with open(OPENS_LOG, "a") as f:
-        f.write(json.dumps(log_entry) + "\n")
+    # Created (and caught up) before the event is written, so this is its only count
+    campaign_counters = aggregates_for(campaign) if campaign else None
+    if follower is not None:
+        follower.own(log_entry["event_id"])
+    event_writer.append(log_entry)
+    aggregates.add(log_entry, pending_geo=True)
+    if campaign_counters is not None:
+        campaign_counters.add(log_entry, pending_geo=True)
+    if not geo_enricher.submit(log_entry):
+        publish_event(log_entry)
     
-    print(f"[OPEN] {tracking_id} from {geo.get('city')}, {geo.get('country')}")
+    LOG_SECONDS.observe(time.perf_counter() - started, 'open')
+    log.info('OPEN', tracking_id=tracking_id, ip=ip_address, campaign=campaign)
     return log_entry
 
 @app.route('/track')
 def track_click():
     """Main tracking endpoint"""
-    tracking_id = request.args.get('id', 'unknown')
-    target_url = request.args.get('url', '')
-    
-    if not target_url:
-        return "Error: No target URL", 400
+    tracking_id = request.args.get('id', '')
+    valid, campaign = check_tracking_id(tracking_id)
+    if not valid:
+        # Forged or garbage ID: nothing is logged or geolocated
+        return "Error: Invalid tracking link", 404
     
-    target_url = unquote(target_url)
+    # Token links carry no destination; they land on the awareness page
+    target_url = request.args.get('url', '')
+    target_url = unquote(target_url) if target_url else f"/failed-test?id={quote(tracking_id)}"
     
     log_click(
         tracking_id=tracking_id,
         target_url=target_url,
         ip_address=request.remote_addr,
         user_agent=request.headers.get('User-Agent', 'Unknown'),
-        referrer=request.headers.get('Referer', 'Direct')
+        referrer=request.headers.get('Referer', 'Direct'),
+        campaign=campaign
     )
     
     return redirect(target_url)
@@ -138,626 +428,247 @@ def track_click():
 @app.route('/pixel')
 def tracking_pixel():
     """Email open tracking pixel"""
-    tracking_id = request.args.get('id', 'unknown')
+    tracking_id = request.args.get('id', '')
+    valid, campaign = check_tracking_id(tracking_id)
     
-    log_email_open(
-        tracking_id=tracking_id,
-        ip_address=request.remote_addr,
-        user_agent=request.headers.get('User-Agent', 'Unknown')
-    )
+    # Invalid IDs still get the image, just aren't recorded
+    if valid:
+        log_email_open(
+            tracking_id=tracking_id,
+            ip_address=request.remote_addr,
+            user_agent=request.headers.get('User-Agent', 'Unknown'),
+            campaign=campaign
+        )
     
-    return send_file(
-        io.BytesIO(PIXEL_GIF),
-        mimetype='image/gif',
-        as_attachment=False
-    )
-
-import io
+    return pixel_response()
 
 @app.route('/dashboard')
 def dashboard():
-    """Visual analytics dashboard with names"""
-    clicks = []
-    opens = []
-    unique_clickers = set()
-    unique_openers = set()
-    
-    # Load name mapping
-    name_map = load_name_mapping()
-    
-    # Load clicks
-    if os.path.exists(LOG_FILE):
-        with open(LOG_FILE, "r") as f:
-            for line in f:
-                try:
-                    event = json.loads(line.strip())
-                    if event.get('event_type') == 'click':
-                        # Add name to event
-                        tid = event['tracking_id']
-                        event['name'] = name_map.get(tid) or name_map.get(tid.split('_')[0]) or tid
-                        clicks.append(event)
-                        unique_clickers.add(tid)
-                except:
-                    continue
+    """Visual analytics dashboard with names (?campaign= for a single campaign)"""
+    campaign = request.args.get('campaign') or None
+    campaign_ids = tuple(campaign_registry.ids())
+    if campaign and campaign not in campaign_ids:
+        return f"Unknown campaign: {escape(campaign)}", 404
+    counters = aggregates_for(campaign) if campaign else aggregates
     
-    # Load opens
-    if os.path.exists(OPENS_LOG):
-        with open(OPENS_LOG, "r") as f:
-            for line in f:
-                try:
-                    event = json.loads(line.strip())
-                    if event.get('event_type') == 'open':
-                        # Add name to event
-                        tid = event['tracking_id']
-                        event['name'] = name_map.get(tid) or name_map.get(tid.split('_')[0]) or tid
-                        opens.append(event)
-                        unique_openers.add(tid)
-                except:
-                    continue
-    
-    clicks.reverse()
-    opens.reverse()
-    
-    total_clicks = len(clicks)
-    total_opens = len(opens)
-    
-    # Prepare chart data
-    countries = {}
-    hourly_clicks = {}
-    hourly_opens = {}
-    
-    for event in clicks + opens:
-        country = event.get('country', 'Unknown')
-        countries[country] = countries.get(country, 0) + 1
-        
-        # Hourly breakdown
-        hour = event['timestamp'][11:13] if len(event['timestamp']) > 13 else '00'
-        if event['event_type'] == 'click':
-            hourly_clicks[hour] = hourly_clicks.get(hour, 0) + 1
-        else:
-            hourly_opens[hour] = hourly_opens.get(hour, 0) + 1
-    
-    # ISP breakdown
-    isps = {}
-    for event in clicks + opens:
-        isp = event.get('isp', 'Unknown')[:30]
-        isps[isp] = isps.get(isp, 0) + 1
+    # Counters are maintained as events arrive; fragments are re-rendered only after they change
+    recipient_directory.refresh()
+    quick_send_directory.refresh()
+    names_generation = (recipient_directory.generation, quick_send_directory.generation)
+    with AGGREGATION_SECONDS.time('campaign' if campaign else 'all'):
+        return dashboard_page.render(counters, campaign, campaign_ids, names_generation)
+
+@app.route('/api/stream')
+def api_stream():
+    """Server-Sent Events feed of new clicks and opens (?campaign= for one campaign)"""
+    subscriber = live_feed.subscribe(request.args.get('campaign') or None)
+    return Response(live_feed.stream(subscriber), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+API_PAGE_DEFAULT = 100
+API_PAGE_MAX = 1000
+
+def encode_cursor(key):
+    """Opaque cursor for a (timestamp, partition, seq) position"""
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    timestamp, partition, seq = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    return [str(timestamp), str(partition), int(seq)]
+
+@app.route('/api/clicks')
+def api_clicks():
+    """Cursor-paginated events as JSON.
+
+    Query args: limit, after (cursor from next_cursor), event_type,
+    since/until (ISO timestamps), tracking_id, campaign. Responses carry an
+    ETag so pollers get a 304 while nothing has been written.
+    """
+    campaign = request.args.get('campaign') or None
+    try:
+        limit = min(max(int(request.args.get('limit', API_PAGE_DEFAULT)), 1), API_PAGE_MAX)
+        after = decode_cursor(request.args['after']) if request.args.get('after') else None
+    except (ValueError, TypeError):
+        return jsonify({'error': 'Invalid limit or cursor'}), 400
     
-    # Prepare JSON data for charts
-    chart_data = {
-        "clicks": total_clicks,
-        "opens": total_opens,
-        "countries": countries,
-        "isps": dict(sorted(isps.items(), key=lambda x: x[1], reverse=True)[:10]),
-        "hourly_clicks": hourly_clicks,
-        "hourly_opens": hourly_opens
-    }
+    etag = hashlib.sha1(f"{event_store.change_token(campaign)}|{sorted(request.args.items(multi=True))}".encode('utf-8')).hexdigest()
+    if etag in request.if_none_match:
+        return '', 304, {'ETag': f'"{etag}"'}
     
-    html = '''
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>Cyber Tracker Analytics Dashboard</title>
-        <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
-        <style>
-            body { font-family: 'Segoe UI', Arial, sans-serif; margin: 0; padding: 20px; background: #0b0f1a; color: #e2e8f0; }
-            h1 { color: #3b82f6; margin-bottom: 10px; }
-            .subtitle { color: #64748b; margin-bottom: 30px; }
-            
-            /* Navigation Tabs */
-            .tabs { display: flex; gap: 10px; margin-bottom: 30px; border-bottom: 2px solid #334155; }
-            .tab { padding: 12px 24px; cursor: pointer; background: #1a1f2e; border-radius: 8px 8px 0 0; border: none; color: #94a3b8; font-size: 14px; font-weight: 600; }
-            .tab.active { background: #3b82f6; color: white; }
-            .tab:hover:not(.active) { background: #1e293b; color: #e2e8f0; }
-            
-            /* Tab Content */
-            .tab-content { display: none; }
-            .tab-content.active { display: block; }
-            
-            /* Stats Boxes */
-            .stats { display: grid; grid-template-columns: repeat(auto-fit, minmax(200px, 1fr)); gap: 20px; margin: 20px 0; }
-            .stat-box { background: linear-gradient(135deg, #1a1f2e, #0f172a); padding: 25px; border-radius: 12px; border: 1px solid #334155; text-align: center; }
-            .stat-box.danger { border-color: #dc2626; background: linear-gradient(135deg, #1a1f2e, #450a0a); }
-            .stat-box.warning { border-color: #f59e0b; background: linear-gradient(135deg, #1a1f2e, #451a03); }
-            .stat-box.info { border-color: #3b82f6; background: linear-gradient(135deg, #1a1f2e, #172554); }
-            .stat-number { font-size: 42px; font-weight: bold; color: #3b82f6; margin: 10px 0; }
-            .stat-box.danger .stat-number { color: #dc2626; }
-            .stat-box.warning .stat-number { color: #f59e0b; }
-            .stat-box.info .stat-number { color: #10b981; }
-            .stat-label { color: #94a3b8; font-size: 14px; text-transform: uppercase; letter-spacing: 1px; }
-            
-            /* High Risk Section */
-            .high-risk-section { background: linear-gradient(135deg, #450a0a, #1a1f2e); border: 2px solid #dc2626; border-radius: 12px; padding: 30px; margin: 30px 0; }
-            .high-risk-header { display: flex; align-items: center; gap: 15px; margin-bottom: 20px; }
-            .high-risk-header h2 { color: #dc2626; margin: 0; font-size: 24px; }
-            .high-risk-badge { background: #dc2626; color: white; padding: 6px 14px; border-radius: 20px; font-size: 12px; font-weight: bold; }
-            
-            /* Event Tables */
-            .event-table { width: 100%; border-collapse: collapse; margin-top: 20px; font-size: 14px; }
-            .event-table th { background: #1e293b; color: #3b82f6; padding: 14px; text-align: left; font-weight: 600; }
-            .event-table td { padding: 12px 14px; border-bottom: 1px solid #334155; }
-            .event-table tr:hover { background: #1e293b; }
-            .event-table tr.high-risk { background: rgba(220, 38, 38, 0.1); }
-            .event-table tr.high-risk:hover { background: rgba(220, 38, 38, 0.2); }
-            
-            /* Badges */
-            .badge { padding: 6px 12px; border-radius: 12px; font-size: 12px; font-weight: bold; }
-            .badge-click { background: #dc2626; color: white; }
-            .badge-open { background: #10b981; color: white; }
-            .badge-risk { background: #f59e0b; color: #451a03; }
-            
-            /* Charts */
-            .charts { display: grid; grid-template-columns: repeat(auto-fit, minmax(400px, 1fr)); gap: 20px; margin: 30px 0; }
-            .chart-box { background: #1a1f2e; padding: 20px; border-radius: 12px; border: 1px solid #334155; }
-            .chart-title { color: #3b82f6; font-size: 16px; margin-bottom: 15px; font-weight: 600; }
-            
-            /* Actions */
-            .actions { margin: 20px 0; }
-            .btn { background: #3b82f6; color: white; padding: 12px 24px; border: none; border-radius: 8px; cursor: pointer; text-decoration: none; display: inline-block; margin-right: 10px; font-size: 14px; }
-            .btn:hover { background: #2563eb; }
-            .btn-danger { background: #dc2626; }
-            .btn-danger:hover { background: #b91c1c; }
-            
-            /* Info Boxes */
-            .info-box { background: rgba(59, 130, 246, 0.1); border: 1px solid #3b82f6; padding: 20px; border-radius: 8px; margin-bottom: 20px; }
-            .warning-box { background: rgba(245, 158, 11, 0.1); border: 1px solid #f59e0b; padding: 20px; border-radius: 8px; margin-bottom: 20px; }
-            
-            /* Geo text */
-            .geo { color: #94a3b8; font-size: 12px; }
-            
-            /* User Name */
-            .user-name { font-weight: 600; color: #e2e8f0; }
-            .user-name.high-risk { color: #fca5a5; }
-            
-            /* Section Headers */
-            .section-header { display: flex; align-items: center; gap: 10px; margin: 30px 0 20px; padding-bottom: 10px; border-bottom: 2px solid #334155; }
-            .section-header h2 { margin: 0; color: #e2e8f0; }
-            .section-header.opens { border-color: #10b981; }
-            .section-header.clicks { border-color: #dc2626; }
-        </style>
-    </head>
-    <body>
-        <h1>🔒 Cyber Awareness Analytics Dashboard</h1>
-        <p class="subtitle">Real-time phishing simulation tracking - Monitor email opens and identify high-risk users who click</p>
-        
-        <div class="actions">
-            <button class="btn" onclick="location.reload()">🔄 Refresh</button>
-            <a href="/api/export/csv" class="btn">📥 Export CSV</a>
-            <a href="/api/clicks" class="btn" target="_blank">📡 API</a>
-        </div>
-        
-        <!-- Summary Stats -->
-        <div class="stats">
-            <div class="stat-box danger">
-                <div class="stat-label">⚠️ Link Clicks (Failed)</div>
-                <div class="stat-number">''' + str(total_clicks) + '''</div>
-            </div>
-            <div class="stat-box info">
-                <div class="stat-label">📧 Email Opens</div>
-                <div class="stat-number">''' + str(total_opens) + '''</div>
-            </div>
-            <div class="stat-box danger">
-                <div class="stat-label">🚨 High Risk Users</div>
-                <div class="stat-number">''' + str(len(unique_clickers)) + '''</div>
-            </div>
-            <div class="stat-box warning">
-                <div class="stat-label">👥 Unique Openers</div>
-                <div class="stat-number">''' + str(len(unique_openers)) + '''</div>
-            </div>
-        </div>
-        
-        <!-- Navigation Tabs -->
-        <div class="tabs">
-            <div class="tab active" onclick="showTab('overview')">📊 Overview</div>
-            <div class="tab" onclick="showTab('highrisk')">🚨 High Risk Users</div>
-            <div class="tab" onclick="showTab('opens')">📧 Email Opens</div>
-            <div class="tab" onclick="showTab('clicks')">⚠️ Click Events</div>
-        </div>
-        
-        <!-- Overview Tab -->
-        <div id="overview" class="tab-content active">
-            <div class="charts">
-                <div class="chart-box">
-                    <div class="chart-title">📊 Clicks vs Opens</div>
-                    <canvas id="pieChart"></canvas>
-                </div>
-                
-                <div class="chart-box">
-                    <div class="chart-title">🌍 Events by Country</div>
-                    <canvas id="countryChart"></canvas>
-                </div>
-                
-                <div class="chart-box">
-                    <div class="chart-title">📈 Activity Timeline (24h)</div>
-                    <canvas id="timelineChart"></canvas>
-                </div>
-                
-                <div class="chart-box">
-                    <div class="chart-title">🏢 Top ISPs/Organizations</div>
-                    <canvas id="ispChart"></canvas>
-                </div>
-            </div>
-            
-            <div class="info-box">
-                <h3>📋 Dashboard Guide</h3>
-                <p><strong>Email Opens:</strong> Users who opened the email (tracked via pixel). This is normal behavior and not a failure.</p>
-                <p><strong>Link Clicks:</strong> Users who clicked the phishing link. These are <strong>High Risk Users</strong> who need cybersecurity training.</p>
-                <p><strong>High Risk Users:</strong> Anyone who clicked should be enrolled in additional security awareness training.</p>
-            </div>
-        </div>
-        
-        <!-- High Risk Users Tab -->
-        <div id="highrisk" class="tab-content">
-            <div class="high-risk-section">
-                <div class="high-risk-header">
-                    <h2>🚨 HIGH RISK USERS</h2>
-                    <span class="high-risk-badge">''' + str(len(unique_clickers)) + ''' USERS NEED TRAINING</span>
-                </div>
-                <p style="color: #fca5a5; margin-bottom: 20px;">These users clicked on the phishing link. They should be enrolled in cybersecurity awareness training.</p>
-                
-                <table class="event-table">
-                    <tr>
-                        <th>Time</th>
-                        <th>Name</th>
-                        <th>Risk Level</th>
-                        <th>Location</th>
-                        <th>ISP/Device</th>
-                    </tr>
-                    ''' + ''.join([
-                        f"<tr class='high-risk'><td>{e['timestamp'][11:19]}</td><td class='user-name high-risk'>{e.get('name', 'Unknown')}</td><td><span class='badge badge-click'>HIGH RISK - CLICKED</span></td><td class='geo'>{e.get('city', 'Unknown')}, {e.get('country', 'Unknown')}</td><td class='geo'>{e.get('isp', 'Unknown')[:25]}</td></tr>"
-                        for e in clicks[:50]
-                    ]) + '''
-                </table>
-            </div>
-            
-            <div class="warning-box">
-                <h3>⚠️ Recommended Actions</h3>
-                <ul style="margin: 10px 0; padding-left: 20px; color: #fbbf24;">
-                    <li>Schedule mandatory cybersecurity training for all High Risk Users</li>
-                    <li>Send follow-up educational email about phishing red flags</li>
-                    <li>Consider additional MFA requirements for these users</li>
-                    <li>Retest in 30 days to measure improvement</li>
-                </ul>
-            </div>
-        </div>
-        
-        <!-- Email Opens Tab -->
-        <div id="opens" class="tab-content">
-            <div class="section-header opens">
-                <h2>📧 Email Opens Tracking</h2>
-                <span style="color: #10b981; font-size: 14px;">Users who opened the email (not a failure - just tracking)</span>
-            </div>
-            
-            <div class="info-box">
-                <p><strong>Note:</strong> Opening an email is normal behavior. These users are NOT high risk - they just opened the email. Only users who click the link are flagged as high risk.</p>
-            </div>
-            
-            <table class="event-table">
-                <tr>
-                    <th>Time</th>
-                    <th>Name</th>
-                    <th>Status</th>
-                    <th>Location</th>
-                    <th>ISP/Device</th>
-                </tr>
-                ''' + ''.join([
-                    f"<tr><td>{e['timestamp'][11:19]}</td><td class='user-name'>{e.get('name', 'Unknown')}</td><td><span class='badge badge-open'>OPENED EMAIL</span></td><td class='geo'>{e.get('city', 'Unknown')}, {e.get('country', 'Unknown')}</td><td class='geo'>{e.get('isp', 'Unknown')[:25]}</td></tr>"
-                    for e in opens[:50]
-                ]) + '''
-            </table>
-        </div>
-        
-        <!-- Click Events Tab -->
-        <div id="clicks" class="tab-content">
-            <div class="section-header clicks">
-                <h2>⚠️ Link Click Events (Failed Test)</h2>
-                <span style="color: #dc2626; font-size: 14px;">Users who clicked the phishing link - SECURITY FAILURE</span>
-            </div>
-            
-            <div class="warning-box">
-                <p style="color: #fbbf24; margin: 0;"><strong>🚨 WARNING:</strong> These users clicked on a phishing link. This represents a security failure and they should be enrolled in training.</p>
-            </div>
-            
-            <table class="event-table">
-                <tr>
-                    <th>Time</th>
-                    <th>Name</th>
-                    <th>Status</th>
-                    <th>Location</th>
-                    <th>ISP/Device</th>
-                </tr>
-                ''' + ''.join([
-                    f"<tr class='high-risk'><td>{e['timestamp'][11:19]}</td><td class='user-name high-risk'>{e.get('name', 'Unknown')}</td><td><span class='badge badge-click'>CLICKED LINK - FAILED</span></td><td class='geo'>{e.get('city', 'Unknown')}, {e.get('country', 'Unknown')}</td><td class='geo'>{e.get('isp', 'Unknown')[:25]}</td></tr>"
-                    for e in clicks[:50]
-                ]) + '''
-            </table>
-        </div>
-        
-        <script>
-            const chartData = ''' + json.dumps(chart_data) + ''';
-            
-            // Tab switching
-            function showTab(tabName) {
-                // Hide all tabs
-                document.querySelectorAll('.tab-content').forEach(tab => tab.classList.remove('active'));
-                document.querySelectorAll('.tab').forEach(tab => tab.classList.remove('active'));
-                
-                // Show selected tab
-                document.getElementById(tabName).classList.add('active');
-                event.target.classList.add('active');
-            }
-            
-            // Pie Chart - Clicks vs Opens
-            new Chart(document.getElementById('pieChart'), {
-                type: 'doughnut',
-                data: {
-                    labels: ['Clicks (Failed)', 'Opens (Tracked)'],
-                    datasets: [{
-                        data: [chartData.clicks, chartData.opens],
-                        backgroundColor: ['#dc2626', '#10b981'],
-                        borderWidth: 0
-                    }]
-                },
-                options: {
-                    responsive: true,
-                    plugins: {
-                        legend: { position: 'bottom', labels: { color: '#e2e8f0' } }
-                    }
-                }
-            });
-            
-            // Bar Chart - Countries
-            const countryLabels = Object.keys(chartData.countries);
-            const countryData = Object.values(chartData.countries);
-            new Chart(document.getElementById('countryChart'), {
-                type: 'bar',
-                data: {
-                    labels: countryLabels,
-                    datasets: [{
-                        label: 'Events',
-                        data: countryData,
-                        backgroundColor: '#3b82f6'
-                    }]
-                },
-                options: {
-                    responsive: true,
-                    plugins: { legend: { display: false } },
-                    scales: {
-                        x: { ticks: { color: '#94a3b8' }, grid: { color: '#334155' } },
-                        y: { ticks: { color: '#94a3b8' }, grid: { color: '#334155' } }
-                    }
-                }
-            });
-            
-            // Line Chart - Timeline
-            const hours = Array.from({length: 24}, (_, i) => String(i).padStart(2, '0'));
-            const clickData = hours.map(h => chartData.hourly_clicks[h] || 0);
-            const openData = hours.map(h => chartData.hourly_opens[h] || 0);
-            
-            new Chart(document.getElementById('timelineChart'), {
-                type: 'line',
-                data: {
-                    labels: hours.map(h => h + ':00'),
-                    datasets: [
-                        {
-                            label: 'Clicks (Failed)',
-                            data: clickData,
-                            borderColor: '#dc2626',
-                            backgroundColor: 'rgba(220, 38, 38, 0.1)',
-                            fill: true,
-                            tension: 0.4
-                        },
-                        {
-                            label: 'Opens (Tracked)',
-                            data: openData,
-                            borderColor: '#10b981',
-                            backgroundColor: 'rgba(16, 185, 129, 0.1)',
-                            fill: true,
-                            tension: 0.4
-                        }
-                    ]
-                },
-                options: {
-                    responsive: true,
-                    plugins: { legend: { labels: { color: '#e2e8f0' } } },
-                    scales: {
-                        x: { ticks: { color: '#94a3b8' }, grid: { color: '#334155' } },
-                        y: { ticks: { color: '#94a3b8' }, grid: { color: '#334155' } }
-                    }
-                }
-            });
-            
-            // Horizontal Bar - ISPs
-            const ispLabels = Object.keys(chartData.isps);
-            const ispData = Object.values(chartData.isps);
-            new Chart(document.getElementById('ispChart'), {
-                type: 'bar',
-                data: {
-                    labels: ispLabels,
-                    datasets: [{
-                        label: 'Events',
-                        data: ispData,
-                        backgroundColor: '#8b5cf6'
-                    }]
-                },
-                options: {
-                    indexAxis: 'y',
-                    responsive: true,
-                    plugins: { legend: { display: false } },
-                    scales: {
-                        x: { ticks: { color: '#94a3b8' }, grid: { color: '#334155' } },
-                        y: { ticks: { color: '#94a3b8' }, grid: { color: '#334155' } }
-                    }
-                }
-            });
-        </script>
-    </body>
-    </html>
-    '''
+    rows = event_store.page(
+        event_type=request.args.get('event_type'),
+        since=request.args.get('since'),
+        until=request.args.get('until'),
+        tracking_id=request.args.get('tracking_id'),
+        after=after,
+        limit=limit + 1,
+        campaign=campaign
+    )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
     
-    return render_template_string(html)
+    response = jsonify({
+        'events': [event for _, event in rows],
+        'count': len(rows),
+        'has_more': has_more,
+        'next_cursor': encode_cursor(rows[-1][0]) if has_more else None
+    })
+    response.headers['ETag'] = f'"{etag}"'
+    return response
 
-@app.route('/api/clicks')
-def api_clicks():
-    """API endpoint to get all events as JSON"""
-    events = []
-    for log_file in [LOG_FILE, OPENS_LOG]:
-        if os.path.exists(log_file):
-            with open(log_file, "r") as f:
-                for line in f:
-                    try:
-                        events.append(json.loads(line.strip()))
-                    except:
-                        continue
-    return jsonify(events)
+@app.route('/api/geo-cache')
+def api_geo_cache():
+    """Geolocation cache hit/miss counters"""
+    return jsonify(geo_cache.stats())
+
+@app.route('/api/writer-stats')
+def api_writer_stats():
+    """Event writer queue depth and commit latency (plus, with several workers, this one's pid and follower)"""
+    stats = event_writer.stats()
+    if follower is not None:
+        stats.update(follower.stats(), worker_pid=os.getpid())
+    return jsonify(stats)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Request counters and hot-path timings in the Prometheus text format (all workers combined)"""
+    snapshots = shared_metrics.collect() if shared_metrics is not None else None
+    return Response(metrics.render(snapshots), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+CSV_EXPORT_FIELDS = ['event_type', 'timestamp', 'tracking_id', 'ip_address', 'country', 'city', 'isp', 'user_agent', 'target_url',
+                     'campaign']
+
+@app.route('/api/campaigns', methods=['GET'])
+def list_campaigns():
+    """Campaigns with their recipient counts"""
+    return jsonify({'campaigns': campaign_registry.list()})
+
+@app.route('/api/campaigns', methods=['POST'])
+def create_campaign():
+    """Create a campaign from {id, template, recipients: [{name, email, employee_id, ...}]}"""
+    data = request.get_json() or {}
+    template = data.get('template')
+    if template and not template_library.exists(template):
+        return jsonify({'success': False, 'error': f'Unknown email template: {template}',
+                        'templates': template_library.names()}), 400
+    try:
+        record = campaign_registry.create(data.get('id', ''), data.get('recipients') or [], template)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True, 'campaign': record}), 201
 
 @app.route('/api/export/csv')
 def export_csv():
-    """Export all events as CSV"""
-    events = []
-    for log_file in [LOG_FILE, OPENS_LOG]:
-        if os.path.exists(log_file):
-            with open(log_file, "r") as f:
-                for line in f:
-                    try:
-                        events.append(json.loads(line.strip()))
-                    except:
-                        continue
+    """Stream events as CSV.
+
+    Filters: type=click|open, since/until (ISO timestamps), campaign (reads
+    only that campaign's partition), prefix (tracking_id prefix). gzip=1
+    compresses the stream when the client accepts it.
+    """
+    event_type = request.args.get('type')
+    since = request.args.get('since')
+    until = request.args.get('until')
+    prefix = request.args.get('prefix')
+    campaign = request.args.get('campaign') or None
+    use_gzip = request.args.get('gzip') == '1' and 'gzip' in request.headers.get('Accept-Encoding', '')
+    
+    def generate_rows():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(CSV_EXPORT_FIELDS)
+        for event in event_store.query(event_type, since=since, until=until, tracking_prefix=prefix, campaign=campaign):
+            writer.writerow([event.get(field, '') for field in CSV_EXPORT_FIELDS])
+            if buffer.tell() >= 64 * 1024:
+                yield buffer.getvalue().encode('utf-8')
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue().encode('utf-8')
     
-    output = ["event_type,timestamp,tracking_id,ip_address,country,city,isp,user_agent,target_url"]
-    for event in events:
-        row = f"{event.get('event_type')},{event.get('timestamp')},{event.get('tracking_id')},{event.get('ip_address')},{event.get('country')},{event.get('city')},{event.get('isp')},\"{event.get('user_agent', '')}\",{event.get('target_url', '')}"
-        output.append(row)
+    def generate_gzip():
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 -> gzip container
+        for chunk in generate_rows():
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
     
-    return '\n'.join(output), 200, {'Content-Type': 'text/csv'}
+    filename = f"tracker-events-{campaign}.csv" if campaign else "tracker-events.csv"
+    headers = {'Content-Disposition': f'attachment; filename={filename}'}
+    if use_gzip:
+        headers['Content-Encoding'] = 'gzip'
+        headers['Vary'] = 'Accept-Encoding'
+    body = generate_gzip() if use_gzip else generate_rows()
+    return Response(stream_with_context(body), mimetype='text/csv', headers=headers)
+
+def report_key(campaign, since, until):
+    """Name of the cached report for these filters: changes with any stored event, geolocation or CSV"""
+    basis = json.dumps([REPORT_LAYOUT, event_store.change_token(campaign), recipient_directory.signature(),
+                        quick_send_directory.signature(), campaign, since, until])
+    return hashlib.sha1(basis.encode('utf-8')).hexdigest()
+
+def report_summary(campaign, since, until):
+    """First pass over the events: the totals, and how often each high-risk user clicked"""
+    clicks_per_user = {}
+    clicks = 0
+    for event in event_store.query('click', since=since, until=until, campaign=campaign):
+        tracking_id = event.get('tracking_id', '')
+        clicks_per_user[tracking_id] = clicks_per_user.get(tracking_id, 0) + 1
+        clicks += 1
+    openers = set()
+    opens = 0
+    for event in event_store.query('open', since=since, until=until, campaign=campaign):
+        openers.add(event.get('tracking_id', ''))
+        opens += 1
+    summary = {'opens': opens, 'unique_openers': len(openers), 'clicks': clicks, 'high_risk_users': len(clicks_per_user)}
+    return summary, clicks_per_user
+
+def high_risk_users(campaign, since, until, clicks_per_user):
+    """Second pass: one row per user at their first click, oldest first (consumes clicks_per_user)"""
+    for event in event_store.query('click', since=since, until=until, campaign=campaign):
+        tracking_id = event.get('tracking_id', '')
+        clicks = clicks_per_user.pop(tracking_id, None)
+        if clicks is None:
+            continue
+        yield {
+            'first_click': event.get('timestamp', '')[:19].replace('T', ' '),
+            'name': resolve_name(tracking_id),
+            'tracking_id': tracking_id,
+            'clicks': clicks,
+            'location': f"{event.get('city') or 'Unknown'}, {event.get('country') or 'Unknown'}",
+            'isp': event.get('isp') or 'Unknown'
+        }
 
 @app.route('/api/export/pdf')
 def export_pdf():
-    """Generate PDF report"""
-    clicks = []
-    opens = []
-    
-    if os.path.exists(LOG_FILE):
-        with open(LOG_FILE, "r") as f:
-            for line in f:
-                try:
-                    event = json.loads(line.strip())
-                    if event.get('event_type') == 'click':
-                        clicks.append(event)
-                except:
-                    continue
+    """PDF report of every high-risk user (?campaign=, since/until).
+
+    Built in two passes over the events and streamed a page at a time, so
+    memory depends on the number of users, not events. The finished file is
+    kept under REPORT_CACHE_DIR until the events behind it change; repeat
+    downloads are served from there.
+    """
+    since = request.args.get('since')
+    until = request.args.get('until')
+    campaign = request.args.get('campaign') or None
+    filename = f"phishing-report-{campaign}.pdf" if campaign else "phishing-report.pdf"
+    key = report_key(campaign, since, until)
     
-    if os.path.exists(OPENS_LOG):
-        with open(OPENS_LOG, "r") as f:
-            for line in f:
-                try:
-                    event = json.loads(line.strip())
-                    if event.get('event_type') == 'open':
-                        opens.append(event)
-                except:
-                    continue
+    cached = report_cache.get(key)
+    if cached:
+        # Absolute: send_file() would resolve a relative path against the app's directory, not ours
+        response = send_file(os.path.abspath(cached), mimetype='application/pdf', as_attachment=True,
+                             download_name=filename)
+        response.headers['X-Report-Cache'] = 'hit'
+        return response
     
-    # Generate simple HTML report that can be printed to PDF
-    report_html = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>Phishing Simulation Report</title>
-        <style>
-            @media print {{
-                body {{ padding: 20px; }}
-                .no-print {{ display: none; }}
-            }}
-            body {{ font-family: Arial, sans-serif; max-width: 900px; margin: 0 auto; padding: 40px; background: white; }}
-            h1 {{ color: #1a365d; border-bottom: 3px solid #3b82f6; padding-bottom: 15px; }}
-            .summary {{ background: #f3f4f6; padding: 25px; border-radius: 10px; margin: 25px 0; }}
-            .stat-grid {{ display: grid; grid-template-columns: repeat(3, 1fr); gap: 20px; margin: 20px 0; }}
-            .stat-box {{ background: white; padding: 20px; border-radius: 8px; text-align: center; box-shadow: 0 2px 4px rgba(0,0,0,0.1); }}
-            .stat-number {{ font-size: 36px; font-weight: bold; color: #dc2626; }}
-            .stat-label {{ color: #6b7280; font-size: 14px; margin-top: 5px; }}
-            table {{ width: 100%; border-collapse: collapse; margin: 25px 0; }}
-            th {{ background: #1e3a5f; color: white; padding: 12px; text-align: left; }}
-            td {{ padding: 10px 12px; border-bottom: 1px solid #e5e7eb; }}
-            tr:nth-child(even) {{ background: #f9fafb; }}
-            .high-risk {{ color: #dc2626; font-weight: bold; }}
-            .section {{ margin: 35px 0; }}
-            .recommendations {{ background: #fef3c7; padding: 20px; border-radius: 8px; border-left: 4px solid #f59e0b; }}
-            .btn {{ background: #3b82f6; color: white; padding: 12px 24px; border: none; border-radius: 6px; cursor: pointer; font-size: 16px; }}
-            .btn:hover {{ background: #2563eb; }}
-            .date {{ color: #6b7280; font-size: 14px; }}
-        </style>
-    </head>
-    <body>
-        <div class="no-print" style="margin-bottom: 20px;">
-            <button class="btn" onclick="window.print()">🖨️ Print / Save as PDF</button>
-            <a href="/dashboard" class="btn" style="text-decoration: none; margin-left: 10px;">← Back to Dashboard</a>
-        </div>
-        
-        <h1>🔒 Phishing Simulation Report</h1>
-        <p class="date">Generated: {datetime.now().strftime('%Y-%m-%d %H:%M UTC')}</p>
-        
-        <div class="summary">
-            <h2>Executive Summary</h2>
-            <div class="stat-grid">
-                <div class="stat-box">
-                    <div class="stat-number">{len(opens)}</div>
-                    <div class="stat-label">Emails Opened</div>
-                </div>
-                <div class="stat-box">
-                    <div class="stat-number" style="color: #dc2626;">{len(clicks)}</div>
-                    <div class="stat-label">Link Clicks (Failed)</div>
-                </div>
-                <div class="stat-box">
-                    <div class="stat-number" style="color: #059669;">{len(set(e['tracking_id'] for e in clicks))}</div>
-                    <div class="stat-label">High Risk Users</div>
-                </div>
-            </div>
-        </div>
-        
-        <div class="section">
-            <h2>🚨 High Risk Users (Clicked Link)</h2>
-            {'' if clicks else '<p>No users clicked the phishing link. Great job! 👏</p>'}
-            {'' if not clicks else '''
-            <table>
-                <tr>
-                    <th>Time</th>
-                    <th>Tracking ID</th>
-                    <th>IP Address</th>
-                    <th>Location</th>
-                    <th>ISP</th>
-                </tr>
-                ''' + ''.join([f"<tr class='high-risk'><td>{e['timestamp'][:19]}</td><td>{e['tracking_id']}</td><td>{e.get('ip_address', 'Unknown')}</td><td>{e.get('city', 'Unknown')}, {e.get('country', 'Unknown')}</td><td>{e.get('isp', 'Unknown')[:30]}</td></tr>" for e in clicks[:50]]) + '''
-            </table>
-            '''}
-        </div>
-        
-        <div class="section">
-            <h2>📧 Email Opens (Tracking Only)</h2>
-            {'' if opens else '<p>No emails have been opened yet.</p>'}
-            {'' if not opens else f'''
-            <p>Total opens: {len(opens)} | Unique openers: {len(set(e['tracking_id'] for e in opens))}</p>
-            '''}
-        </div>
-        
-        <div class="recommendations">
-            <h2>🎯 Recommendations</h2>
-            <ul>
-                <li><strong>High Risk Users:</strong> {len(set(e['tracking_id'] for e in clicks))} users clicked the phishing link and should receive mandatory security awareness training.</li>
-                <li><strong>Training Topics:</strong> Focus on recognizing suspicious senders, urgency tactics, and hover-before-clicking.</li>
-                <li><strong>Retest:>/strong> Schedule a follow-up phishing test in 30 days to measure improvement.</li>
-                <li><strong>Policy:</strong> Consider implementing additional MFA requirements for high-risk users.</li>
-            </ul>
-        </div>
-        
-        <div style="margin-top: 40px; padding-top: 20px; border-top: 1px solid #e5e7eb; color: #6b7280; font-size: 12px;">
-            <p>This report was generated by the Cyber Awareness Tracker system.</p>
-            <p>For questions, contact your IT Security team.</p>
-        </div>
-    </body>
-    </html>
-    """
+    def generate_report():
+        summary, clicks_per_user = report_summary(campaign, since, until)
+        yield from render_report(summary, high_risk_users(campaign, since, until, clicks_per_user),
+                                 campaign=campaign, since=since, until=until)
     
-    return render_template_string(report_html)
+    headers = {'Content-Disposition': f'attachment; filename={filename}', 'X-Report-Cache': 'miss'}
+    return Response(report_cache.store(key, generate_report()), mimetype='application/pdf', headers=headers)
 
 @app.route('/bulk-upload')
 def bulk_upload_page():
@@ -926,182 +837,12 @@ Bob Wilson,bob@company.com"></textarea>
 # ==================== EMAIL SENDER WEB INTERFACE ====================
 
 def load_recipients():
-    """Load recipients from campaign CSV"""
-    recipients = []
-    try:
-        if os.path.exists(CAMPAIGN_CSV):
-            with open(CAMPAIGN_CSV, 'r') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    recipients.append({
-                        'name': row.get('name', 'Test User'),
-                        'email': row.get('email', ''),
-                        'tracking_id': row.get('tracking_id', ''),
-                        'employee_id': row.get('employee_id', '')
-                    })
-    except:
-        pass
-    return recipients
+    """Recipients with tracking IDs from every campaign CSV"""
+    return recipient_directory.recipients(with_tracking_only=True)
 
-def create_phishing_email(name, email, tracking_id, employee_id):
-    """Create HTML phishing email"""
-    
-    # Use patrickcorr.me for testing
-    BASE_URL = "https://www.patrickcorr.me"
-    from urllib.parse import quote
-    
-    failed_page_url = f"{BASE_URL}/failed-test?id={tracking_id}&name={quote(name)}"
-    tracking_url = f"{BASE_URL}/track?id={tracking_id}&url={quote(failed_page_url, safe='')}&dest=failed"
-    pixel_url = f"{BASE_URL}/pixel?id={employee_id}"
-    
-    current_time = datetime.now().strftime('%Y-%m-%d %H:%M UTC')
-    
-    html = f"""<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Microsoft 365 Security Alert</title>
-</head>
-<body style="margin: 0; padding: 0; background-color: #f3f2f1; font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;">
-    <table role="presentation" width="100%" cellspacing="0" cellpadding="0" border="0">
-        <tr>
-            <td align="center" style="padding: 40px 20px;">
-                <table role="presentation" width="600" cellspacing="0" cellpadding="0" border="0" style="max-width: 600px; width: 100%; background: #ffffff; border-radius: 8px; box-shadow: 0 2px 8px rgba(0,0,0,0.08);">
-                    
-                    <!-- Header with Microsoft Logo -->
-                    <tr>
-                        <td style="padding: 30px 40px 20px; text-align: center; border-bottom: 1px solid #e1dfdd;">
-                            <table role="presentation" cellspacing="0" cellpadding="0" border="0" style="margin: 0 auto;">
-                                <tr>
-                                    <td style="width: 24px; height: 24px; background: #f25022; display: inline-block; margin-right: 2px;"></td>
-                                    <td style="width: 24px; height: 24px; background: #7fba00; display: inline-block;"></td>
-                                </tr>
-                                <tr>
-                                    <td style="width: 24px; height: 24px; background: #00a4ef; display: inline-block; margin-right: 2px;"></td>
-                                    <td style="width: 24px; height: 24px; background: #ffb900; display: inline-block;"></td>
-                                </tr>
-                            </table>
-                            <p style="margin: 15px 0 0; font-size: 18px; color: #323130; font-weight: 600;">Microsoft 365</p>
-                        </td>
-                    </tr>
-                    
-                    <!-- Alert Banner -->
-                    <tr>
-                        <td style="background: #fff4ce; padding: 20px 40px; border-left: 4px solid #ffc107;">
-                            <table role="presentation" cellspacing="0" cellpadding="0" border="0" width="100%">
-                                <tr>
-                                    <td width="40" valign="top" style="padding-right: 15px;">
-                                        <span style="font-size: 28px;">⚠️</span>
-                                    </td>
-                                    <td>
-                                        <h1 style="margin: 0 0 8px; font-size: 20px; color: #8b6914; font-weight: 600;">Security Notice</h1>
-                                        <p style="margin: 0; font-size: 14px; color: #b78103; line-height: 1.5;">Sign‑in activity requires verification</p>
-                                    </td>
-                                </tr>
-                            </table>
-                        </td>
-                    </tr>
-                    
-                    <!-- Main Content -->
-                    <tr>
-                        <td style="padding: 35px 40px;">
-                            <p style="margin: 0 0 20px; font-size: 16px; color: #323130; line-height: 1.6;">Dear {name},</p>
-                            
-                            <p style="margin: 0 0 18px; font-size: 16px; color: #323130; line-height: 1.6;">
-                                We have detected <strong>unusual sign‑in activity</strong> on your Microsoft 365 account. In line with our security policy, we require verification before access can continue.
-                            </p>
-                            <p style="margin: 0 0 25px; font-size: 16px; color: #323130; line-height: 1.6;">
-                                Please review the activity below and confirm whether it was you.
-                            </p>
-                            
-                            <!-- Activity Details Box -->
-                            <table role="presentation" width="100%" cellspacing="0" cellpadding="0" border="0" style="background: #f3f2f1; border-radius: 6px; margin: 25px 0;">
-                                <tr>
-                                    <td style="padding: 20px 25px;">
-                                        <p style="margin: 0 0 12px; font-size: 14px; color: #605e5c;">
-                                            <span style="display: inline-block; width: 70px; color: #323130; font-weight: 600;">📍 Location:</span> 
-                                            United Kingdom (IP: 185.XXX.XXX.XXX)
-                                        </p>
-                                        <p style="margin: 0 0 12px; font-size: 14px; color: #605e5c;">
-                                            <span style="display: inline-block; width: 70px; color: #323130; font-weight: 600;">🕐 Time:</span> 
-                                            {current_time}
-                                        </p>
-                                        <p style="margin: 0; font-size: 14px; color: #605e5c;">
-                                            <span style="display: inline-block; width: 70px; color: #323130; font-weight: 600;">💻 Device:</span> 
-                                            Windows 10 - Chrome Browser
-                                        </p>
-                                    </td>
-                                </tr>
-                            </table>
-                            
-                            <p style="margin: 25px 0; font-size: 16px; color: #323130; line-height: 1.6;">
-                                If we do not receive verification within <strong>24 hours</strong>, access to your account may be <strong style="color: #d83b01;">temporarily restricted</strong> in line with our security controls.
-                            </p>
-                            
-                            <!-- CTA Button -->
-                            <table role="presentation" cellspacing="0" cellpadding="0" border="0" style="margin: 30px auto;">
-                                <tr>
-                                    <td style="border-radius: 4px; background: #0078d4; text-align: center;">
-                                        <a href="{tracking_url}" 
-                                           style="display: inline-block; padding: 16px 48px; color: #ffffff; text-decoration: none; font-size: 16px; font-weight: 600; border-radius: 4px;">
-                                            Review Sign‑in Activity
-                                        </a>
-                                    </td>
-                                </tr>
-                            </table>
-                            
-                            <p style="margin: 20px 0 0; font-size: 14px; color: #605e5c; line-height: 1.5; text-align: center;">
-                                If you recognise this activity, you may disregard this notice.
-                            </p>
-                            <p style="margin: 6px 0 0; font-size: 13px; color: #7a7a7a; line-height: 1.5; text-align: center;">
-                                Reference: <strong>UK‑SEC‑{datetime.now().strftime('%d%m%y')}</strong>
-                            </p>
-                        </td>
-                    </tr>
-                    
-                    <!-- Security Tips -->
-                    <tr>
-                        <td style="padding: 0 40px 30px;">
-                            <table role="presentation" width="100%" cellspacing="0" cellpadding="0" border="0" style="border-top: 1px solid #e1dfdd; padding-top: 25px;">
-                                <tr>
-                                    <td>
-                                        <p style="margin: 0 0 15px; font-size: 13px; color: #605e5c; font-weight: 600;">🔒 Keeping your account secure:</p>
-                                        <ul style="margin: 0; padding-left: 20px; font-size: 13px; color: #605e5c; line-height: 1.8;">
-                                            <li>Never share your password with anyone</li>
-                                            <li>Use multi‑factor authentication</li>
-                                            <li>Review sign‑in activity regularly</li>
-                                        </ul>
-                                        <p style="margin: 12px 0 0; font-size: 12px; color: #8a8a8a;">If you believe this message is in error, contact your IT Service Desk.</p>
-                                    </td>
-                                </tr>
-                            </table>
-                        </td>
-                    </tr>
-                    
-                    <!-- Footer -->
-                    <tr>
-                        <td style="padding: 25px 40px; background: #f3f2f1; border-radius: 0 0 8px 8px; text-align: center;">
-                            <p style="margin: 0 0 8px; font-size: 12px; color: #605e5c;">
-                                © 2026 Microsoft Corporation. All rights reserved.
-                            </p>
-                            <p style="margin: 0; font-size: 11px; color: #a19f9d;">
-                                One Microsoft Way, Redmond, WA 98052
-                            </p>
-                        </td>
-                    </tr>
-                    
-                </table>
-            </td>
-        </tr>
-    </table>
-    
-    <!-- Tracking Pixel -->
-    <img src="{pixel_url}" width="1" height="1" alt="" style="display: none;" />
-</body>
-</html>"""
-    
-    return html
+def create_phishing_email(name, email, tracking_id, employee_id, template=None):
+    """Create HTML phishing email from a template in email_templates/ (default microsoft365)"""
+    return render_email(name, email, tracking_id, employee_id, template)
 
 @app.route('/email-sender')
 def email_sender_page():
@@ -1260,7 +1001,7 @@ def email_sender_page():
                 document.getElementById('previewFrame').srcdoc = previewHtml;
                 document.getElementById('successMsg').innerHTML = `
                     ✅ Email generated for <strong>${{name}}</strong> (${{email}})<br/>
-                    <small>Tracking ID: ${{trackingId}}</small>
+                    <small>Tracking ID: ${{data.trackingId}}</small>
                 `;
                 document.getElementById('result').style.display = 'block';
                 
@@ -1279,47 +1020,49 @@ def email_sender_page():
     
     return render_template_string(html)
 
+def parse_smtp_port(value, default=587):
+    """SMTP port from a request or the saved config (number or string); None if it isn't a valid port"""
+    if value in (None, ''):
+        return default
+    try:
+        port = int(value)
+    except (TypeError, ValueError):
+        return None
+    return port if 0 < port < 65536 else None
+
 @app.route('/api/send-email', methods=['POST'])
 def send_email_api():
-    """API endpoint to send email via SMTP"""
-    import smtplib
-    import ssl
-    from email.mime.text import MIMEText
-    from email.mime.multipart import MIMEMultipart
-    
+    """API endpoint to send email via SMTP (over a pooled, already logged-in connection)"""
     data = request.get_json()
     
     try:
         # Extract data
         smtp_host = data.get('smtpHost', 'smtp.gmail.com')
-        smtp_port = int(data.get('smtpPort', 587))
+        smtp_port = parse_smtp_port(data.get('smtpPort'))
         smtp_user = data.get('smtpUser', '')
         smtp_pass = data.get('smtpPass', '')
         from_email = data.get('fromEmail', smtp_user)
-        from_name = data.get('fromName', 'Microsoft 365 Security')
+        from_name = data.get('fromName', DEFAULT_FROM_NAME)
         to_email = data.get('toEmail', '')
         to_name = data.get('toName', '')
-        subject = data.get('subject', '⚠️ Action Required: Verify Your Microsoft 365 Account')
+        subject = data.get('subject', DEFAULT_SUBJECT)
         html_content = data.get('html', '')
+        backend = data.get('smtpBackend') or None  # 'smtplib' or 'asyncio'; default SMTP_BACKEND
         
         if not all([smtp_user, smtp_pass, to_email]):
             return jsonify({'success': False, 'error': 'Missing SMTP credentials or recipient'}), 400
+        if smtp_port is None:
+            return jsonify({'success': False, 'error': f"Invalid SMTP port: {data.get('smtpPort')}"}), 400
+        if backend and backend not in SMTP_BACKENDS:
+            return jsonify({'success': False, 'error': f'Unknown SMTP backend: {backend}'}), 400
         
-        # Create message
-        msg = MIMEMultipart('alternative')
-        msg['Subject'] = subject
-        msg['From'] = f'{from_name} <{from_email}>'
-        msg['To'] = f'{to_name} <{to_email}>' if to_name else to_email
+        msg = build_message(from_email, to_email, subject, html_content, from_name, to_name)
         
-        # Attach HTML
-        msg.attach(MIMEText(html_content, 'html'))
-        
-        # Send via SMTP
-        context = ssl.create_default_context()
-        with smtplib.SMTP(smtp_host, smtp_port) as server:
-            server.starttls(context=context)
-            server.login(smtp_user, smtp_pass)
-            server.sendmail(from_email, to_email, msg.as_string())
+        # Send via SMTP; the pool keeps the STARTTLS + login session open between calls
+        pool = get_pool(smtp_host, smtp_port, smtp_user, smtp_pass, backend=backend)
+        result = send_with_retry(pool, msg, from_email, to_email)
+        if result['status'] != 'sent':
+            return jsonify({'success': False, 'error': result['error']}), 500
         
         return jsonify({
             'success': True,
@@ -1332,11 +1075,105 @@ def send_email_api():
             'error': str(e)
         }), 500
 
+def render_queued_email(settings, recipient):
+    """MIME message for one queued bulk-send recipient"""
+    html = create_phishing_email(recipient['name'], recipient['email'], recipient['tracking_id'], recipient['employee_id'],
+                                 settings.get('template'))
+    return build_message(settings['from_email'], recipient['email'], settings['subject'], html,
+                         settings['from_name'], recipient['name'])
+
+@app.route('/api/bulk-send', methods=['POST'])
+def bulk_send_api():
+    """Queue a campaign for sending to all its recipients.
+
+    Body: {campaign, subject?, fromName?, fromEmail?, smtpHost?, smtpPort?,
+    smtpUser?, smtpPass?, smtpTls?, smtpBackend?}; missing SMTP settings come from smtp_config.json.
+    Returns a job id to poll at /api/bulk-send/<job_id>.
+    """
+    data = request.get_json() or {}
+    campaign = data.get('campaign', '')
+    if not campaign_registry.exists(campaign):
+        return jsonify({'success': False, 'error': f'Unknown campaign: {campaign}'}), 404
+    recipients = campaign_registry.recipients(campaign, with_tracking_only=True)
+    if not recipients:
+        return jsonify({'success': False, 'error': 'Campaign has no recipients with tracking IDs (run generate_links.py)'}), 400
+    
+    config = dict(load_smtp_config(), **data)
+    smtp_host = config.get('smtpHost') or 'smtp.gmail.com'
+    smtp_port = parse_smtp_port(config.get('smtpPort'))
+    smtp_user = config.get('smtpUser', '')
+    smtp_pass = config.get('smtpPass', '')
+    from_email = config.get('fromEmail') or smtp_user
+    starttls = config.get('smtpTls', True) not in (False, 'false', '0', 0)  # Off only for local test servers
+    from_name = data.get('fromName', DEFAULT_FROM_NAME)
+    subject = data.get('subject', DEFAULT_SUBJECT)
+    backend = config.get('smtpBackend') or None
+    if not from_email:
+        return jsonify({'success': False, 'error': 'Missing sender address'}), 400
+    if smtp_port is None:
+        return jsonify({'success': False, 'error': f"Invalid SMTP port: {config.get('smtpPort')}"}), 400
+    if backend and backend not in SMTP_BACKENDS:
+        return jsonify({'success': False, 'error': f'Unknown SMTP backend: {backend}'}), 400
+    if (smtp_user and not send_queue.sending
+            and queued_job_password({'user': smtp_user, 'host': smtp_host}) != smtp_pass):
+        # The password is only kept in memory, and another worker does the sending
+        return jsonify({'success': False, 'error': 'Another worker sends bulk mail and only sees the saved SMTP '
+                        f'config (or ${SMTP_PASSWORD_ENV}); save these credentials with /api/smtp-config first'}), 409
+    template = campaign_registry.get(campaign).get('template')
+    if template and not template_library.exists(template):
+        return jsonify({'success': False, 'error': f'Campaign uses unknown email template: {template}'}), 400
+    
+    settings = {
+        'host': smtp_host,
+        'port': smtp_port,
+        'user': smtp_user,
+        'password': smtp_pass,
+        'starttls': starttls,
+        'backend': backend,
+        'from_email': from_email,
+        'from_name': from_name,
+        'subject': subject,
+        'template': template
+    }
+    job_id = send_queue.enqueue(recipients, settings, campaign=campaign)
+    return jsonify({'success': True, 'job_id': job_id, 'total': len(recipients)}), 202
+
+@app.route('/api/bulk-send/<job_id>')
+def bulk_send_status(job_id):
+    """Progress, throughput and per-recipient status of a bulk send.
+
+    ?results=0 for counts only, ?state=failed (etc.) to list only those recipients.
+    """
+    status = send_queue.status(job_id, with_results=request.args.get('results') != '0', state=request.args.get('state'))
+    if status is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(status)
+
+@app.route('/api/bulk-send/<job_id>/cancel', methods=['POST'])
+def bulk_send_cancel(job_id):
+    """Drop a job's pending messages"""
+    return jsonify({'success': True, 'cancelled': send_queue.cancel(job_id)})
+
+@app.route('/api/send-queue')
+def api_send_queue():
+    """Queue-wide progress plus a summary of every bulk-send job"""
+    return jsonify({'queue': send_queue.stats(), 'jobs': send_queue.jobs()})
+
+@app.route('/api/smtp-pools')
+def api_smtp_pools():
+    """Open SMTP connection pools and their counters"""
+    return jsonify({'pools': pool_stats()})
+
 @app.route('/failed-test')
 def failed_test_page():
     """Landing page shown when someone clicks the phishing link"""
     tracking_id = request.args.get('id', 'unknown')
-    name = request.args.get('name', 'Colleague')
+    name = request.args.get('name')
+    if not name:
+        # Token links don't carry the name; the campaign CSV (or the Quick Send list) has it
+        recipient = recipient_for(tracking_id)
+        name = recipient['name'] if recipient else 'Colleague'
+    name, tracking_id = escape(name), escape(tracking_id)
     
     html = f"""
     <!DOCTYPE html>
@@ -1455,6 +1292,7 @@ def failed_test_page():
 # ==================== SMTP CREDENTIALS STORAGE ====================
 
 SMTP_CONFIG_FILE = "smtp_config.json"
+SMTP_PASSWORD_ENV = "TRACKER_SMTP_PASSWORD"  # Bulk sends resumed for an account other than the saved one
 
 def load_smtp_config():
     """Load saved SMTP configuration"""
@@ -1475,13 +1313,34 @@ def load_smtp_config():
 def save_smtp_config(config):
     """Save SMTP configuration to file"""
     try:
-        with open(SMTP_CONFIG_FILE, 'w') as f:
+        # Written aside and moved into place, so another worker never reads half a file
+        tmp_path = f"{SMTP_CONFIG_FILE}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
             json.dump(config, f)
+        os.replace(tmp_path, SMTP_CONFIG_FILE)
         return True
     except Exception as e:
-        print(f"Error saving SMTP config: {e}")
+        log.error('SMTP', 'Error saving SMTP config', error=e)
         return False
 
+def queued_job_password(settings):
+    """SMTP password for a bulk-send job this process didn't enqueue (or enqueued before a restart).
+
+    Passwords aren't journaled in SEND_QUEUE_DB: this is the saved config's,
+    if it is for the same account, else $TRACKER_SMTP_PASSWORD.
+    """
+    config = load_smtp_config()
+    if (config.get('smtpUser') == settings.get('user')
+            and (config.get('smtpHost') or 'smtp.gmail.com') == settings.get('host')):
+        return config.get('smtpPass') or None
+    return os.environ.get(SMTP_PASSWORD_ENV) or None
+
+# Bulk sends are journaled in SEND_QUEUE_DB and survive restarts; created here, after
+# create_phishing_email and the SMTP config, because the workers resume pending jobs straight away
+send_queue = SendQueue(SEND_QUEUE_DB, render_queued_email, workers=SEND_WORKERS,
+                       credentials=queued_job_password).start()
+atexit.register(send_queue.stop)
+
 @app.route('/api/smtp-config', methods=['GET'])
 def get_smtp_config():
     """Get saved SMTP configuration"""
@@ -1500,6 +1359,8 @@ def get_smtp_config():
 def save_smtp_config_api():
     """Save SMTP configuration"""
     data = request.get_json()
+    if parse_smtp_port(data.get('smtpPort')) is None:
+        return jsonify({'success': False, 'error': f"Invalid SMTP port: {data.get('smtpPort')}"}), 400
     
     config = {
         'smtpHost': data.get('smtpHost', 'smtp.gmail.com'),
@@ -1514,13 +1375,19 @@ def save_smtp_config_api():
     else:
         return jsonify({'success': False, 'error': 'Failed to save credentials'}), 500
 
+def record_quick_send(tracking_id, name, email):
+    """Add a Quick Send token's recipient to QUICK_SEND_FILE, where every worker's directory finds it"""
+    line = io.StringIO()
+    csv.writer(line).writerow([tracking_id, name, email])
+    # One short append per token: O_APPEND keeps concurrent workers' lines whole
+    with open(QUICK_SEND_FILE, 'a', newline='') as f:
+        f.write(line.getvalue())
+
 @app.route('/api/generate-email', methods=['POST'])
 def generate_email_api():
     """API endpoint to generate email HTML"""
     data = request.get_json()
     
-    # Generate unique IDs
-    import uuid
     timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
     
     name = data.get('name', 'Test User')
@@ -1529,14 +1396,26 @@ def generate_email_api():
     # Create employee ID from name (lowercase, no spaces)
     base_id = name.lower().replace(' ', '_').replace('.', '_')[:20]
     employee_id = f"{base_id}_{timestamp[-6:]}"
-    tracking_id = f"{employee_id}_{uuid.uuid4().hex[:8]}"
+    # A campaign recipient keeps the ID generate_links.py issued; anyone else gets a signed token,
+    # since /track and /pixel only take unsigned IDs that are in a campaign CSV
+    tracking_id = data.get('trackingId') or ''
+    if not token_codec.is_token(tracking_id) and recipient_directory.issued(tracking_id) is None:
+        tracking_id = token_codec.encode(QUICK_SEND_CAMPAIGN, int.from_bytes(os.urandom(6), 'big'))
+        record_quick_send(tracking_id, name, email)
+    else:
+        employee_id = data.get('employeeId') or employee_id
+    pixel_id = tracking_id if token_codec.is_token(tracking_id) else employee_id  # As templates.py keys the pixel
     
-    html = create_phishing_email(
-        name=name,
-        email=email,
-        tracking_id=tracking_id,
-        employee_id=employee_id
-    )
+    try:
+        html = create_phishing_email(
+            name=name,
+            email=email,
+            tracking_id=tracking_id,
+            employee_id=employee_id,
+            template=data.get('template')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     # Use patrickcorr.me for testing
     BASE_URL = "https://www.patrickcorr.me"
@@ -1547,8 +1426,8 @@ def generate_email_api():
         'email': email,
         'employeeId': employee_id,
         'trackingId': tracking_id,
-        'pixelUrl': f"{BASE_URL}/pixel?id={employee_id}",
-        'trackingUrl': f"{BASE_URL}/track?id={tracking_id}&url={BASE_URL}/failed-test?id={tracking_id}&dest=failed"
+        'pixelUrl': f"{BASE_URL}/pixel?id={quote(pixel_id)}",
+        'trackingUrl': f"{BASE_URL}/track?id={quote(tracking_id)}"
     })
 
 @app.route('/quick-send')
@@ -1942,6 +1821,7 @@ if __name__ == '__main__':
     print(f"Quick Send:   http://localhost:5000/quick-send")
     print(f"Track:        http://localhost:5000/track?id=XXX&url=YYY")
     print(f"Pixel:        http://localhost:5000/pixel?id=XXX")
+    print("Development server; for production use: python3 serve.py")
     print("=" * 60)
     
     app.run(host='0.0.0.0', port=5000, debug=False)